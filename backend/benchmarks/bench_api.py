@@ -0,0 +1,364 @@
+"""Нагрузочные замеры всех маршрутов API и функций sql.py на корпусах заметок разного размера.
+
+Каждый корпус создаётся заново во временной базе с фиксированным seed,
+маршруты вызываются внутри процесса через ASGI-транспорт httpx (без сети),
+функции sql.py - в синхронной сессии. Для каждого замера сохраняются
+p50/p95/p99 и операций в секунду. Замеры маршрута делятся на --rounds серий;
+p50_min_ms - наименьшая из медиан серий: кратковременные помехи (сборка
+мусора, fsync соседнего процесса) сдвигают её меньше, чем медиану всех
+замеров, поэтому по ней по умолчанию и ищутся регрессии.
+
+Не замеряются /events (бесконечный поток: ASGI-транспорт httpx ждёт конца
+тела ответа) и /metrics (метрики выключены, NOTES_METRICS=0, чтобы их
+middleware не входил в замеры остальных маршрутов).
+
+Запуск из каталога backend:
+    python benchmarks/bench_api.py --sizes 1000 10000 --output bench.json
+    python benchmarks/bench_api.py --sizes 1000 10000 --baseline bench.json --threshold 0.25
+
+С --baseline код выхода 1, если какой-либо замер медленнее базового
+больше чем на threshold и на --min-delta-ms (по метрике --metric).
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import math
+import os
+import platform
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy import func, select
+
+from models.models import NoteBase
+
+WORDS = (
+    "заметка список встреча проект задача идея покупки отчёт звонок письмо бюджет план "
+    "релиз сервер база запрос индекс кэш клиент дизайн макет срок команда договор счёт "
+    "отпуск поездка книга фильм рецепт тренировка врач ремонт квартира машина подарок"
+).split()
+DEFAULT_SIZES = (1000, 10000)
+METRICS = ("p50_min_ms", "p50_ms", "p95_ms", "p99_ms", "mean_ms")
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    # Метод ближайшего ранга: значение, не превышенное в p% замеров
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(timings: List[float], rounds: int = 1) -> dict:
+    ordered = sorted(timings)
+    total = sum(ordered)
+    size = max(1, math.ceil(len(timings) / rounds))
+    round_medians = [percentile(sorted(timings[start:start + size]), 50) for start in range(0, len(timings), size)]
+    return {
+        "count": len(ordered),
+        "p50_min_ms": round(min(round_medians, default=0.0) * 1000, 4),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 4),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 4),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 4),
+        "mean_ms": round(total / len(ordered) * 1000, 4),
+        "ops_per_sec": round(len(ordered) / total, 1) if total else 0.0,
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float,
+            metric: str = "p50_min_ms", min_delta_ms: float = 0.5) -> List[tuple]:
+    """Замеры медленнее базовых больше чем на threshold: (имя, было, стало, отношение).
+
+    Разница меньше min_delta_ms не считается регрессией: у операций короче
+    пары миллисекунд разброс между запусками доходит до десятых долей
+    миллисекунды, больше любого порога в процентах.
+    """
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None or not base.get(metric):
+            continue
+        before, after = base[metric], current[metric]
+        if after > before * (1 + threshold) and after - before >= min_delta_ms:
+            regressions.append((name, before, after, round(after / before, 2)))
+    return regressions
+
+
+def make_corpus(count: int, seed: int, start_id: int = 0) -> List[dict]:
+    """Заметки с длиной текста по логнормальному закону: медиана ~400 символов, хвост до 10000."""
+    rng = random.Random(seed * 1_000_003 + start_id)
+    started = datetime(2024, 1, 1)
+    notes = []
+    for i in range(count):
+        words = max(1, min(1400, int(rng.lognormvariate(4.1, 1.1))))
+        text = " ".join(rng.choice(WORDS) for _ in range(words))[:10000]
+        headline = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).capitalize()[:45]
+        created = started + timedelta(minutes=17 * (start_id + i))
+        notes.append({
+            "headline": headline,
+            "text": text,
+            "improtance": rng.randint(1, 3),
+            "created_date": created,
+            "change_date": created + timedelta(days=rng.randint(1, 30)) if rng.random() < 0.3 else None,
+        })
+    return notes
+
+
+@dataclass
+class Case:
+    name: str
+    # Выполняется для каждого аргумента из prepare; время подготовки не учитывается
+    run: Callable[[Any], Any]
+    prepare: Optional[Callable[[int], Any]] = None
+
+
+async def call(result):
+    if inspect.isawaitable(result):
+        result = await result
+    status = getattr(result, "status_code", None)
+    if status is not None and status >= 400:
+        raise RuntimeError(f"HTTP {status}: {result.text[:200]}")
+    return result
+
+
+async def measure(case: Case, requests: int, warmup: int, rounds: int = 1) -> dict:
+    total = requests + warmup
+    args = [None] * total
+    if case.prepare is not None:
+        args = await call(case.prepare(total))
+    timings = []
+    for index, arg in enumerate(args):
+        started = time.perf_counter()
+        await call(case.run(arg))
+        if index >= warmup:
+            timings.append(time.perf_counter() - started)
+    return summarize(timings, rounds)
+
+
+def seed_database(sql, database, count: int, seed: int, existing: int) -> None:
+    # Корпус растёт от меньшего размера к большему: уже вставленные заметки остаются
+    with database.Session() as session:
+        for offset in range(existing, count, 1000):
+            chunk = make_corpus(min(1000, count - offset), seed, offset)
+            sql.apply_notes_batch([("create", None, note) for note in chunk], session)
+            session.commit()
+        # Около 5% заметок в корзине
+        live = session.scalars(select(NoteBase.id).where(sql.LIVE)).all()
+        rng = random.Random(seed + count)
+        target = count // 20 - session.scalar(select(func.count()).select_from(NoteBase).where(sql.TRASHED))
+        if target > 0:
+            trashed = rng.sample(live, target)
+            sql.apply_notes_batch([("trash", id, None) for id in trashed], session)
+            session.commit()
+
+
+def build_cases(client, sql, database, ids: List[int], seed: int) -> List[Case]:
+    rng = random.Random(seed)
+    pick = lambda: rng.choice(ids)  # noqa: E731
+    word = lambda: rng.choice(WORDS)  # noqa: E731
+
+    async def create_notes(count: int) -> List[int]:
+        created = []
+        for offset in range(0, count, 500):
+            operations = [{"op": "create", "note": {"headline": f"Бенчмарк {i}", "text": word()}}
+                          for i in range(min(500, count - offset))]
+            response = await call(client.post("/notes/batch", json={"operations": operations}))
+            created.extend(item["result_id"] for item in response.json()["results"])
+        return created
+
+    async def trashed_notes(count: int) -> List[int]:
+        created = await create_notes(count)
+        await call(client.post("/notes/batch", json={"operations": [{"op": "trash", "id": id} for id in created]}))
+        return created
+
+    async def cursors(count: int) -> List[str]:
+        # Курсор второй страницы: keyset-пагинация не читает пропущенные строки
+        page = await call(client.get("/notes/", params={"limit": 200, "view": "summary"}))
+        cursor = page.headers.get("X-Next-Cursor")
+        return [cursor] * count
+
+    async def change_seqs(count: int) -> List[int]:
+        # Клиент, отставший на 20 изменений; транзакции заполнения корпуса
+        # меняют тысячи заметок каждая и в это окно не попадают
+        for _ in range(20):
+            await call(client.put(f"/notes/{pick()}", json={"improtance": rng.randint(1, 3)}))
+        seq = (await call(client.get("/notes/changes", params={"since": 0}))).json()["seq"]
+        return [seq - 20] * count
+
+    async def drafts(count: int) -> List[str]:
+        await call(client.put("/drafts/bench-read", json={"headline": "Черновик", "text": word() * 40}))
+        return ["bench-read"] * count
+
+    async def asset_urls(count: int) -> List[str]:
+        html = (await call(client.get("/"))).text
+        return [re.search(r'"(/static/script\.[0-9a-f]+\.js)"', html).group(1)] * count
+
+    async def export(_):
+        # Постановка задачи и опрос до готового файла: время ответа - до файла
+        ids = [pick() for _ in range(50)]
+        job = (await call(client.post("/exports", json={"format": "zip", "ids": ids}))).json()
+        while True:
+            response = await call(client.get(f"/exports/{job['id']}"))
+            if response.status_code != 202:
+                return response
+            await asyncio.sleep(0.001)
+
+    def sync_session(fn):
+        def run(arg):
+            with database.Session() as session:
+                result = fn(session, arg)
+                session.commit()
+                return result
+        return run
+
+    return [
+        Case("GET /notes/?limit=50", lambda _: client.get("/notes/", params={"limit": 50})),
+        Case("GET /notes/?limit=200&view=summary",
+             lambda _: client.get("/notes/", params={"limit": 200, "view": "summary"})),
+        Case("GET /notes/?sort=headline&limit=50",
+             lambda _: client.get("/notes/", params={"sort": "headline", "order": "asc", "limit": 50})),
+        Case("GET /notes/?importance=3&limit=50",
+             lambda _: client.get("/notes/", params={"importance": 3, "limit": 50})),
+        Case("GET /notes/?after=<cursor>", lambda cursor: client.get(
+            "/notes/", params={"limit": 200, "view": "summary", "after": cursor}), cursors),
+        Case("GET /notes/{id}", lambda _: client.get(f"/notes/{pick()}")),
+        Case("GET /notes/search", lambda _: client.get("/notes/search", params={"q": word(), "limit": 20})),
+        Case("GET /notes/changes", lambda since: client.get("/notes/changes", params={"since": since}), change_seqs),
+        Case("GET /trash/?limit=50", lambda _: client.get("/trash/", params={"limit": 50})),
+        Case("GET /trash/", lambda _: client.get("/trash/")),
+        Case("POST /notes/", lambda _: client.post("/notes/", json={"headline": "Новая", "text": word() * 40})),
+        Case("PUT /notes/{id}", lambda _: client.put(f"/notes/{pick()}", json={"text": word() * 40})),
+        Case("POST /notes/{id}/trash", lambda id: client.post(f"/notes/{id}/trash"), create_notes),
+        Case("POST /trash/{id}/restore", lambda id: client.post(f"/trash/{id}/restore"), trashed_notes),
+        Case("DELETE /notes/{id}", lambda id: client.delete(f"/notes/{id}"), create_notes),
+        Case("DELETE /trash/{id}", lambda id: client.delete(f"/trash/{id}"), trashed_notes),
+        Case("POST /notes/batch (50)", lambda _: client.post("/notes/batch", json={"operations": [
+            {"op": "update", "id": pick(), "note": {"improtance": 2}} for _ in range(50)
+        ]})),
+        Case("GET /notes/export?format=json (50)", lambda _: client.get(
+            "/notes/export", params={"format": "json", "ids": ",".join(str(pick()) for _ in range(50))})),
+        Case("POST /exports + GET /exports/{id} (50)", export),
+        Case("PUT /drafts/{key}", lambda _: client.put("/drafts/bench", json={"text": word()})),
+        Case("GET /drafts/{key}", lambda key: client.get(f"/drafts/{key}"), drafts),
+        Case("GET /", lambda _: client.get("/", headers={"Accept-Encoding": "gzip"})),
+        Case("GET /static/{asset}", lambda url: client.get(url, headers={"Accept-Encoding": "gzip"}), asset_urls),
+        Case("sql.get_notes_page", sync_session(lambda s, _: sql.get_notes_page(s, limit=50))),
+        Case("sql.get_note_by_id", sync_session(lambda s, _: sql.get_note_by_id(pick(), s))),
+        Case("sql.search_notes", sync_session(lambda s, _: sql.search_notes(s, word(), limit=20))),
+        Case("sql.change_note", sync_session(lambda s, _: sql.change_note(pick(), s, {"text": word()}))),
+        Case("sql.move_to_trash", sync_session(lambda s, id: sql.move_to_trash(id, s)), create_notes),
+        Case("sql.get_changes", sync_session(lambda s, since: sql.get_changes(s, since)), change_seqs),
+    ]
+
+
+async def run_size(app, sql, size: int, args) -> Dict[str, dict]:
+    import httpx
+
+    database = app.state.database
+    with database.Session() as session:
+        ids = session.scalars(select(NoteBase.id).where(sql.LIVE)).all()
+    transport = httpx.ASGITransport(app=app)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for case in build_cases(client, sql, database, ids, args.seed):
+            if args.only and not re.search(args.only, case.name):
+                continue
+            result = await measure(case, args.requests, args.warmup, args.rounds)
+            results[f"{size}/{case.name}"] = result
+            print(f"{size:>7} {case.name:<40} p50 {result['p50_ms']:8.3f}  p95 {result['p95_ms']:8.3f}"
+                  f"  p99 {result['p99_ms']:8.3f} мс  {result['ops_per_sec']:9.1f} оп/с", flush=True)
+    # Черновики из буфера записываются так же, как при остановке приложения
+    await app.state.draft_buffer.flush()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="размеры корпусов, например 1000 10000 100000")
+    parser.add_argument("--requests", type=int, default=500, help="замеров на маршрут")
+    parser.add_argument("--rounds", type=int, default=5, help="серий замеров для p50_min_ms")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", help="регулярное выражение для имён замеров")
+    parser.add_argument("--cache", action="store_true", help="включить кэш чтений (по умолчанию выключен)")
+    parser.add_argument("--profile", default="durable", help="профиль хранилища NOTES_DB_PROFILE")
+    parser.add_argument("--output", help="файл JSON для результатов")
+    parser.add_argument("--baseline", help="файл JSON с базовыми результатами для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.25, help="допустимое замедление, доля")
+    parser.add_argument("--metric", choices=METRICS, default="p50_min_ms")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5)
+    args = parser.parse_args()
+
+    # Настройки читаются при создании приложения, поэтому окружение задаётся до него
+    workdir = tempfile.mkdtemp(prefix="notes-bench-")
+    os.environ["NOTES_DB_DATABASE"] = os.path.join(workdir, "bench.db")
+    os.environ["NOTES_DB_PROFILE"] = args.profile
+    os.environ["NOTES_METRICS"] = "0"
+    if not args.cache:
+        os.environ["NOTES_CACHE_SIZE"] = "0"
+    import main as app_main
+    import sql
+    app = app_main.create_app()
+    app.state.export_jobs.spool_dir = os.path.join(workdir, "exports")
+    app.state.database.ensure_schemas()
+
+    meta = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "sizes": sorted(args.sizes),
+        "requests": args.requests,
+        "rounds": args.rounds,
+        "seed": args.seed,
+        "cache": args.cache,
+        "profile": args.profile,
+    }
+    results: Dict[str, dict] = {}
+    existing = 0
+    try:
+        for size in sorted(args.sizes):
+            started = time.perf_counter()
+            seed_database(sql, app.state.database, size, args.seed, existing)
+            existing = size
+            print(f"Корпус {size} заметок создан за {time.perf_counter() - started:.1f} с", flush=True)
+            results.update(asyncio.run(run_size(app, sql, size, args)))
+    finally:
+        app.state.database.engine.dispose()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"meta": meta, "results": results}, file, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        for key in ("sizes", "requests", "rounds", "cache", "profile"):
+            if baseline["meta"].get(key) != meta[key]:
+                print(f"Внимание: {key} отличается от базового запуска: "
+                      f"{baseline['meta'].get(key)!r} и {meta[key]!r}")
+        regressions = compare(results, baseline["results"], args.threshold, args.metric, args.min_delta_ms)
+        for name, before, after, ratio in regressions:
+            print(f"РЕГРЕССИЯ {name}: {args.metric} {before:.3f} -> {after:.3f} мс (x{ratio})")
+        if regressions:
+            sys.exit(1)
+        print(f"Регрессий нет (порог {args.threshold:.0%} по {args.metric})")
+
+
+if __name__ == "__main__":
+    main()
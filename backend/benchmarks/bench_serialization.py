@@ -0,0 +1,95 @@
+"""Сравнение сериализации списка заметок: модели pydantic + json против быстрого пути.
+
+Запуск из каталога backend:
+    python benchmarks/bench_serialization.py --notes 1000 --text-size 10240
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pydantic import TypeAdapter
+
+import serialization
+from main import NoteResponse
+from models.models import NoteBase
+from serialization import project, encode_json, NOTE_FIELDS, GZIP_LEVEL
+
+
+def make_notes(count: int, text_size: int) -> List[NoteBase]:
+    started = datetime(2024, 1, 1)
+    text = ("Текст заметки " * (text_size // 14 + 1))[:text_size]
+    return [
+        NoteBase(id=i, headline=f"Заметка {i}", text=text, improtance=i % 3 + 1,
+                 created_date=started + timedelta(minutes=i), change_date=None)
+        for i in range(1, count + 1)
+    ]
+
+
+def models_path(notes: List[NoteBase]) -> bytes:
+    # Как FastAPI с response_model: проверка каждой строки моделью, затем json.dumps
+    adapter = TypeAdapter(List[NoteResponse])
+    content = adapter.dump_python(adapter.validate_python(notes), mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def stdlib_path(notes: List[NoteBase]) -> bytes:
+    orjson, serialization.orjson = serialization.orjson, None
+    try:
+        return encode_json(project(notes, NOTE_FIELDS))
+    finally:
+        serialization.orjson = orjson
+
+
+def fast_path(notes: List[NoteBase]) -> bytes:
+    return encode_json(project(notes, NOTE_FIELDS))
+
+
+def measure(fn: Callable[[], bytes], repeat: int) -> tuple:
+    body = fn()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--notes", type=int, default=1000)
+    parser.add_argument("--text-size", type=int, default=10240)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    notes = make_notes(args.notes, args.text_size)
+    per_thousand = 1000 / args.notes
+    cases = [
+        ("pydantic + json (было)", lambda: models_path(notes)),
+        ("строки + json", lambda: stdlib_path(notes)),
+    ]
+    if serialization.orjson is not None:
+        cases.append(("строки + orjson", lambda: fast_path(notes)))
+    if serialization.msgpack is not None:
+        cases.append(("строки + msgpack", lambda: serialization.encode_msgpack(project(notes, NOTE_FIELDS))))
+    body = fast_path(notes)
+    cases.append((f"gzip уровня {GZIP_LEVEL}", lambda: gzip.compress(body, compresslevel=GZIP_LEVEL)))
+
+    print(f"{args.notes} заметок по {args.text_size} байт, лучший из {args.repeat} запусков")
+    baseline = None
+    for name, fn in cases:
+        seconds, result = measure(fn, args.repeat)
+        baseline = baseline or seconds
+        print(f"{name:<26} {seconds * 1000 * per_thousand:9.2f} мс / 1000 заметок"
+              f"  {len(result) / 1024:9.0f} КиБ  x{baseline / seconds:5.1f}")
+
+
+if __name__ == "__main__":
+    main()
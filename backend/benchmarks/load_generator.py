@@ -0,0 +1,540 @@
+"""Генератор нагрузки: смешанный поток запросов к приложению с заданной интенсивностью.
+
+Модель открытая: запросы отправляются по расписанию (пуассоновскому или
+равномерному) с частотой rate, не дожидаясь ответов на предыдущие. Их
+выполняют users виртуальных пользователей; если все заняты, запрос ждёт в
+очереди, и это ожидание входит в задержку - она считается от
+запланированного времени отправки, а не от фактического. Профили нагрузки
+описаны в workloads.toml.
+
+По умолчанию приложение запускается в отдельном процессе uvicorn на
+временной базе с корпусом заметок; --url направляет нагрузку на уже
+запущенный сервер, --in-process вызывает приложение через ASGI-транспорт
+httpx в том же процессе (без uvicorn, но генератор и приложение делят
+один цикл событий).
+
+Запуск из каталога backend:
+    python benchmarks/load_generator.py --workload read_heavy
+    python benchmarks/load_generator.py --workload write_heavy --rate 300 --users 50 --workers 2
+    python benchmarks/load_generator.py --workload write_heavy --shards 4
+    python benchmarks/load_generator.py --workload smoke --url http://127.0.0.1:8000
+    python benchmarks/load_generator.py --list
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tomllib
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from dataclasses import asdict, dataclass, field, fields, replace
+from typing import Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.bench_api import WORDS, percentile, seed_database
+from metrics import LATENCY_BUCKETS
+
+DEFAULT_CONFIG = os.path.join(BACKEND_DIR, "benchmarks", "workloads.toml")
+OPERATIONS = ("list", "list_summary", "read", "search", "changes", "create", "update", "trash", "restore", "draft")
+ARRIVALS = ("poisson", "uniform")
+LOCKED_MESSAGE = "database is locked"
+
+
+@dataclass(frozen=True)
+class Workload:
+    name: str
+    # Веса операций из OPERATIONS
+    mix: Dict[str, float] = field(default_factory=dict)
+    rate: float = 100
+    users: int = 10
+    duration: float = 30
+    corpus: int = 10000
+    arrivals: str = "poisson"
+    description: str = ""
+
+
+def validate_workload(workload: Workload) -> Workload:
+    if workload.rate <= 0:
+        raise ValueError(f"{workload.name}: rate должен быть больше нуля")
+    if workload.users < 1:
+        raise ValueError(f"{workload.name}: нужен хотя бы один пользователь")
+    if workload.duration <= 0:
+        raise ValueError(f"{workload.name}: duration должен быть больше нуля")
+    if workload.corpus < 0:
+        raise ValueError(f"{workload.name}: corpus не может быть отрицательным")
+    if workload.arrivals not in ARRIVALS:
+        raise ValueError(f"{workload.name}: недопустимое значение arrivals: {workload.arrivals}")
+    unknown = set(workload.mix) - set(OPERATIONS)
+    if unknown:
+        raise ValueError(f"{workload.name}: неизвестные операции: {', '.join(sorted(unknown))}")
+    if any(weight < 0 for weight in workload.mix.values()) or sum(workload.mix.values()) <= 0:
+        raise ValueError(f"{workload.name}: веса операций должны быть неотрицательными и не все нулевыми")
+    return workload
+
+
+def load_workloads(path: str = DEFAULT_CONFIG) -> Dict[str, Workload]:
+    with open(path, "rb") as file:
+        config = tomllib.load(file)
+    allowed = {item.name for item in fields(Workload)} - {"name"}
+    workloads = {}
+    for name, values in config.get("workloads", {}).items():
+        unknown = set(values) - allowed
+        if unknown:
+            raise ValueError(f"{name}: неизвестные параметры профиля: {', '.join(sorted(unknown))}")
+        workloads[name] = validate_workload(Workload(name=name, **values))
+    return workloads
+
+
+def arrival_times(workload: Workload, rng: random.Random) -> List[float]:
+    """Моменты отправки запросов в секундах от начала прогона."""
+    if workload.arrivals == "uniform":
+        count = int(workload.duration * workload.rate)
+        return [i / workload.rate for i in range(count)]
+    times, moment = [], rng.expovariate(workload.rate)
+    while moment < workload.duration:
+        times.append(moment)
+        moment += rng.expovariate(workload.rate)
+    return times
+
+
+def choose_operations(workload: Workload, count: int, rng: random.Random) -> List[str]:
+    names = [name for name, weight in workload.mix.items() if weight > 0]
+    return rng.choices(names, weights=[workload.mix[name] for name in names], k=count)
+
+
+class Report:
+    """Задержки, ошибки и пропускная способность прогона."""
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        # Задержка от запланированного времени и время самого запроса, в секундах
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.service: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.skipped: Counter = Counter()
+        self.locked = 0
+        self.server_locked = 0
+        self.max_backlog = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.timeline: Dict[int, list] = defaultdict(lambda: [0, 0, []])
+        self.elapsed = 0.0
+
+    def record(self, operation: str, finished: float, latency: float, service: float,
+               error: Optional[str] = None, locked: bool = False) -> None:
+        self.latencies[operation].append(latency)
+        self.service[operation].append(service)
+        self.histogram[bisect_left(LATENCY_BUCKETS, latency)] += 1
+        slot = self.timeline[int(finished // self.interval)]
+        slot[0] += 1
+        slot[2].append(latency)
+        if error is not None:
+            self.errors[error] += 1
+            slot[1] += 1
+        if locked:
+            self.locked += 1
+
+    def summary(self) -> dict:
+        completed = sum(len(values) for values in self.latencies.values())
+        errors = sum(self.errors.values())
+        operations = {}
+        for name in sorted(self.latencies):
+            latencies, service = sorted(self.latencies[name]), sorted(self.service[name])
+            operations[name] = {
+                "count": len(latencies),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+                "max_ms": round(latencies[-1] * 1000, 3),
+                "service_p95_ms": round(percentile(service, 95) * 1000, 3),
+            }
+        everything = sorted(value for values in self.latencies.values() for value in values)
+        timeline = []
+        for slot in range(max(self.timeline, default=-1) + 1):
+            done, failed, latencies = self.timeline.get(slot, (0, 0, []))
+            timeline.append({
+                "t": round(slot * self.interval, 3),
+                "rps": round(done / self.interval, 1),
+                "errors": failed,
+                "p95_ms": round(percentile(sorted(latencies), 95) * 1000, 3),
+            })
+        bounds = [round(bound * 1000, 3) for bound in LATENCY_BUCKETS] + ["+Inf"]
+        return {
+            "completed": completed,
+            "elapsed_s": round(self.elapsed, 3),
+            "throughput_rps": round(completed / self.elapsed, 1) if self.elapsed else 0.0,
+            "errors": errors,
+            "error_rate": round(errors / completed, 4) if completed else 0.0,
+            "errors_by_kind": dict(self.errors.most_common()),
+            "skipped": dict(self.skipped),
+            "database_locked": self.locked,
+            "database_locked_in_server_log": self.server_locked,
+            "max_backlog": self.max_backlog,
+            "p50_ms": round(percentile(everything, 50) * 1000, 3),
+            "p95_ms": round(percentile(everything, 95) * 1000, 3),
+            "p99_ms": round(percentile(everything, 99) * 1000, 3),
+            "operations": operations,
+            "histogram": [[bound, count] for bound, count in zip(bounds, self.histogram)],
+            "timeline": timeline,
+        }
+
+
+class Traffic:
+    """Операции виртуальных пользователей и общие для них id живых и удалённых заметок."""
+
+    def __init__(self, client, rng: random.Random, users: int):
+        self.client = client
+        self.rng = rng
+        self.users = users
+        self.ids: List[int] = []
+        self.trashed: List[int] = []
+        self.seq = 0
+
+    async def prime(self) -> None:
+        params = {"limit": 500, "view": "summary"}
+        while len(self.ids) < 100000:
+            response = await self.client.get("/notes/", params=params)
+            response.raise_for_status()
+            self.ids.extend(note["id"] for note in response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+            params["after"] = cursor
+        response = await self.client.get("/trash/", params={"limit": 500})
+        response.raise_for_status()
+        self.trashed = [note["id"] for note in response.json()]
+        response = await self.client.get("/notes/changes", params={"since": 0})
+        response.raise_for_status()
+        self.seq = response.json()["seq"]
+
+    def _take(self, pool: List[int]) -> Optional[int]:
+        # Заметка сразу убирается из пула, чтобы другие пользователи не
+        # удаляли и не восстанавливали её одновременно
+        if not pool:
+            return None
+        index = self.rng.randrange(len(pool))
+        pool[index], pool[-1] = pool[-1], pool[index]
+        return pool.pop()
+
+    def _text(self, words: int) -> str:
+        return " ".join(self.rng.choice(WORDS) for _ in range(words))
+
+    async def list(self):
+        return await self.client.get("/notes/", params={"limit": 50})
+
+    async def list_summary(self):
+        return await self.client.get("/notes/", params={"limit": 200, "view": "summary"})
+
+    async def read(self):
+        if not self.ids:
+            return None
+        return await self.client.get(f"/notes/{self.rng.choice(self.ids)}")
+
+    async def search(self):
+        return await self.client.get("/notes/search", params={"q": self.rng.choice(WORDS), "limit": 20})
+
+    async def changes(self):
+        # Клиент, который опрашивает изменения с последнего известного номера
+        response = await self.client.get("/notes/changes", params={"since": self.seq})
+        if response.status_code == 200:
+            self.seq = max(self.seq, response.json()["seq"])
+        return response
+
+    async def create(self):
+        response = await self.client.post("/notes/", json={
+            "headline": self._text(2).capitalize(), "text": self._text(self.rng.randint(5, 150)),
+            "improtance": self.rng.randint(1, 3),
+        })
+        if response.status_code == 201:
+            self.ids.append(response.json()["id"])
+        return response
+
+    async def update(self):
+        if not self.ids:
+            return None
+        return await self.client.put(f"/notes/{self.rng.choice(self.ids)}",
+                                     json={"text": self._text(self.rng.randint(5, 150))})
+
+    async def trash(self):
+        id = self._take(self.ids)
+        if id is None:
+            return None
+        response = await self.client.post(f"/notes/{id}/trash")
+        (self.trashed if response.status_code == 200 else self.ids).append(id)
+        return response
+
+    async def restore(self):
+        id = self._take(self.trashed)
+        if id is None:
+            return None
+        response = await self.client.post(f"/trash/{id}/restore")
+        if response.status_code == 200:
+            self.ids.append(response.json()["id"])
+        else:
+            self.trashed.append(id)
+        return response
+
+    async def draft(self):
+        # Каждый пользователь редактирует один из двух своих черновиков
+        key = f"load-{self.rng.randrange(self.users * 2)}"
+        return await self.client.put(f"/drafts/{key}", json={"text": self._text(self.rng.randint(5, 150))})
+
+
+async def run_load(client, workload: Workload, seed: int = 1, interval: float = 1.0,
+                   timeout: float = 30.0, report: Optional[Report] = None) -> Report:
+    import httpx
+
+    rng = random.Random(seed)
+    report = report or Report(interval)
+    traffic = Traffic(client, rng, workload.users)
+    await traffic.prime()
+    offsets = arrival_times(workload, rng)
+    schedule = list(zip(offsets, choose_operations(workload, len(offsets), rng)))
+    queue: asyncio.Queue = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def user():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            offset, operation = item
+            began = loop.time()
+            error, locked = None, False
+            try:
+                response = await asyncio.wait_for(getattr(traffic, operation)(), timeout)
+                if response is None:
+                    report.skipped[operation] += 1
+                    continue
+                if response.status_code >= 400:
+                    error = f"HTTP {response.status_code}"
+                    locked = LOCKED_MESSAGE in response.text
+            except asyncio.TimeoutError:
+                error = "timeout"
+            except httpx.TransportError as exc:
+                error = type(exc).__name__
+            except Exception as exc:
+                # Транспорт ASGI пробрасывает исключения приложения как есть
+                error = type(exc).__name__
+                locked = LOCKED_MESSAGE in str(exc)
+            finished = loop.time()
+            report.record(operation, finished - start, finished - start - offset, finished - began, error, locked)
+
+    users = [asyncio.create_task(user()) for _ in range(workload.users)]
+    for offset, operation in schedule:
+        delay = start + offset - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        queue.put_nowait((offset, operation))
+        report.max_backlog = max(report.max_backlog, queue.qsize())
+    for _ in users:
+        queue.put_nowait(None)
+    await asyncio.gather(*users)
+    report.elapsed = loop.time() - start
+    return report
+
+
+def print_report(workload: Workload, result: dict) -> None:
+    print(f"\nПрофиль {workload.name}: {workload.rate:g} запросов/с, {workload.users} пользователей, "
+          f"{workload.duration:g} с, {workload.arrivals}")
+    print(f"Выполнено {result['completed']} запросов за {result['elapsed_s']:.1f} с: "
+          f"{result['throughput_rps']} запросов/с")
+    print(f"Задержка p50 {result['p50_ms']:.2f}  p95 {result['p95_ms']:.2f}  p99 {result['p99_ms']:.2f} мс")
+    kinds = ", ".join(f"{kind} - {count}" for kind, count in result["errors_by_kind"].items())
+    print(f"Ошибки: {result['errors']} ({result['error_rate']:.2%}){': ' + kinds if kinds else ''}")
+    print(f"database is locked: {result['database_locked']} в ответах, "
+          f"{result['database_locked_in_server_log']} в журнале сервера")
+    if result["skipped"]:
+        print("Пропущено (нет подходящих заметок): "
+              + ", ".join(f"{name} - {count}" for name, count in result["skipped"].items()))
+    print(f"Очередь: до {result['max_backlog']} запросов ждали свободного пользователя")
+
+    print(f"\n{'операция':<14}{'кол-во':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'макс':>10}{'p95 сервиса':>14}  мс")
+    for name, stats in result["operations"].items():
+        print(f"{name:<14}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+              f"{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}{stats['service_p95_ms']:>14.2f}")
+
+    print("\nГистограмма задержек:")
+    widest = max((count for _, count in result["histogram"]), default=0) or 1
+    for bound, count in result["histogram"]:
+        if count:
+            label = f"<= {bound} мс" if bound != "+Inf" else "больше"
+            print(f"  {label:>14} {count:>8}  {'#' * max(1, round(40 * count / widest))}")
+
+    print("\nПо времени:")
+    print(f"  {'t, с':>7}{'запросов/с':>12}{'ошибок':>8}{'p95, мс':>10}")
+    for slot in result["timeline"]:
+        print(f"  {slot['t']:>7g}{slot['rps']:>12}{slot['errors']:>8}{slot['p95_ms']:>10.2f}")
+
+
+def prepare_database(workdir: str, corpus: int, seed: int) -> dict:
+    """Окружение приложения с временной базой и корпусом заметок."""
+    env = dict(os.environ)
+    env["NOTES_DB_DATABASE"] = os.path.join(workdir, "load.db")
+    # Приложение читает настройки из окружения при создании, поэтому оно задаётся здесь
+    os.environ.update(env)
+    import sql
+    from settings import load_storage_settings
+
+    database = sql.Database(load_storage_settings())
+    database.ensure_schemas()
+    if corpus:
+        started = time.perf_counter()
+        seed_database(sql, database, corpus, seed, 0)
+        print(f"Корпус {corpus} заметок создан за {time.perf_counter() - started:.1f} с", flush=True)
+    for shard in database.shards:
+        shard.engine.dispose()
+    return env
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Server:
+    """Приложение под uvicorn в дочернем процессе; считает блокировки SQLite в его журнале."""
+
+    def __init__(self, env: dict, workers: int = 1):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.locked = 0
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(self.port),
+             "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+            cwd=BACKEND_DIR, env=env, stderr=subprocess.PIPE, text=True,
+        )
+        self._reader = threading.Thread(target=self._read_log, daemon=True)
+        self._reader.start()
+
+    def _read_log(self) -> None:
+        for line in self.process.stderr:
+            if LOCKED_MESSAGE in line:
+                self.locked += 1
+
+    def wait_ready(self, timeout: float = 30.0) -> None:
+        import httpx
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"uvicorn завершился с кодом {self.process.returncode}; "
+                                   "установите uvicorn или используйте --in-process")
+            try:
+                httpx.get(self.url + "/notes/", params={"limit": 1}, timeout=1).raise_for_status()
+                return
+            except httpx.HTTPError:
+                time.sleep(0.2)
+        raise RuntimeError(f"Сервер не ответил за {timeout:g} с")
+
+    def stop(self) -> None:
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._reader.join(5)
+
+
+async def run_against_url(url: str, workload: Workload, args) -> Report:
+    import httpx
+
+    limits = httpx.Limits(max_connections=workload.users, max_keepalive_connections=workload.users)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as client:
+        return await run_load(client, workload, args.seed, args.interval, args.timeout)
+
+
+async def run_in_process(workload: Workload, args) -> Report:
+    import httpx
+    import main as app_main
+
+    app = app_main.create_app()
+    transport = httpx.ASGITransport(app=app)
+    async with app_main.lifespan(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://load") as client:
+            return await run_load(client, workload, args.seed, args.interval, args.timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="файл TOML с профилями нагрузки")
+    parser.add_argument("--workload", default="read_heavy", help="имя профиля")
+    parser.add_argument("--list", action="store_true", help="показать профили и выйти")
+    parser.add_argument("--rate", type=float, help="запросов в секунду вместо указанного в профиле")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--duration", type=float)
+    parser.add_argument("--corpus", type=int)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="адрес запущенного приложения; база и корпус не создаются")
+    target.add_argument("--in-process", action="store_true", help="вызывать приложение без uvicorn")
+    parser.add_argument("--workers", type=int, default=1, help="процессов uvicorn")
+    parser.add_argument("--profile", help="профиль хранилища NOTES_DB_PROFILE запускаемого приложения")
+    parser.add_argument("--shards", type=int, help="число шардов NOTES_DB_SHARDS запускаемого приложения")
+    parser.add_argument("--interval", type=float, default=1.0, help="шаг отчёта по времени, с")
+    parser.add_argument("--timeout", type=float, default=30.0, help="таймаут запроса, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="файл JSON для результатов")
+    args = parser.parse_args()
+
+    workloads = load_workloads(args.config)
+    if args.list:
+        for name, workload in workloads.items():
+            print(f"{name:<14} {workload.rate:>6g}/с {workload.users:>4} польз. {workload.duration:>5g} с  "
+                  f"{workload.description}")
+        return
+    if args.workload not in workloads:
+        parser.error(f"неизвестный профиль {args.workload}; есть: {', '.join(workloads)}")
+    overrides = {name: getattr(args, name) for name in ("rate", "users", "duration", "corpus")
+                 if getattr(args, name) is not None}
+    workload = validate_workload(replace(workloads[args.workload], **overrides))
+
+    if args.url:
+        report = asyncio.run(run_against_url(args.url.rstrip("/"), workload, args))
+        target_name = args.url
+    else:
+        workdir = tempfile.mkdtemp(prefix="notes-load-")
+        try:
+            if args.profile:
+                os.environ["NOTES_DB_PROFILE"] = args.profile
+            if args.shards:
+                os.environ["NOTES_DB_SHARDS"] = str(args.shards)
+            env = prepare_database(workdir, workload.corpus, args.seed)
+            if args.in_process:
+                report = asyncio.run(run_in_process(workload, args))
+                target_name = "in-process"
+            else:
+                server = Server(env, args.workers)
+                try:
+                    server.wait_ready()
+                    report = asyncio.run(run_against_url(server.url, workload, args))
+                finally:
+                    server.stop()
+                report.server_locked = server.locked
+                target_name = f"uvicorn --workers {args.workers}"
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = report.summary()
+    print_report(workload, result)
+    if args.output:
+        meta = {"workload": asdict(workload), "target": target_name, "seed": args.seed,
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"meta": meta, "result": result}, file, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import asyncio
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable
+
+# Все созданные кэши: после коммита записи sql.py сбрасывает затронутые ключи в каждом из них
+_caches = weakref.WeakSet()
+
+
+class ReadCache:
+    """LRU-кэш чтений с TTL и объединением одновременных промахов по одному ключу.
+
+    Ключ - кортеж, первый элемент которого - пространство имён ("notes", "trash",
+    "note"): запись в коллекцию сбрасывает всё её пространство или отдельные ключи.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        # Растёт при каждой инвалидации: результат чтения, начатого до записи,
+        # не попадает в кэш, даже если запрос завершился уже после неё
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+        _caches.add(self)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _lookup(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        found, value = self._lookup(key)
+        if found:
+            self.hits += 1
+            return value
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # Отменили ведущий запрос (например, клиент закрыл соединение),
+                # а не этот: загрузка повторяется, а не обрывает чужие запросы
+                if not pending.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                return await self.get_or_load(key, loader)
+
+        self.misses += 1
+        generation = self._generation
+        pending = asyncio.get_running_loop().create_future()
+        self._inflight[key] = pending
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except Exception as e:
+            pending.set_exception(e)
+            # Исключение получат ожидающие запросы; если их нет, не логируем его повторно
+            pending.exception()
+            raise
+        else:
+            pending.set_result(value)
+            # None (запись не найдена) не кэшируется: SQLite может выдать этот id новой заметке
+            if value is not None and generation == self._generation:
+                self._store(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def invalidate(self, namespaces: Iterable[str] = (), keys: Iterable[Hashable] = ()) -> None:
+        # Ключ сбрасывает и все записи, начинающиеся с него: ("note", 1)
+        # сбрасывает ("note", 1, версия)
+        namespaces, keys = set(namespaces), list(keys)
+        stale = [
+            key for key in self._entries
+            if key[0] in namespaces or any(key[:len(prefix)] == prefix for prefix in keys)
+        ]
+        for key in stale:
+            self._entries.pop(key, None)
+        self._generation += 1
+        self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._generation += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def invalidate_all(namespaces: Iterable[str] = (), keys: Iterable[Hashable] = ()) -> None:
+    namespaces, keys = list(namespaces), list(keys)
+    for cache in list(_caches):
+        cache.invalidate(namespaces, keys)
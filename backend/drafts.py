@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional
+
+from settings import DraftSettings
+from sql import DRAFT_COLUMNS, write_drafts_async, get_draft_async, get_drafts_async, utc_now
+
+logger = logging.getLogger("uvicorn.error")
+
+
+@dataclass
+class _Entry:
+    # data is None - черновик удалён, но удаление ещё не записано в базу
+    data: Optional[dict]
+    revision: int
+    dirty: bool
+
+
+def _row(draft) -> dict:
+    return {name: getattr(draft, name) for name in DRAFT_COLUMNS}
+
+
+class DraftBuffer:
+    """Буфер отложенной записи черновиков.
+
+    Автосохранение с каждым нажатием клавиши обновляет только запись в памяти:
+    повторные сохранения одного черновика сливаются, а в базу раз в
+    flush_interval уходят последние версии всех изменённых черновиков одной
+    транзакцией. Записанные черновики остаются в памяти как кэш и вытесняются
+    по LRU сверх max_entries; незаписанные не вытесняются никогда.
+    """
+
+    def __init__(self, session_factory, settings: DraftSettings):
+        self.session_factory = session_factory
+        self.settings = settings
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._revision = 0
+        self.dirty = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        # Записи в базу идут по одной: иначе старая пачка могла бы закоммититься позже новой
+        self._lock = asyncio.Lock()
+        self.puts = 0
+        self.coalesced = 0
+        self.commits = 0
+        self.written = 0
+        self.evicted = 0
+        self.last_flush_ms: Optional[float] = None
+
+    def _set(self, key: str, data: Optional[dict]) -> None:
+        self._revision += 1
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = _Entry(data, self._revision, True)
+            self.dirty += 1
+        else:
+            if entry.dirty:
+                self.coalesced += 1
+            else:
+                self.dirty += 1
+            entry.data, entry.revision, entry.dirty = data, self._revision, True
+            self._entries.move_to_end(key)
+        if self.dirty >= self.settings.max_dirty and self._wakeup is not None:
+            self._wakeup.set()
+        self._evict()
+
+    def put(self, key: str, data: dict) -> dict:
+        draft = {name: data.get(name) for name in DRAFT_COLUMNS}
+        draft["key"] = key
+        draft["updated_date"] = utc_now()
+        self.puts += 1
+        self._set(key, draft)
+        return draft
+
+    def delete(self, key: str) -> None:
+        self._set(key, None)
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            async with self.session_factory() as session:
+                draft = await get_draft_async(session, key)
+            # Пока шло чтение, черновик могли сохранить: версия в памяти новее
+            entry = self._entries.get(key)
+            if entry is None:
+                if draft is None:
+                    return None
+                self._revision += 1
+                entry = self._entries[key] = _Entry(_row(draft), self._revision, False)
+                self._evict()
+        else:
+            self._entries.move_to_end(key)
+        return entry.data
+
+    async def list(self) -> List[dict]:
+        async with self.session_factory() as session:
+            drafts = {draft.key: _row(draft) for draft in await get_drafts_async(session)}
+        for key, entry in self._entries.items():
+            if entry.data is None:
+                drafts.pop(key, None)
+            else:
+                drafts[key] = entry.data
+        return sorted(drafts.values(), key=lambda draft: draft["updated_date"], reverse=True)
+
+    def _evict(self) -> None:
+        excess = len(self._entries) - self.settings.max_entries
+        if excess <= 0:
+            return
+        for key in [key for key, entry in self._entries.items() if not entry.dirty][:excess]:
+            del self._entries[key]
+            self.evicted += 1
+
+    async def flush(self) -> int:
+        """Записывает изменённые черновики одной транзакцией; возвращает их число."""
+        async with self._lock:
+            pending = [(key, entry.revision, entry.data) for key, entry in self._entries.items() if entry.dirty]
+            if not pending:
+                return 0
+            started = time.perf_counter()
+            async with self.session_factory() as session:
+                await write_drafts_async(
+                    session,
+                    [data for _, _, data in pending if data is not None],
+                    [key for key, _, data in pending if data is None]
+                )
+                await session.commit()
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+            self.commits += 1
+            self.written += len(pending)
+
+            for key, revision, data in pending:
+                entry = self._entries.get(key)
+                # Сохранённый во время записи черновик остаётся изменённым до следующей пачки
+                if entry is None or entry.revision != revision:
+                    continue
+                entry.dirty = False
+                self.dirty -= 1
+                if data is None:
+                    del self._entries[key]
+            self._evict()
+            return len(pending)
+
+    async def run_loop(self) -> None:
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.settings.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Ошибка записи черновиков")
+
+    async def shutdown(self) -> None:
+        self._wakeup = None
+        flushed = await self.flush()
+        if flushed:
+            logger.info("Записано черновиков при остановке: %d", flushed)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "dirty": self.dirty,
+            "puts": self.puts,
+            "coalesced": self.coalesced,
+            "commits": self.commits,
+            "written": self.written,
+            "evicted": self.evicted,
+            "last_flush_ms": self.last_flush_ms,
+        }
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import weakref
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+
+# Все созданные хабы: после коммита записи sql.py публикует изменения в каждый из них
+_hubs = weakref.WeakSet()
+
+
+def format_event(seq: int, event: str, data: str) -> str:
+    return f"id: {seq}\nevent: {event}\ndata: {data}\n\n"
+
+
+def change_payload(seq: int, changes: Iterable[Tuple[int, str, Optional[datetime]]]) -> str:
+    return json.dumps({
+        "seq": seq,
+        "changes": [
+            {"id": id, "op": op, "change_date": when.isoformat() if when else None}
+            for id, op, when in changes
+        ],
+    }, ensure_ascii=False, separators=(",", ":"))
+
+
+class EventHub:
+    """Рассылка изменений заметок подписчикам SSE внутри одного процесса.
+
+    У подписчиков нет своих очередей: все читают общий кольцевой буфер последних
+    событий, каждый со своей позиции. Медленный клиент не копит память на сервере -
+    отставший дальше буфера получает событие reset и загружает список заново.
+    """
+
+    def __init__(self, history: int = 1024, heartbeat: float = 15.0, max_subscribers: int = 10000):
+        self.heartbeat = heartbeat
+        self.max_subscribers = max_subscribers
+        self._history: "deque[Tuple[int, str]]" = deque(maxlen=history)
+        # Все события с номером больше base есть в буфере; None - пока неизвестно
+        self.base: Optional[int] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.subscribers = 0
+        self.published = 0
+        self.resets = 0
+        _hubs.add(self)
+
+    @property
+    def last_seq(self) -> Optional[int]:
+        return self._history[-1][0] if self._history else self.base
+
+    @property
+    def full(self) -> bool:
+        return self.subscribers >= self.max_subscribers
+
+    def prime(self, seq: int) -> None:
+        if self.base is None:
+            self.base = seq
+
+    def covers(self, seq: int) -> bool:
+        return self.base is not None and seq >= self.base
+
+    def publish(self, seq: int, changes: List[Tuple[int, str, Optional[datetime]]]) -> None:
+        data = change_payload(seq, changes)
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            self._append(seq, data)
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._append(seq, data)
+        else:
+            # Коммит из другого потока: буфер меняется только в цикле событий
+            loop.call_soon_threadsafe(self._append, seq, data)
+
+    def _append(self, seq: int, data: str) -> None:
+        if self.base is None:
+            self.base = seq - 1
+        if len(self._history) == self._history.maxlen:
+            self.base = self._history[0][0]
+        self._history.append((seq, data))
+        self.published += 1
+        if self._wakeup is not None:
+            wakeup, self._wakeup = self._wakeup, None
+            wakeup.set()
+
+    def _pending(self, cursor: int) -> List[Tuple[int, str]]:
+        # Обычно подписчик отстаёт на одно-два события: буфер просматривается с конца
+        pending = []
+        for seq, data in reversed(self._history):
+            if seq <= cursor:
+                break
+            pending.append((seq, data))
+        pending.reverse()
+        return pending
+
+    def _wait(self) -> asyncio.Event:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    async def stream(self, cursor: int) -> AsyncIterator[str]:
+        """SSE-кадры для подписчика, уже получившего все события до cursor включительно."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # asyncio.Event привязан к циклу событий, в котором его ждали
+            self._loop, self._wakeup = loop, None
+        self.subscribers += 1
+        try:
+            while True:
+                wakeup = self._wait()
+                if not self.covers(cursor):
+                    self.resets += 1
+                    cursor = self.last_seq or 0
+                    yield format_event(cursor, "reset", json.dumps({"seq": cursor}))
+                for seq, data in self._pending(cursor):
+                    cursor = seq
+                    yield format_event(seq, "change", data)
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    # Комментарий SSE не дает прокси закрыть простаивающее соединение
+                    yield ": ping\n\n"
+        finally:
+            self.subscribers -= 1
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": self.subscribers,
+            "max_subscribers": self.max_subscribers,
+            "published": self.published,
+            "resets": self.resets,
+            "buffered": len(self._history),
+            "last_seq": self.last_seq,
+        }
+
+
+def publish_all(seq: int, changes: Iterable[Tuple[int, str, Optional[datetime]]]) -> None:
+    changes = list(changes)
+    for hub in list(_hubs):
+        hub.publish(seq, changes)
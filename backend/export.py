@@ -0,0 +1,149 @@
+import json
+import os
+import zipfile
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from models.models import NoteBase
+
+EXPORT_MEDIA_TYPES = {
+    "txt": "text/plain; charset=utf-8",
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "pdf": "application/pdf",
+    "zip": "application/zip",
+}
+
+IMPORTANCE_LABELS = {1: "Обычная", 2: "Важная", 3: "Срочная"}
+
+# Стандартные шрифты PDF не содержат кириллицы, поэтому для PDF нужен TTF
+PDF_FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+]
+
+
+def _format_date(value: Optional[str]) -> str:
+    return datetime.fromisoformat(value).strftime("%d.%m.%Y, %H:%M:%S") if value else ""
+
+
+def note_to_export_dict(note: NoteBase) -> dict:
+    return {
+        "headline": note.headline,
+        "text": note.text,
+        "importance": note.improtance,
+        "created_date": note.created_date.isoformat() if note.created_date else None,
+        "change_date": note.change_date.isoformat() if note.change_date else None,
+    }
+
+
+def note_to_txt(item: dict) -> str:
+    lines = [
+        "=" * 50,
+        "Заголовок: " + (item["headline"] or "Без названия"),
+        "Важность: " + IMPORTANCE_LABELS.get(item["importance"], IMPORTANCE_LABELS[1]),
+        "Создано: " + _format_date(item["created_date"]),
+    ]
+    if item["change_date"]:
+        lines.append("Изменено: " + _format_date(item["change_date"]))
+    lines.append("-" * 50)
+    lines.append(item["text"] or "Нет текста")
+    return "\n".join(lines) + "\n\n"
+
+
+class ExportEncoder:
+    """Кодирует заметки в выбранный формат по частям, не держа весь файл в памяти."""
+
+    def __init__(self, format: str):
+        if format not in ("txt", "json", "ndjson"):
+            raise ValueError(f"Неизвестный формат экспорта: {format}")
+        self.format = format
+        self._first = True
+
+    def start(self) -> str:
+        return "[\n" if self.format == "json" else ""
+
+    def encode(self, notes: Iterable[NoteBase]) -> str:
+        items = [note_to_export_dict(note) for note in notes]
+        if self.format == "txt":
+            return "".join(note_to_txt(item) for item in items)
+        if self.format == "ndjson":
+            return "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items)
+
+        parts = []
+        for item in items:
+            encoded = json.dumps(item, ensure_ascii=False, indent=2)
+            parts.append(("" if self._first else ",\n") + "  " + encoded.replace("\n", "\n  "))
+            self._first = False
+        return "".join(parts)
+
+    def finish(self) -> str:
+        if self.format != "json":
+            return ""
+        return "]\n" if self._first else "\n]\n"
+
+
+# Функции ниже выполняются в пуле воркеров, поэтому принимают только
+# сериализуемые данные: список словарей note_to_export_dict и путь к файлу.
+
+def render_zip(items: List[dict], path: str) -> None:
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for number, item in enumerate(items, start=1):
+            archive.writestr(f"{number:05d}.txt", note_to_txt(item))
+        archive.writestr("notes.json", json.dumps(items, ensure_ascii=False, indent=2))
+
+
+def find_pdf_font() -> Optional[str]:
+    configured = os.environ.get("NOTES_PDF_FONT")
+    if configured:
+        return configured
+    for candidate in PDF_FONT_CANDIDATES:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def render_pdf(items: List[dict], path: str) -> None:
+    try:
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib.styles import ParagraphStyle
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+    except ImportError as e:
+        raise RuntimeError("Для экспорта в PDF требуется пакет reportlab") from e
+
+    font_path = find_pdf_font()
+    if font_path is None:
+        raise RuntimeError("Не найден TTF-шрифт с кириллицей, задайте NOTES_PDF_FONT")
+    pdfmetrics.registerFont(TTFont("NotesFont", font_path))
+
+    title = ParagraphStyle("title", fontName="NotesFont", fontSize=14, leading=18, spaceAfter=4)
+    meta = ParagraphStyle("meta", fontName="NotesFont", fontSize=9, leading=12, textColor="#666666")
+    body = ParagraphStyle("body", fontName="NotesFont", fontSize=11, leading=15)
+
+    def escape(value: str) -> str:
+        return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+    story = [Paragraph(f"Мои заметки ({len(items)})", title), Spacer(1, 12)]
+    for item in items:
+        info = IMPORTANCE_LABELS.get(item["importance"], IMPORTANCE_LABELS[1])
+        info += " | Создано: " + _format_date(item["created_date"])
+        if item["change_date"]:
+            info += " | Изменено: " + _format_date(item["change_date"])
+        story.append(Paragraph(escape(item["headline"] or "Без названия"), title))
+        story.append(Paragraph(escape(info), meta))
+        story.append(Spacer(1, 6))
+        text = escape(item["text"] or "Нет текста").replace("\n", "<br/>")
+        story.append(Paragraph(text, body))
+        story.append(Spacer(1, 18))
+
+    SimpleDocTemplate(path, pagesize=A4, title="Заметки").build(story)
+
+
+RENDERERS = {
+    "pdf": render_pdf,
+    "zip": render_zip,
+}
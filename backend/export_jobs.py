@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
+
+from export import RENDERERS, note_to_export_dict
+from sql import stream_notes_async
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+# Рендеринг PDF нагружает процессор и выполняется в пуле процессов,
+# архивы (zlib отпускает GIL) собираются в пуле потоков.
+CPU_BOUND_FORMATS = {"pdf"}
+# Каталог готовых файлов не зависит от текущего каталога процесса
+SPOOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db", "exports")
+
+
+def content_hash(format: str, items: List[dict]) -> str:
+    payload = json.dumps([format, items], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+@dataclass
+class ExportJob:
+    id: str
+    format: str
+    note_ids: Optional[List[int]]
+    status: str = "queued"
+    progress: float = 0.0
+    notes: int = 0
+    cached: bool = False
+    content_hash: Optional[str] = None
+    path: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    finished_at: Optional[datetime] = None
+
+
+class ExportJobManager:
+    """Очередь фоновых задач экспорта с кэшем готовых файлов по хэшу содержимого."""
+
+    def __init__(self, session_factory, spool_dir: str = SPOOL_DIR,
+                 ttl: float = 24 * 3600, max_workers: int = 2):
+        self.session_factory = session_factory
+        self.spool_dir = spool_dir
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.jobs: Dict[str, ExportJob] = {}
+        self._rendering: Dict[str, asyncio.Future] = {}
+        # Цикл событий хранит на задачи только слабые ссылки: без этого набора
+        # выполняющийся экспорт может собрать сборщик мусора
+        self._tasks: Set[asyncio.Task] = set()
+        self._pool: Optional["ProcessPoolExecutor"] = None
+
+    def submit(self, format: str, note_ids: Optional[List[int]] = None) -> ExportJob:
+        if format not in RENDERERS:
+            raise ValueError(f"Неизвестный формат экспорта: {format}")
+        job = ExportJob(id=uuid.uuid4().hex, format=format, note_ids=note_ids)
+        self.jobs[job.id] = job
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get(self, job_id: str) -> Optional[ExportJob]:
+        return self.jobs.get(job_id)
+
+    def artifact_path(self, digest: str, format: str) -> str:
+        return os.path.join(self.spool_dir, f"{digest}.{format}")
+
+    def _is_fresh(self, path: str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(path) < self.ttl
+        except OSError:
+            return False
+
+    async def _load(self, note_ids: Optional[List[int]]) -> List[dict]:
+        items = []
+        async with self.session_factory() as session:
+            async for partition in stream_notes_async(session, note_ids):
+                items.extend(note_to_export_dict(note) for note in partition)
+        return items
+
+    async def _run(self, job: ExportJob) -> None:
+        try:
+            job.status = "loading"
+            job.progress = 0.1
+            items = await self._load(job.note_ids)
+            job.notes = len(items)
+            job.content_hash = content_hash(job.format, items)
+            path = self.artifact_path(job.content_hash, job.format)
+
+            if self._is_fresh(path):
+                # Повторный экспорт тех же заметок отдаёт готовый файл
+                job.cached = True
+                os.utime(path)
+            else:
+                job.status = "rendering"
+                job.progress = 0.3
+                await asyncio.shield(self._render_once(job.format, items, path, job.content_hash))
+
+            job.path = path
+            job.status = "done"
+            job.progress = 1.0
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = datetime.now(timezone.utc)
+
+    def _render_once(self, format: str, items: List[dict], path: str, digest: str) -> asyncio.Future:
+        # Одинаковые задачи, запущенные одновременно, ждут один и тот же рендеринг
+        pending = self._rendering.get(digest)
+        if pending is None:
+            pending = asyncio.ensure_future(self._render(format, items, path))
+            self._rendering[digest] = pending
+            pending.add_done_callback(lambda _: self._rendering.pop(digest, None))
+        return pending
+
+    async def _render(self, format: str, items: List[dict], path: str) -> None:
+        os.makedirs(self.spool_dir, exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        executor = self._process_pool() if format in CPU_BOUND_FORMATS else None
+        try:
+            await asyncio.get_running_loop().run_in_executor(executor, RENDERERS[format], items, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _process_pool(self) -> "ProcessPoolExecutor":
+        if self._pool is None:
+            # Импорт здесь: multiprocessing нужен только экспорту в PDF, а не каждому запуску воркера
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # spawn: дочерние процессы не наследуют потоки aiosqlite и цикл событий
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    def collect_garbage(self) -> int:
+        removed = 0
+        now = time.time()
+        if os.path.isdir(self.spool_dir):
+            for name in os.listdir(self.spool_dir):
+                path = os.path.join(self.spool_dir, name)
+                try:
+                    if now - os.path.getmtime(path) >= self.ttl:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished_at is not None
+                   and now - job.finished_at.timestamp() >= self.ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
+        return removed
+
+    async def run_gc_loop(self, interval: float = 600) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.collect_garbage)
+
+    async def shutdown(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -1,18 +1,60 @@
-from fastapi import FastAPI, Request, Depends, HTTPException, status
-from fastapi.responses import FileResponse, JSONResponse
+import time
+
+# Начало импорта приложения: время импорта входит в отчёт о запуске воркера
+IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from contextlib import asynccontextmanager
+
+from fastapi import APIRouter, FastAPI, Request, Response, Depends, Header, HTTPException, Path, Query, status
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.exceptions import HTTPException as StarletteHTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
+import sql
 from sql import (
-    Session as SessionLocal, create_note, change_note, delete_note,
-    move_to_trash, get_all_trashed, restore_from_trash, delete_from_trash
+    create_note_async, change_note_async,
+    delete_note_async, move_to_trash_async, get_notes_page_async,
+    get_trashed_page_async, restore_from_trash_async, delete_from_trash_async,
+    search_notes_async, explain_notes_page_async, NoteFilters,
+    apply_notes_batch_async, apply_trash_batch_async, stream_notes_async,
+    get_version_async, get_note_by_id_async, NOTES, TRASH,
+    get_changes_async, get_event_seq_async, SUMMARY_COLUMNS, VersionConflict
 )
-from models.models import NoteBase, TrashedNote
+from cache import ReadCache
+from export import ExportEncoder, EXPORT_MEDIA_TYPES
+from export_jobs import ExportJobManager
+from static_assets import StaticAssets, STATIC_PREFIX
+from retention import TrashRetention
+from drafts import DraftBuffer
+from events import EventHub, format_event, change_payload
+from metrics import Metrics, MetricsMiddleware, PROMETHEUS_MEDIA_TYPE
+from serialization import (
+    fast_response, negotiate_media_type, project, NOTE_FIELDS, TRASHED_FIELDS, GZIP_ETAG_SUFFIX
+)
+from settings import StorageSettings, load_storage_settings, load_retention_settings, load_draft_settings
+from models.models import NoteBase
 
-from pydantic import BaseModel, Field
+from pydantic import AliasChoices, BaseModel, Field
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Annotated, List, Literal, Optional, Union
+
+PAGE_LIMIT_MAX = 500
+BATCH_SIZE_MAX = 1000
+EXPORT_IDS_MAX = 10000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+QUERY_PLAN_HEADER = "X-Query-Plan"
+CACHE_HEADERS = {"Cache-Control": "no-cache"}
+# 1 - списки заметок кодируются напрямую из строк (orjson, MessagePack, gzip);
+# по умолчанию ответы сериализуются через модели pydantic и не сжимаются
+FAST_RESPONSES = os.environ.get("NOTES_FAST_RESPONSES", "0").lower() in ("1", "true", "yes", "on")
+# Метрики Prometheus на /metrics: задержки маршрутов, время SQL, пул соединений
+METRICS_ENABLED = os.environ.get("NOTES_METRICS", "1").lower() not in ("0", "false", "no", "off")
 
 
 class NoteCreate(BaseModel):
@@ -34,176 +76,798 @@ class NoteResponse(BaseModel):
     improtance: int
     created_date: datetime
     change_date: Optional[datetime]
+    version: int = 1
 
     class Config:
         from_attributes = True
 
 
+class NoteSearchResult(BaseModel):
+    id: int
+    headline: Optional[str]
+    headline_highlight: Optional[str]
+    snippet: Optional[str]
+    improtance: int
+    created_date: datetime
+    change_date: Optional[datetime]
+    rank: float
+
+
 class TrashedNoteResponse(BaseModel):
     id: int
-    original_id: int
+    # Заметка попадает в корзину под своим id, поле оставлено для совместимости
+    original_id: int = Field(validation_alias=AliasChoices("original_id", "id"))
     headline: Optional[str]
     text: Optional[str]
     improtance: int
     created_date: datetime
     change_date: Optional[datetime]
+    version: int = 1
     deleted_date: datetime
 
     class Config:
         from_attributes = True
 
 
-app = FastAPI(title="Notes API", version="1.0.0")
+class BatchCreate(BaseModel):
+    op: Literal["create"]
+    note: NoteCreate
 
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["sysinfo.ro", "46.173.28.153"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+class BatchUpdate(BaseModel):
+    op: Literal["update"]
+    id: int
+    note: NoteUpdate
+
+
+class BatchTrash(BaseModel):
+    op: Literal["trash"]
+    id: int
+
+
+class BatchDelete(BaseModel):
+    op: Literal["delete"]
+    id: int
+
+
+class BatchRestore(BaseModel):
+    op: Literal["restore"]
+    id: int
+
+
+class NotesBatchRequest(BaseModel):
+    operations: List[Annotated[
+        Union[BatchCreate, BatchUpdate, BatchTrash, BatchDelete],
+        Field(discriminator="op")
+    ]] = Field(..., min_length=1, max_length=BATCH_SIZE_MAX)
+
+
+class TrashBatchRequest(BaseModel):
+    operations: List[Annotated[
+        Union[BatchRestore, BatchDelete],
+        Field(discriminator="op")
+    ]] = Field(..., min_length=1, max_length=BATCH_SIZE_MAX)
+
+
+class BatchItemResult(BaseModel):
+    index: int
+    op: str
+    id: Optional[int]
+    result_id: Optional[int]
+    status: int
+    detail: Optional[str] = None
+
+
+class BatchResponse(BaseModel):
+    results: List[BatchItemResult]
+
+
+class ExportJobRequest(BaseModel):
+    format: Literal["pdf", "zip"]
+    ids: Optional[List[int]] = Field(None, max_length=EXPORT_IDS_MAX)
 
 
-def get_db():
-    with SessionLocal() as db:
+class ExportJobResponse(BaseModel):
+    id: str
+    format: str
+    status: str
+    progress: float
+    notes: int
+    cached: bool
+    error: Optional[str]
+    created_at: datetime
+    finished_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+
+class NoteChangesResponse(BaseModel):
+    # Курсор для следующего запроса: номер изменения, при шардах - строка
+    # с номерами изменений шардов через точку
+    seq: Union[int, str]
+    # true - состояние клиента устарело, список нужно загрузить заново
+    reset: bool
+    notes: List[NoteResponse]
+    deleted: List[int]
+
+
+class DraftUpdate(BaseModel):
+    note_id: Optional[int] = None
+    headline: Optional[str] = Field(None, max_length=45)
+    text: Optional[str] = Field(None, max_length=10000)
+    improtance: Optional[int] = Field(None, ge=1, le=3)
+
+
+class DraftResponse(BaseModel):
+    key: str
+    note_id: Optional[int]
+    headline: Optional[str]
+    text: Optional[str]
+    improtance: Optional[int]
+    updated_date: datetime
+
+
+class PurgeBatchResponse(BaseModel):
+    removed: int
+    duration_ms: float
+
+    class Config:
+        from_attributes = True
+
+
+class PurgeReportResponse(BaseModel):
+    dry_run: bool
+    cutoff: datetime
+    removed: int
+    tombstones_removed: int
+    batches: List[PurgeBatchResponse]
+    duration_ms: float
+    started_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+def note_create_data(note: NoteCreate) -> dict:
+    return {
+        "headline": note.headline,
+        "text": note.text,
+        "improtance": note.improtance,
+        "created_date": datetime.now(timezone.utc)
+    }
+
+
+def note_update_data(note_update: NoteUpdate) -> dict:
+    new_data = {"change_date": datetime.now(timezone.utc)}
+
+    if note_update.headline is not None:
+        new_data["new_headline"] = note_update.headline
+    if note_update.text is not None:
+        new_data["text"] = note_update.text
+    if note_update.improtance is not None:
+        new_data["improtance"] = note_update.improtance
+
+    return new_data
+
+
+def make_etag(prefix: str, version: int, *parts) -> str:
+    # Версия коллекции + хэш параметров запроса: разные страницы и фильтры
+    # получают разные ETag, а любая запись меняет их все сразу
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()[:12]
+    return f'"{prefix}{version}-{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [value.strip().removeprefix("W/") for value in header.split(",")]
+    # Сжатый вариант списка того же содержимого подтверждает и несжатый
+    candidates += [value.replace(GZIP_ETAG_SUFFIX + '"', '"') for value in candidates]
+    return etag in candidates
+
+
+def note_etag(id: int, version: int) -> str:
+    # Версия заметки меняется при каждой записи в неё, в том числе из пакетов
+    return f'"n{id}-v{version}"'
+
+
+def if_match_version(request: Request, note_id: int) -> Optional[int]:
+    """Версия из If-Match для оптимистичной блокировки; None - без условия.
+
+    ETag другой заметки или слабый ETag не совпадают ни с какой версией:
+    такой запрос получает 412, как и запрос с устаревшей версией.
+    """
+    header = request.headers.get("if-match")
+    if not header or header.strip() == "*":
+        return None
+    for value in header.split(","):
+        match = re.fullmatch(rf'"n{note_id}-v(\d+)"', value.strip())
+        if match:
+            return int(match.group(1))
+    return 0
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, **CACHE_HEADERS})
+
+
+def set_etag(response: Response, etag: str) -> None:
+    response.headers["ETag"] = etag
+    response.headers.update(CACHE_HEADERS)
+
+
+def asset_response(request: Request, asset, status_code: int = status.HTTP_200_OK) -> Response:
+    encoding = asset.negotiate(request.headers.get("accept-encoding", ""))
+    # У каждого варианта сжатия свой строгий ETag
+    etag = asset.etag if encoding == "identity" else f'{asset.etag[:-1]}-{encoding}"'
+    headers = {"ETag": etag, "Cache-Control": asset.cache_control, "Vary": "Accept-Encoding"}
+    if status_code == status.HTTP_200_OK and etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(asset.variants[encoding], status_code=status_code,
+                    media_type=asset.media_type, headers=headers)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger = logging.getLogger("uvicorn.error")
+    state = app.state
+    started = time.perf_counter()
+    logger.info("Хранилище SQLite: %s", state.database.settings.describe())
+    # Схема проверяется одним запросом; мигрирует её только первый из воркеров
+    migrated = state.database.ensure_schemas()
+    schema_done = time.perf_counter()
+    state.assets.load()
+    assets_done = time.perf_counter()
+    tasks = [asyncio.create_task(state.export_jobs.run_gc_loop())]
+    if state.trash_retention.settings.enabled:
+        tasks.append(asyncio.create_task(state.trash_retention.run_loop()))
+    tasks.append(asyncio.create_task(state.draft_buffer.run_loop()))
+    if state.metrics is not None:
+        tasks.append(asyncio.create_task(state.metrics.run_loop_monitor()))
+    startup = state.startup
+    startup.update({
+        "import_ms": IMPORT_MS,
+        "schema_ms": round((schema_done - started) * 1000, 1),
+        "schema_migrated": migrated,
+        "assets_ms": round((assets_done - schema_done) * 1000, 1),
+        "ready_ms": round(IMPORT_MS + (time.perf_counter() - started) * 1000, 1),
+    })
+    logger.info("Воркер %d готов за %.0f мс: импорт %.0f, схема %.0f%s, статика %.0f",
+                os.getpid(), startup["ready_ms"], IMPORT_MS, startup["schema_ms"],
+                " (миграция)" if migrated else "", startup["assets_ms"])
+    yield
+    for task in tasks:
+        task.cancel()
+    # Черновики, сохранённые после последней записи, не должны потеряться при остановке
+    await state.draft_buffer.shutdown()
+    await state.export_jobs.shutdown()
+    await state.database.dispose()
+
+
+router = APIRouter()
+
+
+async def get_db(request: Request):
+    metrics = request.app.state.metrics
+    async with request.app.state.database.AsyncSession() as db:
+        if metrics is not None and isinstance(db, AsyncSession):
+            # Соединение берётся из пула сразу, чтобы отдельно измерить ожидание пула
+            started = time.perf_counter()
+            await db.connection()
+            metrics.pool_wait.observe(time.perf_counter() - started)
         yield db
 
 
-@app.exception_handler(StarletteHTTPException)
 async def http_exception_handler(request: Request, exc: StarletteHTTPException):
     if exc.status_code == 404:
         accept = request.headers.get("accept", "")
         if "text/html" in accept:
-            return FileResponse("../frontend/404.html", status_code=404)
+            return asset_response(request, request.app.state.assets.get("/404.html"), status_code=404)
     return JSONResponse(
         status_code=exc.status_code,
-        content={"detail": exc.detail}
+        content={"detail": exc.detail},
+        headers=exc.headers
     )
 
 
-@app.get("/")
-@app.get("/index")
-@app.get("/index.html")
-async def index():
-    return FileResponse("../frontend/index.html")
+@router.get("/")
+@router.get("/index")
+@router.get("/index.html")
+async def index(request: Request):
+    return asset_response(request, request.app.state.assets.get("/index.html"))
 
 
-@app.get("/style.css")
-async def styles():
-    return FileResponse("../frontend/style.css")
+@router.get("/style.css")
+async def styles(request: Request):
+    return asset_response(request, request.app.state.assets.get("/style.css"))
 
 
-@app.get("/script.js")
-async def js():
-    return FileResponse("../frontend/script.js", media_type="application/javascript")
+@router.get("/script.js")
+async def js(request: Request):
+    return asset_response(request, request.app.state.assets.get("/script.js"))
 
 
-@app.get("/trash.html")
-async def trash():
-    return FileResponse("../frontend/trash.html")
+@router.get("/trash.html")
+async def trash(request: Request):
+    return asset_response(request, request.app.state.assets.get("/trash.html"))
 
 
-@app.get("/image.png")
-async def image():
-    return FileResponse("../frontend/image.png", media_type="image/png")
+@router.get("/image.png")
+async def image(request: Request):
+    return asset_response(request, request.app.state.assets.get("/image.png"))
 
 
-@app.post("/notes/", response_model=NoteResponse, status_code=status.HTTP_201_CREATED)
-async def create(note: NoteCreate, db: Session = Depends(get_db)):
-    db_note = NoteBase(
-        headline=note.headline,
-        text=note.text,
-        improtance=note.improtance,
-        created_date=datetime.now(timezone.utc)
-    )
-    created_note = create_note(db_note, session=db)
+@router.get(STATIC_PREFIX + "{name}")
+async def static_asset(name: str, request: Request):
+    asset = request.app.state.assets.get(STATIC_PREFIX + name)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Файл не найден")
+    return asset_response(request, asset)
+
+
+@router.post("/notes/", response_model=NoteResponse, status_code=status.HTTP_201_CREATED)
+async def create(note: NoteCreate, db: AsyncSession = Depends(get_db)):
+    db_note = NoteBase(**note_create_data(note))
+    created_note = await create_note_async(db_note, session=db)
     return created_note
 
 
-@app.get("/notes/", response_model=list[NoteResponse])
-async def get_all(db: Session = Depends(get_db)):
-    notes = db.query(NoteBase).all()
+def list_columns(view: str, fields: Optional[str]) -> Optional[tuple]:
+    # None - полные заметки; id нужен всегда: по нему клиент открывает заметку
+    if fields:
+        names = [name.strip() for name in fields.split(",") if name.strip()]
+        return tuple(dict.fromkeys(["id"] + names))
+    return SUMMARY_COLUMNS if view == "summary" else None
+
+
+@router.get("/notes/", response_model=list[NoteResponse])
+async def get_all(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_LIMIT_MAX),
+    after: Optional[str] = None,
+    sort: Literal["created", "changed", "headline", "importance"] = "created",
+    order: Literal["asc", "desc"] = "desc",
+    importance: Optional[List[Annotated[int, Field(ge=1, le=3)]]] = Query(None),
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    changed_from: Optional[datetime] = None,
+    changed_to: Optional[datetime] = None,
+    view: Literal["full", "summary"] = "full",
+    fields: Optional[str] = None,
+    debug: bool = False,
+    db: AsyncSession = Depends(get_db)
+):
+    columns = list_columns(view, fields)
+    filters = NoteFilters(
+        importance=importance,
+        created_from=created_from,
+        created_to=created_to,
+        changed_from=changed_from,
+        changed_to=changed_to
+    )
+    version = await get_version_async(db, NOTES)
+    media_type = negotiate_media_type(request.headers.get("accept")) if FAST_RESPONSES else None
+    etag = make_etag("n", version, sorted(request.query_params.multi_items()), media_type)
+    if etag_matches(request, etag) and not debug:
+        return not_modified(etag)
+
+    try:
+        notes, next_cursor = await get_notes_page_async(
+            db, limit, after, sort, order, filters, cache=request.app.state.read_cache, version=version,
+            columns=columns
+        )
+        if debug:
+            plan = await explain_notes_page_async(db, limit, after, sort, order, filters, columns)
+            response.headers[QUERY_PLAN_HEADER] = "; ".join(plan)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    set_etag(response, etag)
+    if columns is not None:
+        # У выборки полей нет модели ответа: строки уже содержат только нужные поля
+        return fast_response(request, project(notes, tuple((name, name) for name in columns)), response.headers,
+                             negotiate=FAST_RESPONSES)
+    if FAST_RESPONSES:
+        return fast_response(request, project(notes, NOTE_FIELDS), response.headers)
     return notes
 
 
-@app.get("/notes/{note_id}", response_model=NoteResponse)
-async def get_one(note_id: int, db: Session = Depends(get_db)):
-    note = db.query(NoteBase).filter(NoteBase.id == note_id).first()
-    if not note:
-        raise HTTPException(status_code=404, detail="Заметка не найдена")
-    return note
+BATCH_STATUS = {
+    "create": status.HTTP_201_CREATED,
+    "update": status.HTTP_200_OK,
+    "trash": status.HTTP_200_OK,
+    "restore": status.HTTP_200_OK,
+    "delete": status.HTTP_204_NO_CONTENT,
+}
+
+
+def batch_results(operations, result_ids: List[Optional[int]], not_found: str) -> BatchResponse:
+    results = []
+    for index, (operation, result_id) in enumerate(zip(operations, result_ids)):
+        found = result_id is not None
+        results.append(BatchItemResult(
+            index=index,
+            op=operation.op,
+            id=getattr(operation, "id", None),
+            result_id=result_id,
+            status=BATCH_STATUS[operation.op] if found else status.HTTP_404_NOT_FOUND,
+            detail=None if found else not_found
+        ))
+    return BatchResponse(results=results)
+
+
+@router.post("/notes/batch", response_model=BatchResponse)
+async def notes_batch(batch: NotesBatchRequest, db: AsyncSession = Depends(get_db)):
+    operations = []
+    for operation in batch.operations:
+        if operation.op == "create":
+            operations.append(("create", None, note_create_data(operation.note)))
+        elif operation.op == "update":
+            operations.append(("update", operation.id, note_update_data(operation.note)))
+        else:
+            operations.append((operation.op, operation.id, None))
+
+    result_ids = await apply_notes_batch_async(operations, db)
+    await db.commit()
+    return batch_results(batch.operations, result_ids, "Заметка не найдена")
+
+
+@router.post("/trash/batch", response_model=BatchResponse)
+async def trash_batch(batch: TrashBatchRequest, db: AsyncSession = Depends(get_db)):
+    operations = [(operation.op, operation.id, None) for operation in batch.operations]
+    result_ids = await apply_trash_batch_async(operations, db)
+    await db.commit()
+    return batch_results(batch.operations, result_ids, "Заметка не найдена в корзине")
+
+
+def parse_ids(ids: Optional[str]) -> Optional[List[int]]:
+    if ids is None:
+        return None
+    try:
+        parsed = [int(part) for part in ids.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный список id")
+    if len(parsed) > EXPORT_IDS_MAX:
+        raise HTTPException(status_code=400, detail=f"Не более {EXPORT_IDS_MAX} id за один экспорт")
+    return parsed
+
+
+@router.get("/notes/export")
+async def export_notes(
+    request: Request,
+    format: Literal["txt", "json", "ndjson"] = "json",
+    ids: Optional[str] = None
+):
+    note_ids = parse_ids(ids)
+    encoder = ExportEncoder(format)
+
+    async def body():
+        # Открывающая скобка JSON уходит клиенту до первого запроса к базе
+        start = encoder.start()
+        if start:
+            yield start.encode()
+        async with request.app.state.database.AsyncSession() as session:
+            async for partition in stream_notes_async(session, note_ids):
+                yield encoder.encode(partition).encode()
+        yield encoder.finish().encode()
+
+    return StreamingResponse(
+        body(),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="notes.{format}"'}
+    )
 
 
-@app.put("/notes/{note_id}", response_model=NoteResponse)
-async def update(note_id: int, note_update: NoteUpdate, db: Session = Depends(get_db)):
-    existing_note = db.query(NoteBase).filter(NoteBase.id == note_id).first()
-    if not existing_note:
-        raise HTTPException(status_code=404, detail="Заметка не найдена")
+@router.get("/notes/changes", response_model=NoteChangesResponse)
+async def note_changes(since: str = Query(..., pattern=r"^\d+(\.\d+)*$"), db: AsyncSession = Depends(get_db)):
+    return await get_changes_async(db, since)
 
-    new_data = {"change_date": datetime.now(timezone.utc)}
 
-    if note_update.headline is not None:
-        new_data["new_headline"] = note_update.headline
-    if note_update.text is not None:
-        new_data["text"] = note_update.text
-    if note_update.improtance is not None:
-        new_data["improtance"] = note_update.improtance
+@router.get("/notes/search", response_model=list[NoteSearchResult])
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=PAGE_LIMIT_MAX),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db)
+):
+    return await search_notes_async(db, q, limit, offset)
+
 
-    change_note(note_id, db, new_data)
-    db.commit()
-    db.refresh(existing_note)
+@router.get("/notes/{note_id}", response_model=NoteResponse)
+async def get_one(note_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    note = await get_note_by_id_async(note_id, db, cache=request.app.state.read_cache)
+    if not note:
+        raise HTTPException(status_code=404, detail="Заметка не найдена")
 
-    return existing_note
+    etag = note_etag(note_id, note["version"] if isinstance(note, dict) else note.version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+    return note
 
 
-@app.delete("/notes/{note_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete(note_id: int, db: Session = Depends(get_db)):
-    existing_note = db.query(NoteBase).filter(NoteBase.id == note_id).first()
-    if not existing_note:
+@router.put("/notes/{note_id}", response_model=NoteResponse,
+         responses={412: {"description": "Заметка изменена после чтения (If-Match)"}})
+async def update(note_id: int, note_update: NoteUpdate, request: Request, response: Response,
+                 db: AsyncSession = Depends(get_db)):
+    try:
+        note = await change_note_async(note_id, db, note_update_data(note_update),
+                                       expected_version=if_match_version(request, note_id))
+    except VersionConflict as conflict:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
+                            detail="Заметка изменена другим пользователем",
+                            headers={"ETag": note_etag(note_id, conflict.version)})
+    if not note:
         raise HTTPException(status_code=404, detail="Заметка не найдена")
 
-    delete_note(note_id, db)
-    db.commit()
+    await db.commit()
+    response.headers["ETag"] = note_etag(note.id, note.version)
+    return note
+
+
+@router.delete("/notes/{note_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete(note_id: int, db: AsyncSession = Depends(get_db)):
+    if not await delete_note_async(note_id, db):
+        raise HTTPException(status_code=404, detail="Заметка не найдена")
 
+    await db.commit()
     return None
 
 
-@app.post("/notes/{note_id}/trash", response_model=TrashedNoteResponse)
-async def trash_note(note_id: int, db: Session = Depends(get_db)):
-    existing_note = db.query(NoteBase).filter(NoteBase.id == note_id).first()
-    if not existing_note:
+@router.post("/notes/{note_id}/trash", response_model=TrashedNoteResponse)
+async def trash_note(note_id: int, db: AsyncSession = Depends(get_db)):
+    trashed = await move_to_trash_async(note_id, db)
+    if not trashed:
         raise HTTPException(status_code=404, detail="Заметка не найдена")
 
-    trashed = move_to_trash(note_id, db)
-    db.commit()
-    db.refresh(trashed)
+    await db.commit()
     return trashed
 
 
-@app.get("/trash/", response_model=list[TrashedNoteResponse])
-async def get_all_trash(db: Session = Depends(get_db)):
-    return get_all_trashed(db)
+@router.get("/trash/", response_model=list[TrashedNoteResponse])
+async def get_all_trash(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_LIMIT_MAX),
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    version = await get_version_async(db, TRASH)
+    media_type = negotiate_media_type(request.headers.get("accept")) if FAST_RESPONSES else None
+    etag = make_etag("t", version, limit, after, media_type)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    try:
+        trashed, next_cursor = await get_trashed_page_async(db, limit, after, cache=request.app.state.read_cache,
+                                                            version=version)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    set_etag(response, etag)
+    if FAST_RESPONSES:
+        return fast_response(request, project(trashed, TRASHED_FIELDS), response.headers)
+    return trashed
 
 
-@app.post("/trash/{trash_id}/restore", response_model=NoteResponse)
-async def restore_note(trash_id: int, db: Session = Depends(get_db)):
-    trashed = db.query(TrashedNote).filter(TrashedNote.id == trash_id).first()
-    if not trashed:
+@router.post("/trash/{trash_id}/restore", response_model=NoteResponse)
+async def restore_note(trash_id: int, db: AsyncSession = Depends(get_db)):
+    restored = await restore_from_trash_async(trash_id, db)
+    if not restored:
         raise HTTPException(status_code=404, detail="Заметка не найдена в корзине")
 
-    restored = restore_from_trash(trash_id, db)
-    db.commit()
-    db.refresh(restored)
+    await db.commit()
     return restored
 
 
-@app.delete("/trash/{trash_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_trash(trash_id: int, db: Session = Depends(get_db)):
-    trashed = db.query(TrashedNote).filter(TrashedNote.id == trash_id).first()
-    if not trashed:
+@router.post("/trash/purge", response_model=PurgeReportResponse)
+async def purge_trash(
+    request: Request,
+    dry_run: bool = False,
+    max_age_days: Optional[float] = Query(None, ge=0)
+):
+    return await request.app.state.trash_retention.purge(dry_run=dry_run, max_age_days=max_age_days)
+
+
+@router.get("/trash/purge", response_model=Optional[PurgeReportResponse])
+async def last_trash_purge(request: Request):
+    return request.app.state.trash_retention.last_report
+
+
+@router.delete("/trash/{trash_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_trash(trash_id: int, db: AsyncSession = Depends(get_db)):
+    if not await delete_from_trash_async(trash_id, db):
         raise HTTPException(status_code=404, detail="Заметка не найдена в корзине")
 
-    delete_from_trash(trash_id, db)
-    db.commit()
+    await db.commit()
+    return None
+
+
+DraftKey = Annotated[str, Path(max_length=64, pattern=r"^[\w-]+$")]
+
+
+@router.get("/drafts/", response_model=list[DraftResponse])
+async def get_drafts(request: Request):
+    return await request.app.state.draft_buffer.list()
+
+
+@router.get("/drafts/stats")
+async def drafts_stats(request: Request):
+    return request.app.state.draft_buffer.stats()
+
+
+@router.get("/drafts/{key}", response_model=DraftResponse)
+async def get_draft(key: DraftKey, request: Request):
+    draft = await request.app.state.draft_buffer.get(key)
+    if draft is None:
+        raise HTTPException(status_code=404, detail="Черновик не найден")
+    return draft
+
+
+@router.put("/drafts/{key}", response_model=DraftResponse, status_code=status.HTTP_202_ACCEPTED)
+async def save_draft(key: DraftKey, draft: DraftUpdate, request: Request):
+    # 202: черновик сохранён в памяти и попадёт в базу со следующей пачкой
+    return request.app.state.draft_buffer.put(key, draft.model_dump())
+
+
+@router.delete("/drafts/{key}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_draft(key: DraftKey, request: Request):
+    request.app.state.draft_buffer.delete(key)
     return None
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics(request: Request):
+    metrics = request.app.state.metrics
+    if metrics is None:
+        raise HTTPException(status_code=404, detail="Метрики отключены (NOTES_METRICS=0)")
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_MEDIA_TYPE)
+
+
+@router.get("/cache/stats")
+async def cache_stats(request: Request):
+    return request.app.state.read_cache.stats()
+
+
+def parse_event_id(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+@router.get("/events")
+async def events(request: Request, last_event_id: Optional[str] = Header(None)):
+    event_hub = request.app.state.event_hub
+    if event_hub.full:
+        raise HTTPException(status_code=503, detail="Слишком много подписчиков")
+
+    resume = parse_event_id(last_event_id)
+    frames = []
+    # Сессия закрывается до начала потока: подписчик не держит соединение пула
+    async with request.app.state.database.AsyncSession() as db:
+        seq = await get_event_seq_async(db)
+        event_hub.prime(seq)
+        cursor = seq
+        if resume is not None and resume > seq:
+            frames.append(format_event(seq, "reset", f'{{"seq":{seq}}}'))
+        elif resume is not None and event_hub.covers(resume):
+            cursor = resume
+        elif resume is not None and resume < seq:
+            # Пропущенное до старта буфера дочитывается из журнала изменений
+            changes = await get_changes_async(db, resume)
+            # При шардах номер события не является курсором журнала: журнал
+            # ответит сбросом, поток продолжится с текущего номера
+            cursor = changes["seq"] if isinstance(changes["seq"], int) else seq
+            if changes["reset"]:
+                frames.append(format_event(cursor, "reset", f'{{"seq":{cursor}}}'))
+            else:
+                missed = [(note.id, "update", note.change_date or note.created_date) for note in changes["notes"]]
+                missed.extend((id, "delete", None) for id in changes["deleted"])
+                frames.append(format_event(cursor, "change", change_payload(cursor, missed)))
+
+    async def body():
+        yield "retry: 3000\n\n"
+        for frame in frames:
+            yield frame
+        async for frame in event_hub.stream(cursor):
+            yield frame
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/events/stats")
+async def events_stats(request: Request):
+    return request.app.state.event_hub.stats()
+
+
+@router.post("/exports", response_model=ExportJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_export(export: ExportJobRequest, request: Request):
+    return request.app.state.export_jobs.submit(export.format, export.ids)
+
+
+@router.get("/exports/{job_id}", response_model=ExportJobResponse,
+         responses={200: {"description": "Готовый файл экспорта"}})
+async def get_export(job_id: str, request: Request):
+    job = request.app.state.export_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача экспорта не найдена")
+
+    if job.status == "done":
+        if not os.path.exists(job.path):
+            raise HTTPException(status_code=410, detail="Файл экспорта устарел")
+        return FileResponse(job.path, media_type=EXPORT_MEDIA_TYPES[job.format],
+                            filename=f"notes.{job.format}")
+
+    # Завершившаяся ошибкой задача - обычный результат опроса: 200 со status "failed"
+    content = ExportJobResponse.model_validate(job).model_dump(mode="json")
+    status_code = status.HTTP_200_OK if job.status == "failed" else status.HTTP_202_ACCEPTED
+    return JSONResponse(status_code=status_code, content=content)
+
+
+def create_app(settings: Optional[StorageSettings] = None) -> FastAPI:
+    """Приложение поверх хранилища settings (по умолчанию - из переменных окружения NOTES_DB_*).
+
+    Движки, кэш чтений и фоновые службы у каждого приложения свои (app.state).
+    Движки создаются сразу, но соединяются с базой лениво; схему проверяет
+    lifespan при запуске каждого воркера. Для uvicorn --factory: main:create_app.
+    """
+    app = FastAPI(title="Notes API", version="1.0.0", lifespan=lifespan)
+    state = app.state
+    state.read_cache = ReadCache(maxsize=int(os.environ.get("NOTES_CACHE_SIZE", 256)),
+                                 ttl=float(os.environ.get("NOTES_CACHE_TTL", 30)))
+    state.event_hub = EventHub(
+        history=int(os.environ.get("NOTES_EVENTS_HISTORY", 1024)),
+        heartbeat=float(os.environ.get("NOTES_EVENTS_HEARTBEAT", 15)),
+        max_subscribers=int(os.environ.get("NOTES_EVENTS_MAX_SUBSCRIBERS", 10000))
+    )
+    state.database = sql.Database(settings or load_storage_settings(), state.read_cache, state.event_hub)
+    state.assets = StaticAssets()
+    state.export_jobs = ExportJobManager(state.database.AsyncSession)
+    state.trash_retention = TrashRetention(state.database.AsyncSession, load_retention_settings())
+    state.draft_buffer = DraftBuffer(state.database.AsyncSession, load_draft_settings())
+    state.metrics = Metrics() if METRICS_ENABLED else None
+    # Длительность этапов запуска воркера в мс; заполняется в lifespan
+    state.startup = {}
+
+    app.include_router(router)
+    app.add_exception_handler(StarletteHTTPException, http_exception_handler)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["sysinfo.ro", "46.173.28.153"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER, QUERY_PLAN_HEADER, "ETag"],
+    )
+    metrics = state.metrics
+    if metrics is not None:
+        metrics.register_stats("notes_cache", state.read_cache.stats,
+                               counters=("hits", "misses", "coalesced", "evictions", "invalidations"))
+        metrics.register_stats("notes_events", state.event_hub.stats, counters=("published", "resets"))
+        metrics.register_stats("notes_drafts", state.draft_buffer.stats,
+                               counters=("puts", "coalesced", "commits", "written", "evicted"))
+        metrics.register_stats("notes_startup", lambda: state.startup)
+        for shard in state.database.shards:
+            metrics.instrument_engine(shard.async_engine.sync_engine,
+                                      "async" if shard.index == 0 else f"async_shard{shard.index}")
+        # Последний добавленный middleware - внешний: в задержку входит и CORS
+        app.add_middleware(MetricsMiddleware, metrics=metrics)
+    return app
+
+
+IMPORT_MS = round((time.perf_counter() - IMPORT_STARTED) * 1000, 1)
+app = create_app()
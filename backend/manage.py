@@ -0,0 +1,58 @@
+"""Команды развёртывания.
+
+    python manage.py migrate   - создать или обновить схему базы; выполняется один раз
+                                 на развёртывание, до запуска воркеров с NOTES_DB_SCHEMA=check
+    python manage.py check     - проверить схему, ничего не меняя; код выхода 1, если она устарела
+    python manage.py rebalance - разложить заметки по шардам после изменения NOTES_DB_SHARDS;
+                                 выполняется при остановленных воркерах
+
+База и параметры хранилища берутся из переменных окружения NOTES_DB_*.
+"""
+
+import argparse
+import os
+import sys
+import time
+from dataclasses import replace
+
+import sql
+from settings import load_storage_settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=("migrate", "check", "rebalance"))
+    args = parser.parse_args()
+
+    database = sql.Database(replace(load_storage_settings(), schema="auto"))
+    # Несуществующий файл базы - схема версии 0, её создаст migrate
+    versions = {
+        shard.database: sql.get_schema_version(shard.engine) if os.path.exists(shard.database) else 0
+        for shard in database.shards
+    }
+    if args.command == "check":
+        outdated = {path: version for path, version in versions.items() if version != sql.SCHEMA_VERSION}
+        for path, version in outdated.items():
+            print(f"Схема {path}: версия {version}, нужна {sql.SCHEMA_VERSION}")
+        if outdated:
+            sys.exit(1)
+        print(f"Схема {', '.join(versions)} актуальна (версия {sql.SCHEMA_VERSION})")
+        return
+
+    started = time.perf_counter()
+    if args.command == "rebalance":
+        moved = database.rebalance()
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"Перенесено заметок: {moved} за {elapsed:.0f} мс, шардов: {database.settings.shards}")
+        return
+
+    migrated = database.ensure_schemas()
+    elapsed = (time.perf_counter() - started) * 1000
+    if migrated:
+        print(f"Схема {', '.join(versions)} обновлена до версии {sql.SCHEMA_VERSION} за {elapsed:.0f} мс")
+    else:
+        print(f"Схема {', '.join(versions)} уже актуальна (версия {sql.SCHEMA_VERSION})")
+
+
+if __name__ == "__main__":
+    main()
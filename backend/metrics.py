@@ -0,0 +1,247 @@
+import asyncio
+import contextvars
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин гистограмм в секундах: от быстрых чтений по индексу до медленных экспортов
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Маршрут для запросов, не совпавших ни с одним маршрутом: путь в метку не попадает,
+# иначе сканеры адресов раздували бы число рядов
+UNMATCHED_ROUTE = "<unmatched>"
+# Потоковые ответы, задержка которых измеряется до начала ответа
+STREAMING_MEDIA_TYPE = b"text/event-stream"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.label_names = name, help, labels
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, labels: Tuple = (), amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels: Tuple = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма Prometheus: запись - поиск корзины и три сложения."""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help, self.label_names = name, help, labels
+        self.buckets = buckets
+        # По каждому набору меток: счётчики корзин (последняя - +Inf), сумма, количество
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, labels: Tuple = ()) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, labels: Tuple = ()) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def sum(self, labels: Tuple = ()) -> float:
+        series = self._series.get(labels)
+        return series[1] if series else 0.0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class RequestTiming:
+    """Время SQL, набранное одним HTTP-запросом."""
+
+    __slots__ = ("db_seconds", "db_statements")
+
+    def __init__(self):
+        self.db_seconds = 0.0
+        self.db_statements = 0
+
+
+# Текущий HTTP-запрос. Контекст переходит в greenlet, в котором SQLAlchemy
+# выполняет запросы асинхронного движка, поэтому хуки курсора видят запрос
+_current_request: contextvars.ContextVar[Optional[RequestTiming]] = contextvars.ContextVar(
+    "current_request", default=None
+)
+
+
+class Metrics:
+    """Реестр метрик приложения в текстовом формате Prometheus.
+
+    Запись метрик - несколько операций со словарями в памяти; текст
+    собирается только при запросе /metrics. Внешние счётчики (кэш, SSE,
+    черновики) читаются из их stats() в момент выгрузки.
+    """
+
+    def __init__(self):
+        route = ("method", "route")
+        self.requests = Counter("notes_http_requests_total", "HTTP-запросы по маршруту и статусу",
+                                route + ("status",))
+        self.latency = Histogram("notes_http_request_duration_seconds", "Время обработки HTTP-запроса", route)
+        self.request_db = Histogram("notes_http_request_db_seconds", "Время SQL внутри HTTP-запроса", route)
+        self.request_statements = Histogram("notes_http_request_db_statements", "SQL-запросов на HTTP-запрос",
+                                            route, buckets=(1, 2, 3, 5, 10, 25, 50, 100))
+        self.statements = Histogram("notes_db_statement_duration_seconds", "Время выполнения SQL-запроса",
+                                    ("operation",))
+        self.pool_wait = Histogram("notes_db_pool_wait_seconds", "Ожидание соединения из пула")
+        self.loop_lag = Histogram("notes_event_loop_lag_seconds", "Задержка цикла событий")
+        self._engines: List = []
+        self._collectors: List[Tuple[str, Callable[[], dict], Tuple[str, ...]]] = []
+
+    def register_stats(self, prefix: str, stats: Callable[[], dict], counters: Iterable[str] = ()) -> None:
+        """Числовые поля stats() выгружаются как prefix_<поле>; counters - как счётчики."""
+        self._collectors.append((prefix, stats, tuple(counters)))
+
+    def _stats_lines(self) -> List[str]:
+        lines = []
+        for prefix, stats, counters in self._collectors:
+            for key, value in stats().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                kind = "counter" if key in counters else "gauge"
+                name = f"{prefix}_{key}_total" if kind == "counter" else f"{prefix}_{key}"
+                lines += [f"# TYPE {name} {kind}", f"{name} {_number(value)}"]
+        return lines
+
+    def _pool_lines(self) -> List[str]:
+        lines = []
+        # Эти методы есть только у QueuePool; у NullPool и пулов SQLite в памяти их нет
+        for gauge in ("checkedout", "size", "overflow"):
+            metric = f"notes_db_pool_{gauge}"
+            values = [(name, getattr(engine.pool, gauge)()) for name, engine in self._engines
+                      if callable(getattr(engine.pool, gauge, None))]
+            if values:
+                lines.append(f"# TYPE {metric} gauge")
+                lines += [f'{metric}{{engine="{name}"}} {value}' for name, value in values]
+        return lines
+
+    def instrument_engine(self, engine, name: str = "async") -> None:
+        """Хуки курсора: время каждого SQL-запроса и его доля в текущем HTTP-запросе."""
+        # Хуки на движке должны быть одни, сколько бы раз его ни инструментировали
+        if any(known is engine for _, known in self._engines):
+            return
+        self._engines.append((name, engine))
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info["query_started"].pop()
+            operation = statement.lstrip()[:6].upper()
+            if operation not in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+                operation = "OTHER"
+            self.statements.observe(elapsed, (operation,))
+            timing = _current_request.get()
+            if timing is not None:
+                timing.db_seconds += elapsed
+                timing.db_statements += 1
+
+        @event.listens_for(engine, "handle_error")
+        def failed(context):
+            started = context.connection.info.get("query_started") if context.connection is not None else None
+            if started:
+                started.pop()
+
+    async def run_loop_monitor(self, interval: float = 0.5) -> None:
+        # Насколько позже заказанного просыпается задача: время, пока цикл
+        # событий был занят синхронной работой других обработчиков
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(max(0.0, time.perf_counter() - started - interval))
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.requests, self.latency, self.request_db, self.request_statements,
+                       self.statements, self.pool_wait, self.loop_lag):
+            lines += metric.render()
+        lines += self._pool_lines()
+        lines += self._stats_lines()
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: задержка и статус по шаблону маршрута, время SQL запроса."""
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = _current_request.set(timing)
+        started = time.perf_counter()
+        status = 500
+        first_byte = None
+
+        async def send_with_status(message):
+            nonlocal status, first_byte
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # Поток событий (/events) открыт минутами: для него в задержку
+                # маршрута идёт только время до начала ответа
+                headers = dict(message.get("headers", ()))
+                if headers.get(b"content-type", b"").startswith(STREAMING_MEDIA_TYPE):
+                    first_byte = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _current_request.reset(token)
+            # Маршрутизатор Starlette кладёт найденный маршрут в scope
+            route = scope.get("route")
+            labels = (scope["method"], getattr(route, "path", UNMATCHED_ROUTE))
+            metrics = self.metrics
+            metrics.requests.inc(labels + (str(status),))
+            metrics.latency.observe((first_byte or time.perf_counter()) - started, labels)
+            if timing.db_statements:
+                metrics.request_db.observe(timing.db_seconds, labels)
+                metrics.request_statements.observe(timing.db_statements, labels)
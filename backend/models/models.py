@@ -1,5 +1,5 @@
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, DateTime, Integer
+from sqlalchemy import String, DateTime, Integer, Index, func, text
 from datetime import datetime
 from typing import Optional
 
@@ -8,25 +8,80 @@ class Base(DeclarativeBase):
     pass
 
 
+# Заметка в корзине - это строка notes с заполненной deleted_date. Индексы
+# частичные: списки заметок и корзины читают только свою часть таблицы.
+LIVE_WHERE = text("deleted_date IS NULL")
+TRASHED_WHERE = text("deleted_date IS NOT NULL")
+
+# Длина превью текста для карточек списка
+PREVIEW_LENGTH = 160
+
+
 class NoteBase(Base):
     __tablename__ = "notes"
+    __table_args__ = (
+        Index("ix_notes_created_date_id", "created_date", "id", sqlite_where=LIVE_WHERE),
+        Index("ix_notes_headline_id", "headline", "id", sqlite_where=LIVE_WHERE),
+        Index("ix_notes_improtance_id", "improtance", "id", sqlite_where=LIVE_WHERE),
+        Index("ix_notes_deleted_date_id", "deleted_date", "id", sqlite_where=TRASHED_WHERE),
+        Index("ix_notes_change_seq", "change_seq"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     headline: Mapped[Optional[str]] = mapped_column(String(45))
-    text: Mapped[Optional[str]] = mapped_column(String(10000))
+    preview: Mapped[Optional[str]] = mapped_column(String(PREVIEW_LENGTH))
     improtance: Mapped[int] = mapped_column(Integer)
     created_date: Mapped[datetime] = mapped_column(DateTime)
     change_date: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    deleted_date: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    # Номер последнего изменения заметки в журнале изменений (см. sql.get_changes)
+    change_seq: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    # Номер версии заметки для оптимистичной блокировки (ETag и If-Match)
+    version: Mapped[int] = mapped_column(Integer, default=1, server_default="1")
+    # Текст - последний столбец записи: длинный текст уходит в overflow-страницы,
+    # и списки, которые его не читают, не проходят по ним к следующим столбцам
+    text: Mapped[Optional[str]] = mapped_column(String(10000))
 
 
-class TrashedNote(Base):
-    __tablename__ = "trashed_notes"
+# Сортировка и фильтрация по дате изменения используют дату создания
+# для заметок, которые ни разу не менялись.
+Index(
+    "ix_notes_last_modified_id",
+    func.coalesce(NoteBase.change_date, NoteBase.created_date),
+    NoteBase.id,
+    sqlite_where=LIVE_WHERE,
+)
 
-    id: Mapped[int] = mapped_column(primary_key=True)
-    original_id: Mapped[int] = mapped_column(Integer)
+
+class CollectionVersion(Base):
+    __tablename__ = "collection_versions"
+
+    name: Mapped[str] = mapped_column(String(32), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class NoteTombstone(Base):
+    """Отметка об окончательно удалённой заметке для синхронизации клиентов."""
+
+    __tablename__ = "note_tombstones"
+    __table_args__ = (
+        Index("ix_note_tombstones_seq", "seq"),
+    )
+
+    note_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    seq: Mapped[int] = mapped_column(Integer)
+    deleted_date: Mapped[datetime] = mapped_column(DateTime)
+
+
+class NoteDraft(Base):
+    """Черновик редактора, сохраняемый автоматически (см. drafts.DraftBuffer)."""
+
+    __tablename__ = "drafts"
+
+    # Ключ задаёт клиент: id заметки или метка новой, ещё не созданной заметки
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    note_id: Mapped[Optional[int]] = mapped_column(Integer)
     headline: Mapped[Optional[str]] = mapped_column(String(45))
+    improtance: Mapped[Optional[int]] = mapped_column(Integer)
+    updated_date: Mapped[datetime] = mapped_column(DateTime)
     text: Mapped[Optional[str]] = mapped_column(String(10000))
-    improtance: Mapped[int] = mapped_column(Integer)
-    created_date: Mapped[datetime] = mapped_column(DateTime)
-    change_date: Mapped[Optional[datetime]] = mapped_column(DateTime)
-    deleted_date: Mapped[datetime] = mapped_column(DateTime)
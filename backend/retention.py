@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from settings import RetentionSettings
+from sql import (
+    count_expired_trash_async, purge_trash_batch_async,
+    count_expired_tombstones_async, compact_tombstones_async, utc_now
+)
+
+logger = logging.getLogger("uvicorn.error")
+
+
+@dataclass
+class PurgeBatch:
+    removed: int
+    duration_ms: float
+
+
+@dataclass
+class PurgeReport:
+    dry_run: bool
+    cutoff: datetime
+    removed: int = 0
+    tombstones_removed: int = 0
+    batches: List[PurgeBatch] = field(default_factory=list)
+    duration_ms: float = 0.0
+    started_at: datetime = field(default_factory=utc_now)
+
+
+class TrashRetention:
+    """Фоновая очистка корзины от заметок старше заданного срока."""
+
+    def __init__(self, session_factory, settings: RetentionSettings):
+        self.session_factory = session_factory
+        self.settings = settings
+        self.last_report: Optional[PurgeReport] = None
+        # Плановая и ручная очистка не выполняются одновременно
+        self._lock = asyncio.Lock()
+
+    def cutoff(self, max_age_days: Optional[float] = None) -> datetime:
+        days = self.settings.max_age_days if max_age_days is None else max_age_days
+        return utc_now() - timedelta(days=days)
+
+    async def purge(self, dry_run: bool = False, max_age_days: Optional[float] = None) -> PurgeReport:
+        async with self._lock:
+            report = PurgeReport(dry_run=dry_run, cutoff=self.cutoff(max_age_days))
+            started = time.perf_counter()
+
+            tombstone_cutoff = utc_now() - timedelta(days=self.settings.tombstone_max_age_days)
+            if dry_run:
+                async with self.session_factory() as session:
+                    report.removed = await count_expired_trash_async(session, report.cutoff)
+                    report.tombstones_removed = await count_expired_tombstones_async(session, tombstone_cutoff)
+            else:
+                await self._purge_batches(report)
+                async with self.session_factory() as session:
+                    report.tombstones_removed = await compact_tombstones_async(session, tombstone_cutoff)
+                    await session.commit()
+
+            report.duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            self.last_report = report
+            if report.removed or not dry_run:
+                logger.info(
+                    "Очистка корзины%s: %d заметок старше %s, %d порций, %d отметок об удалении, %.1f мс",
+                    " (пробный запуск)" if dry_run else "", report.removed,
+                    report.cutoff.isoformat(timespec="seconds"), len(report.batches),
+                    report.tombstones_removed, report.duration_ms
+                )
+            return report
+
+    async def _purge_batches(self, report: PurgeReport) -> None:
+        batch_size = self.settings.batch_size
+        while True:
+            started = time.perf_counter()
+            # Каждая порция - отдельная короткая транзакция: блокировка записи
+            # SQLite не удерживается дольше одной порции
+            async with self.session_factory() as session:
+                removed = await purge_trash_batch_async(session, report.cutoff, batch_size)
+                await session.commit()
+            duration_ms = round((time.perf_counter() - started) * 1000, 2)
+
+            if removed:
+                report.batches.append(PurgeBatch(removed=removed, duration_ms=duration_ms))
+                report.removed += removed
+            if removed < batch_size:
+                return
+            await asyncio.sleep(self.settings.pause)
+
+    async def run_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.settings.interval)
+            try:
+                await self.purge()
+            except Exception:
+                logger.exception("Ошибка очистки корзины")
@@ -0,0 +1,101 @@
+import gzip
+import json
+from datetime import datetime
+from typing import Any, Iterable, List, Mapping, Optional, Tuple
+
+from fastapi import Request, Response
+
+from static_assets import parse_accept_encoding
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен, без него используется стандартный json
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # без msgpack MessagePack не предлагается
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# Меньшие ответы сжимать невыгодно: на списках до 8 КиБ gzip стоит больше CPU,
+# чем экономит orjson. Уровень 1 сжимает списки заметок почти так же, как 6,
+# и втрое быстрее (benchmarks/bench_serialization.py)
+GZIP_MIN_SIZE = 8192
+GZIP_LEVEL = 1
+# Сжатый ответ отличается от исходного и получает свой ETag (как в mod_deflate)
+GZIP_ETAG_SUFFIX = "-gzip"
+
+# Поля ответа в порядке NoteResponse и TrashedNoteResponse; (имя, источник)
+NOTE_FIELDS: Tuple[Tuple[str, str], ...] = tuple(
+    (name, name) for name in ("id", "headline", "text", "improtance", "created_date", "change_date", "version")
+)
+TRASHED_FIELDS = NOTE_FIELDS[:1] + (("original_id", "id"),) + NOTE_FIELDS[1:] + (("deleted_date", "deleted_date"),)
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется")
+
+
+def project(items: Iterable[Any], fields: Tuple[Tuple[str, str], ...]) -> List[dict]:
+    """Строки ответа прямо из снимков кэша (словарей) или объектов ORM, без pydantic."""
+    rows = []
+    for item in items:
+        if isinstance(item, dict):
+            rows.append({name: item[source] for name, source in fields})
+        else:
+            rows.append({name: getattr(item, source) for name, source in fields})
+    return rows
+
+
+def encode_json(rows: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(rows)
+    return json.dumps(rows, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def encode_msgpack(rows: Any) -> bytes:
+    return msgpack.packb(rows, default=_default, use_bin_type=True)
+
+
+def negotiate_media_type(accept: Optional[str]) -> str:
+    if msgpack is None:
+        return JSON_MEDIA_TYPE
+    accepted = parse_accept_encoding(accept)
+    json_quality = max(accepted.get(JSON_MEDIA_TYPE, 0), accepted.get("*/*", 0), accepted.get("application/*", 0))
+    for media_type in MSGPACK_MEDIA_TYPES:
+        quality = accepted.get(media_type, 0)
+        if quality > 0 and quality >= json_quality:
+            return media_type
+    return JSON_MEDIA_TYPE
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    accepted = parse_accept_encoding(accept_encoding)
+    return accepted.get("gzip", accepted.get("*", 0)) > 0
+
+
+def fast_response(request: Request, rows: List[dict], headers: Mapping[str, str],
+                  status_code: int = 200, negotiate: bool = True) -> Response:
+    """Ответ со списком строк: быстрый кодировщик, MessagePack по Accept, gzip для больших тел.
+
+    С negotiate=False ответ всегда JSON без сжатия и не зависит от Accept и Accept-Encoding.
+    """
+    media_type = negotiate_media_type(request.headers.get("accept")) if negotiate else JSON_MEDIA_TYPE
+    body = encode_json(rows) if media_type == JSON_MEDIA_TYPE else encode_msgpack(rows)
+    headers = {key: value for key, value in headers.items() if key.lower() != "content-length"}
+    if not negotiate:
+        return Response(body, status_code=status_code, media_type=media_type, headers=headers)
+    headers["Vary"] = "Accept, Accept-Encoding"
+    if len(body) >= GZIP_MIN_SIZE and accepts_gzip(request.headers.get("accept-encoding")):
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+        etag = headers.get("etag") or headers.get("ETag")
+        if etag:
+            headers.pop("etag", None)
+            headers["ETag"] = etag[:-1] + GZIP_ETAG_SUFFIX + '"'
+    return Response(body, status_code=status_code, media_type=media_type, headers=headers)
@@ -0,0 +1,205 @@
+import os
+import tomllib
+from dataclasses import dataclass, fields, replace, asdict
+from typing import Mapping, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATABASE = os.path.join(BACKEND_DIR, "db", "data.db")
+
+JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+SYNCHRONOUS_LEVELS = {"OFF", "NORMAL", "FULL", "EXTRA"}
+TEMP_STORES = {"DEFAULT", "FILE", "MEMORY"}
+POOLS = {"queue", "null"}
+# auto - воркер сам создаёт или мигрирует схему (под блокировкой, один на всех);
+# check - только проверяет: схему заранее готовит шаг развёртывания manage.py migrate
+SCHEMA_MODES = {"auto", "check"}
+
+
+@dataclass(frozen=True)
+class StorageSettings:
+    """Параметры хранилища SQLite, применяемые к каждому соединению пула."""
+
+    profile: str = "durable"
+    database: str = DEFAULT_DATABASE
+    journal_mode: str = "WAL"
+    synchronous: str = "FULL"
+    # Байты, отображаемые в память; 0 - mmap выключен
+    mmap_size: int = 0
+    # Отрицательное значение - размер кэша страниц в КиБ, положительное - в страницах
+    cache_size: int = -2000
+    temp_store: str = "DEFAULT"
+    busy_timeout: int = 5000
+    pool: str = "queue"
+    pool_size: int = 5
+    max_overflow: int = 10
+    schema: str = "auto"
+    # Число файлов, по которым распределяются заметки; 1 - один файл database
+    shards: int = 1
+
+    def pragmas(self) -> dict:
+        return {
+            "journal_mode": self.journal_mode,
+            "synchronous": self.synchronous,
+            "mmap_size": self.mmap_size,
+            "cache_size": self.cache_size,
+            "temp_store": self.temp_store,
+            "busy_timeout": self.busy_timeout,
+        }
+
+    def shard_database(self, index: int) -> str:
+        # Шард 0 - основной файл: в нём же черновики; остальные - data.shard1.db и т.д.
+        if index == 0:
+            return self.database
+        stem, extension = os.path.splitext(self.database)
+        return f"{stem}.shard{index}{extension}"
+
+    def describe(self) -> str:
+        return ", ".join(f"{key}={value}" for key, value in asdict(self).items())
+
+
+# durable: WAL с fsync на каждый коммит - ни одна подтверждённая запись не теряется.
+# throughput: fsync только при checkpoint (после сбоя питания можно потерять
+# последние коммиты, но не целостность базы), большой кэш страниц и mmap.
+PRESETS = {
+    "durable": StorageSettings(profile="durable"),
+    "throughput": StorageSettings(
+        profile="throughput",
+        synchronous="NORMAL",
+        mmap_size=256 * 1024 * 1024,
+        cache_size=-64 * 1024,
+        temp_store="MEMORY",
+        pool_size=10,
+        max_overflow=20,
+    ),
+}
+
+# Переменные окружения переопределяют и профиль, и файл конфигурации
+ENV_PREFIX = "NOTES_DB_"
+
+
+def _coerce(name: str, value) -> object:
+    field_type = {f.name: f.type for f in fields(StorageSettings)}[name]
+    if field_type is int:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Параметр хранилища {name} должен быть целым числом: {value!r}")
+    return str(value)
+
+
+def _validate(settings: StorageSettings) -> StorageSettings:
+    choices = {
+        "journal_mode": JOURNAL_MODES,
+        "synchronous": SYNCHRONOUS_LEVELS,
+        "temp_store": TEMP_STORES,
+    }
+    normalized = {name: getattr(settings, name).upper() for name in choices}
+    for name, allowed in choices.items():
+        if normalized[name] not in allowed:
+            raise ValueError(f"Недопустимое значение {name}: {getattr(settings, name)}")
+    if settings.pool not in POOLS:
+        raise ValueError(f"Недопустимый пул соединений: {settings.pool}")
+    if settings.schema not in SCHEMA_MODES:
+        raise ValueError(f"Недопустимый режим схемы: {settings.schema}")
+    if settings.shards < 1:
+        raise ValueError(f"Число шардов должно быть не меньше 1: {settings.shards}")
+    return replace(settings, **normalized)
+
+
+def load_storage_settings(environ: Optional[Mapping[str, str]] = None) -> StorageSettings:
+    environ = os.environ if environ is None else environ
+
+    config = {}
+    config_path = environ.get(ENV_PREFIX + "CONFIG")
+    if config_path:
+        with open(config_path, "rb") as file:
+            config = tomllib.load(file)
+        config = dict(config.get("storage", config))
+
+    profile = environ.get(ENV_PREFIX + "PROFILE") or config.pop("profile", "durable")
+    config.pop("profile", None)
+    if profile not in PRESETS:
+        raise ValueError(f"Неизвестный профиль хранилища: {profile}")
+
+    overrides = dict(config)
+    for field in fields(StorageSettings):
+        value = environ.get(ENV_PREFIX + field.name.upper())
+        if value is not None and field.name != "profile":
+            overrides[field.name] = value
+
+    unknown = set(overrides) - {field.name for field in fields(StorageSettings)}
+    if unknown:
+        raise ValueError(f"Неизвестные параметры хранилища: {', '.join(sorted(unknown))}")
+    overrides = {name: _coerce(name, value) for name, value in overrides.items()}
+    return _validate(replace(PRESETS[profile], **overrides))
+
+
+def apply_pragmas(dbapi_connection, settings: StorageSettings) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in settings.pragmas().items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+@dataclass(frozen=True)
+class RetentionSettings:
+    """Очистка корзины: заметки старше max_age_days удаляются фоновой задачей."""
+
+    max_age_days: float = 30
+    # Отметки об удалении для синхронизации клиентов хранятся столько же дней;
+    # клиент, не синхронизировавшийся дольше, загружает список заново
+    tombstone_max_age_days: float = 30
+    batch_size: int = 500
+    # Пауза между порциями: между ними успевают пройти запросы других пользователей
+    pause: float = 0.05
+    interval: float = 3600
+    enabled: bool = True
+
+
+def _env_overrides(cls, prefix: str, environ: Mapping[str, str], label: str) -> dict:
+    overrides = {}
+    try:
+        for field in fields(cls):
+            value = environ.get(prefix + field.name.upper())
+            if value is None:
+                continue
+            if field.type is bool:
+                overrides[field.name] = value.lower() not in ("0", "false", "no", "off")
+            else:
+                overrides[field.name] = field.type(value)
+    except ValueError:
+        raise ValueError(f"Некорректный параметр {label}: {field.name}={value!r}")
+    return overrides
+
+
+def load_retention_settings(environ: Optional[Mapping[str, str]] = None) -> RetentionSettings:
+    environ = os.environ if environ is None else environ
+    overrides = _env_overrides(RetentionSettings, "NOTES_TRASH_", environ, "очистки корзины")
+    settings = replace(RetentionSettings(), **overrides)
+    if (settings.batch_size < 1 or settings.max_age_days < 0 or settings.tombstone_max_age_days < 0
+            or settings.interval <= 0 or settings.pause < 0):
+        raise ValueError("Некорректные параметры очистки корзины")
+    return settings
+
+
+@dataclass(frozen=True)
+class DraftSettings:
+    """Черновики: сохранения копятся в памяти и записываются в базу пачками."""
+
+    # Как часто изменённые черновики записываются в базу одной транзакцией
+    flush_interval: float = 10
+    # Сколько черновиков держать в памяти; вытесняются уже записанные
+    max_entries: int = 1000
+    # При стольких незаписанных черновиках запись начинается не дожидаясь интервала
+    max_dirty: int = 200
+
+
+def load_draft_settings(environ: Optional[Mapping[str, str]] = None) -> DraftSettings:
+    environ = os.environ if environ is None else environ
+    overrides = _env_overrides(DraftSettings, "NOTES_DRAFTS_", environ, "черновиков")
+    settings = replace(DraftSettings(), **overrides)
+    if settings.flush_interval <= 0 or settings.max_entries < 1 or not 1 <= settings.max_dirty <= settings.max_entries:
+        raise ValueError("Некорректные параметры черновиков")
+    return settings
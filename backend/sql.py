@@ -1,101 +1,1502 @@
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
-from datetime import datetime
-from typing import Optional, List
+from sqlalchemy.orm import sessionmaker, Session as OrmSession
+from sqlalchemy import create_engine, event, select, insert, update, delete, func, tuple_, asc, desc, text, DDL, DateTime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool, NullPool
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from itertools import count, groupby, islice
+from typing import Any, Optional, List, Tuple, Iterable, Union
+import asyncio
+import base64
+import heapq
+import json
 import os
+import re
 
-from models.models import Base, NoteBase, TrashedNote
+try:
+    import fcntl
+except ImportError:  # без fcntl (Windows) миграции не блокируются; init_db можно повторять
+    fcntl = None
 
-os.makedirs("db", exist_ok=True)
-engine = create_engine("sqlite:///db/data.db", echo=False)
-Base.metadata.create_all(engine)
+from cache import ReadCache, invalidate_all
+from events import EventHub, publish_all
+from models.models import Base, NoteBase, NoteTombstone, CollectionVersion, NoteDraft, PREVIEW_LENGTH
+from settings import StorageSettings, apply_pragmas
 
-Session = sessionmaker(bind=engine)
+def _pool_options(settings: StorageSettings, is_async: bool) -> dict:
+    if settings.pool == "null":
+        return {"poolclass": NullPool}
+    return {
+        "poolclass": AsyncAdaptedQueuePool if is_async else QueuePool,
+        "pool_size": settings.pool_size,
+        "max_overflow": settings.max_overflow,
+    }
+
+
+def create_engines(settings: StorageSettings):
+    """Синхронный и асинхронный движки с PRAGMA из настроек на каждом соединении пула."""
+    sync_engine = create_engine(f"sqlite:///{settings.database}", echo=False,
+                                **_pool_options(settings, is_async=False))
+    # Асинхронный движок для обработчиков FastAPI: запросы к SQLite выполняются
+    # в потоке aiosqlite и не блокируют цикл событий.
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{settings.database}", echo=False,
+                                       **_pool_options(settings, is_async=True))
+    for target in (sync_engine, async_engine.sync_engine):
+        event.listen(target, "connect", lambda dbapi_connection, _: apply_pragmas(dbapi_connection, settings))
+    return sync_engine, async_engine
+
+
+@dataclass
+class Shard:
+    """Файл базы с частью заметок: заметка с id хранится в шарде id % числа шардов."""
+    index: int
+    database: str
+    engine: Any
+    async_engine: Any
+    sessions: async_sessionmaker
+
+
+def _shard_settings(settings: StorageSettings, index: int) -> StorageSettings:
+    return replace(settings, database=settings.shard_database(index))
+
+
+# Полнотекстовый индекс FTS5 по заголовку и тексту заметок. Таблица хранит
+# только индекс (content='notes'), а триггеры поддерживают его в актуальном
+# состоянии при любом INSERT/UPDATE/DELETE в notes, включая перемещение в
+# корзину и восстановление из неё.
+NOTES_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+        headline, text, content='notes', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS notes_fts_ai AFTER INSERT ON notes BEGIN
+        INSERT INTO notes_fts(rowid, headline, text) VALUES (new.id, new.headline, new.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS notes_fts_ad AFTER DELETE ON notes BEGIN
+        INSERT INTO notes_fts(notes_fts, rowid, headline, text)
+        VALUES ('delete', old.id, old.headline, old.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS notes_fts_au AFTER UPDATE OF headline, text ON notes BEGIN
+        INSERT INTO notes_fts(notes_fts, rowid, headline, text)
+        VALUES ('delete', old.id, old.headline, old.text);
+        INSERT INTO notes_fts(rowid, headline, text) VALUES (new.id, new.headline, new.text);
+    END""",
+]
+
+for statement in NOTES_FTS_DDL:
+    event.listen(NoteBase.__table__, "after_create", DDL(statement))
+
+
+# Индексы, которые до перехода на мягкое удаление были полными: при миграции
+# они удаляются и создаются заново как частичные
+LIVE_INDEXES = ("ix_notes_created_date_id", "ix_notes_headline_id",
+                "ix_notes_improtance_id", "ix_notes_last_modified_id")
+NOTE_COLUMNS = "headline, text, improtance, created_date, change_date, deleted_date"
+
+
+def _migrate_soft_delete(conn) -> None:
+    columns = {row.name for row in conn.execute(text("PRAGMA table_info(notes)"))}
+    if "deleted_date" not in columns:
+        conn.execute(text("ALTER TABLE notes ADD COLUMN deleted_date DATETIME"))
+        for name in LIVE_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+    has_trashed_table = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'trashed_notes'"
+    )).first()
+    if not has_trashed_table:
+        return
+
+    # Заметки из старой таблицы корзины возвращаются в notes под прежним id,
+    # если он не занят, иначе получают новый
+    taken = set(conn.execute(text("SELECT id FROM notes")).scalars())
+    keep_id, new_id = [], []
+    rows = conn.execute(text(f"SELECT original_id, {NOTE_COLUMNS} FROM trashed_notes ORDER BY id"))
+    for row in rows.mappings():
+        row = dict(row)
+        if row["original_id"] in taken:
+            new_id.append(row)
+        else:
+            taken.add(row["original_id"])
+            keep_id.append(row)
+    values = ", ".join(":" + column for column in NOTE_COLUMNS.split(", "))
+    if keep_id:
+        conn.execute(text(f"INSERT INTO notes (id, {NOTE_COLUMNS}) VALUES (:original_id, {values})"), keep_id)
+    if new_id:
+        conn.execute(text(f"INSERT INTO notes ({NOTE_COLUMNS}) VALUES ({values})"), new_id)
+    conn.execute(text("DROP TABLE trashed_notes"))
+
+
+def _migrate_change_seq(conn) -> None:
+    columns = {row.name for row in conn.execute(text("PRAGMA table_info(notes)"))}
+    if "change_seq" not in columns:
+        conn.execute(text("ALTER TABLE notes ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0"))
+
+
+NOTES_FTS_TRIGGERS = ("notes_fts_ai", "notes_fts_ad", "notes_fts_au")
+
+
+def make_preview(text_value: Optional[str]) -> Optional[str]:
+    if not text_value:
+        return None
+    return " ".join(text_value.split())[:PREVIEW_LENGTH]
+
+
+def _migrate_layout(conn) -> None:
+    columns = [row.name for row in conn.execute(text("PRAGMA table_info(notes)"))]
+    expected = [column.name for column in NoteBase.__table__.columns]
+    if columns == expected:
+        return
+
+    # Пересборка таблицы: порядок столбцов в SQLite меняется только так.
+    # Индексы и триггеры создаются заново вместе с новой таблицей, rowid
+    # сохраняются, поэтому внешний индекс FTS достаточно перестроить.
+    for name in NOTES_FTS_TRIGGERS:
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+    indexes = conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'notes' AND sql IS NOT NULL"
+    )).scalars().all()
+    for name in indexes:
+        conn.execute(text(f"DROP INDEX {name}"))
+    conn.execute(text("ALTER TABLE notes RENAME TO notes_old"))
+    NoteBase.__table__.create(conn)
+
+    # Новые столбцы получают значения по умолчанию, превью вычисляется ниже
+    copied = ", ".join(column for column in columns if column in expected and column != "preview")
+    conn.execute(text(f"INSERT INTO notes ({copied}) SELECT {copied} FROM notes_old"))
+    conn.execute(text("DROP TABLE notes_old"))
+
+    rows = conn.execute(text("SELECT id, text FROM notes WHERE text IS NOT NULL AND text != ''")).all()
+    if rows:
+        conn.execute(text("UPDATE notes SET preview = :preview WHERE id = :id"),
+                     [{"id": row.id, "preview": make_preview(row.text)} for row in rows])
+    if conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'notes_fts'")).first():
+        conn.execute(text("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')"))
+
+
+def utc_now() -> datetime:
+    # Даты в базе хранятся без часового пояса, в UTC: так их пишут все записи
+    # и так их сравнивают фильтры (_to_naive_utc) и очистка корзины
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# До версии схемы 2 эти даты записывались в местном времени сервера.
+# Миграция не повторяема, поэтому выполняется из ensure_schema по версии,
+# а не из init_db
+LOCAL_DATE_COLUMNS = {
+    "notes": ("change_date", "deleted_date"),
+    "note_tombstones": ("deleted_date",),
+    "drafts": ("updated_date",),
+}
+
+
+def _local_to_utc(value: str) -> str:
+    # Смещение берётся для каждой даты отдельно, с учётом перехода на летнее время
+    converted = datetime.fromisoformat(value).astimezone(timezone.utc).replace(tzinfo=None)
+    return converted.isoformat(" ", "microseconds")
+
+
+def _migrate_utc_dates(conn) -> None:
+    for table, columns in LOCAL_DATE_COLUMNS.items():
+        for column in columns:
+            rows = conn.execute(text(f"SELECT rowid, {column} FROM {table} WHERE {column} IS NOT NULL")).all()
+            if rows:
+                conn.execute(text(f"UPDATE {table} SET {column} = :value WHERE rowid = :id"),
+                             [{"id": row[0], "value": _local_to_utc(row[1])} for row in rows])
+
+
+def init_db(bind) -> None:
+    Base.metadata.create_all(bind)
+
+    with bind.begin() as conn:
+        _migrate_soft_delete(conn)
+        _migrate_change_seq(conn)
+        _migrate_layout(conn)
+
+        # create_all не добавляет индексы к уже существующим таблицам
+        existing = set(conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )).scalars())
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(conn)
+
+        has_fts = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'notes_fts'"
+        )).first()
+        if not has_fts:
+            for statement in NOTES_FTS_DDL:
+                conn.execute(text(statement))
+            conn.execute(text("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')"))
+
+
+# Версия схемы хранится в PRAGMA user_version. Её нужно увеличить вместе с
+# любым изменением моделей или миграций в init_db: базы с прежней версией
+# мигрируются при следующем запуске
+SCHEMA_VERSION = 2
+UTC_DATES_VERSION = 2
+
+
+class SchemaError(RuntimeError):
+    pass
+
+
+def get_schema_version(bind) -> int:
+    with bind.connect() as conn:
+        return conn.execute(text("PRAGMA user_version")).scalar()
+
+
+@contextmanager
+def _schema_lock(database: str):
+    if fcntl is None or database == ":memory:":
+        yield
+        return
+    with open(database + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def ensure_schema(bind, settings: StorageSettings) -> bool:
+    """Проверяет схему базы и при необходимости создаёт или мигрирует её.
+
+    Актуальная база проверяется одним запросом PRAGMA user_version. Миграция
+    идёт под файловой блокировкой: из одновременно запущенных воркеров схему
+    обновляет первый, остальные дожидаются его и видят новую версию.
+    Возвращает True, если миграция выполнялась в этом вызове.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(settings.database)), exist_ok=True)
+    version = get_schema_version(bind)
+    if version == SCHEMA_VERSION:
+        return False
+    if version > SCHEMA_VERSION:
+        raise SchemaError(f"Схема базы версии {version} новее поддерживаемой {SCHEMA_VERSION}")
+    if settings.schema == "check":
+        raise SchemaError(f"Схема базы версии {version} устарела (нужна {SCHEMA_VERSION}): "
+                          "выполните python manage.py migrate")
+
+    with _schema_lock(settings.database):
+        version = get_schema_version(bind)
+        if version == SCHEMA_VERSION:
+            return False
+        init_db(bind)
+        with bind.begin() as conn:
+            if version < UTC_DATES_VERSION:
+                _migrate_utc_dates(conn)
+            conn.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+    return True
+
+
+# Раскладка заметок по шардам: число шардов, для которого выбраны id заметок
+# файла. Без записи - один файл
+SHARD_LAYOUT = "shard_layout"
+
+
+def _get_layout(bind) -> int:
+    with bind.connect() as conn:
+        layout = conn.scalar(select(CollectionVersion.version).where(CollectionVersion.name == SHARD_LAYOUT))
+    return layout or 1
+
+
+def _set_layout(bind, layout: int) -> None:
+    statement = sqlite_insert(CollectionVersion).values(name=SHARD_LAYOUT, version=layout)
+    statement = statement.on_conflict_do_update(index_elements=[CollectionVersion.name],
+                                                set_={"version": layout})
+    with bind.begin() as conn:
+        conn.execute(statement)
+
+
+class ShardedAsyncSession:
+    """Сессии шардов для одного запроса.
+
+    Сессия шарда открывается при первом обращении к нему. commit и rollback
+    выполняются во всех открытых шардах по очереди: транзакции нескольких
+    шардов не атомарны.
+    """
+
+    def __init__(self, database: "Database"):
+        self.database = database
+        self._makers = [shard.sessions for shard in database.shards]
+        self._sessions: dict = {}
+
+    @property
+    def count(self) -> int:
+        return len(self._makers)
+
+    def shard(self, index: int):
+        session = self._sessions.get(index)
+        if session is None:
+            session = self._sessions[index] = self._makers[index]()
+        return session
+
+    def for_id(self, id: int):
+        return self.shard(id % self.count)
+
+    def next_index(self) -> int:
+        return next(self.database._create_order) % self.count
+
+    async def scatter(self, read) -> list:
+        # Чтение выполняется во всех шардах одновременно: у каждого шарда
+        # своё соединение и свой поток aiosqlite
+        return await asyncio.gather(*(self.shard(index).run_sync(read) for index in range(self.count)))
+
+    async def commit(self) -> None:
+        for session in list(self._sessions.values()):
+            await session.commit()
+
+    async def rollback(self) -> None:
+        for session in list(self._sessions.values()):
+            await session.rollback()
+
+    async def close(self) -> None:
+        for session in list(self._sessions.values()):
+            await session.close()
+        self._sessions.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+class Database:
+    """Хранилище одного приложения: движки шардов, фабрики сессий и получатели изменений.
+
+    Движки соединяются с базой лениво: при создании не открывается ни одного
+    файла. Схему проверяет ensure_schemas при запуске приложения. Сессии
+    помнят свой Database (session.info["database"]): после их коммита
+    сбрасывается только его кэш чтений и события получает только его хаб.
+    """
+
+    def __init__(self, settings: StorageSettings, read_cache: Optional[ReadCache] = None,
+                 event_hub: Optional[EventHub] = None):
+        self.settings = settings
+        self.read_cache = read_cache
+        self.event_hub = event_hub
+        self.shards = [self._open_shard(index) for index in range(settings.shards)]
+        # Основной файл (шард 0): в нём же черновики и все заметки без шардирования
+        self.engine, self.async_engine = self.shards[0].engine, self.shards[0].async_engine
+        self.Session = sessionmaker(bind=self.engine, info=self._info(0))
+        # Номера событий /events. Без шардов событие получает номер изменения; у
+        # шардов счётчики изменений свои, и события нумеруются внутри процесса
+        self.last_event_id = 0
+        self._event_ids = count(1)
+        # Новые заметки распределяются по шардам по кругу
+        self._create_order = count()
+
+    def _info(self, index: int) -> dict:
+        info = {"database": self}
+        if self.settings.shards > 1:
+            # По session.info["shard"] функции записи выбирают id новых заметок (см. _allocate_ids)
+            info["shard"] = (index, self.settings.shards)
+        return info
+
+    def _open_shard(self, index: int) -> Shard:
+        engine, async_engine = create_engines(_shard_settings(self.settings, index))
+        sessions = async_sessionmaker(bind=async_engine, expire_on_commit=False, info=self._info(index))
+        return Shard(index, self.settings.shard_database(index), engine, async_engine, sessions)
+
+    def AsyncSession(self):
+        """Сессия для обработчиков и фоновых задач: AsyncSession или ShardedAsyncSession при нескольких шардах."""
+        if len(self.shards) == 1:
+            return self.shards[0].sessions()
+        return ShardedAsyncSession(self)
+
+    def next_event_id(self) -> int:
+        self.last_event_id = next(self._event_ids)
+        return self.last_event_id
+
+    def ensure_schemas(self) -> bool:
+        """ensure_schema для каждого шарда и проверка раскладки заметок.
+
+        Пустые файлы получают раскладку текущего числа шардов. Если заметки
+        разложены для другого числа шардов (в том числе база, заполненная без
+        шардирования), часть из них была бы не видна: нужен manage.py rebalance.
+        """
+        settings = self.settings
+        migrated = False
+        for shard in self.shards:
+            migrated = ensure_schema(shard.engine, _shard_settings(settings, shard.index)) or migrated
+            layout = _get_layout(shard.engine)
+            if layout == settings.shards:
+                continue
+            with shard.engine.connect() as conn:
+                empty = conn.scalar(select(NoteBase.id).limit(1)) is None
+            if not empty:
+                raise SchemaError(f"Заметки в {shard.database} разложены для {layout} шардов, задано "
+                                  f"{settings.shards}: выполните python manage.py rebalance")
+            _set_layout(shard.engine, settings.shards)
+        return migrated
+
+    def rebalance(self, batch_size: int = 500) -> int:
+        """Переносит заметки в шарды id % числа шардов после изменения NOTES_DB_SHARDS.
+
+        Выполняется при остановленных воркерах. Заметки копируются в новый шард
+        до удаления из старого, поэтому прерванный перенос можно просто повторить.
+        Возвращает число перенесённых заметок.
+        """
+        settings = replace(self.settings, schema="auto")
+        total = settings.shards
+        for shard in self.shards:
+            ensure_schema(shard.engine, _shard_settings(settings, shard.index))
+        engines = [shard.engine for shard in self.shards]
+        # Лишние файлы прежней раскладки только опустошаются
+        previous = max(_get_layout(shard.engine) for shard in self.shards)
+        for index in range(total, previous):
+            database = settings.shard_database(index)
+            if os.path.exists(database):
+                engines.append(create_engines(_shard_settings(settings, index))[0])
+
+        sessions = [OrmSession(bind=bind) for bind in engines]
+        moved = 0
+        try:
+            for index, source in enumerate(sessions):
+                while True:
+                    misplaced = source.scalars(
+                        select(NoteBase).where(NoteBase.id % total != index).order_by(NoteBase.id).limit(batch_size)
+                    ).all()
+                    if not misplaced:
+                        break
+                    for target_index, notes in groupby(sorted(misplaced, key=lambda note: note.id % total),
+                                                       key=lambda note: note.id % total):
+                        target = sessions[target_index]
+                        seq = _change_seq(target, NOTES, TRASH)
+                        target.execute(sqlite_insert(NoteBase).values(
+                            [{**_columns(note), "change_seq": seq} for note in notes]
+                        ).on_conflict_do_nothing())
+                        target.commit()
+                    source.execute(delete(NoteBase).where(NoteBase.id.in_([note.id for note in misplaced])))
+                    bump_version(source, NOTES, TRASH)
+                    source.commit()
+                    moved += len(misplaced)
+            for bind in engines:
+                _set_layout(bind, total)
+        finally:
+            for session in sessions:
+                session.close()
+            for bind in engines[len(self.shards):]:
+                bind.dispose()
+        return moved
+
+    async def dispose(self) -> None:
+        # Закрывает соединения пулов; движки можно использовать и после этого
+        for shard in self.shards:
+            await shard.async_engine.dispose()
+            shard.engine.dispose()
+
+
+# Версии коллекций растут при каждой записи и служат основой для ETag:
+# по ним можно проверить, изменилось ли что-то, не читая сами заметки.
+NOTES = "notes"
+TRASH = "trash"
+NOTE = "note"
+# Сквозной номер изменения заметок и граница уже сжатых отметок об удалении
+CHANGES = "changes"
+TOMBSTONE_FLOOR = "tombstone_floor"
+
+
+def _remember_written(session, names: Iterable[str] = (), note_ids: Iterable[int] = ()) -> None:
+    # Что изменила транзакция; кэши чтения сбрасываются только после коммита
+    session.info.setdefault("written", set()).update(names)
+    session.info.setdefault("written_notes", set()).update(note_ids)
+
+
+def _record_changes(session, op: str, ids: Iterable[int], when: Optional[datetime] = None) -> None:
+    # События для подписчиков /events публикуются только после коммита
+    session.info.setdefault("changes", []).extend((id, op, when) for id in ids)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _invalidate_read_caches(session) -> None:
+    seq = session.info.pop("change_seq", None)
+    session.info.pop("bumped", None)
+    changes = session.info.pop("changes", [])
+    names = session.info.pop("written", set())
+    note_ids = session.info.pop("written_notes", set())
+    # Сессии вне Database (тесты, скрипты) сбрасывают все кэши и публикуют
+    # во все хабы процесса
+    database = session.info.get("database")
+    if names or note_ids:
+        keys = [(NOTE, id) for id in note_ids]
+        if database is None:
+            invalidate_all(names, keys)
+        elif database.read_cache is not None:
+            database.read_cache.invalidate(names, keys)
+    if seq is not None and changes:
+        if database is None:
+            publish_all(seq, changes)
+        elif database.event_hub is not None:
+            database.event_hub.publish(database.next_event_id() if "shard" in session.info else seq, changes)
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _forget_written(session) -> None:
+    session.info.pop("change_seq", None)
+    session.info.pop("bumped", None)
+    session.info.pop("changes", None)
+    session.info.pop("written", None)
+    session.info.pop("written_notes", None)
+
+
+def _increment_versions(session, names: Iterable[str]):
+    # Версия коллекции меняется один раз за транзакцию: читатели видят только
+    # закоммиченные версии, повторное увеличение ничего не даёт
+    bumped = session.info.setdefault("bumped", set())
+    names = [name for name in dict.fromkeys(names) if name not in bumped]
+    if not names:
+        return None
+    bumped.update(names)
+    statement = sqlite_insert(CollectionVersion).values([{"name": name, "version": 1} for name in names])
+    return statement.on_conflict_do_update(
+        index_elements=[CollectionVersion.name],
+        set_={"version": CollectionVersion.version + 1}
+    )
+
+
+def bump_version(session, *names: str, note_ids: Iterable[int] = ()) -> None:
+    _remember_written(session, names, note_ids)
+    statement = _increment_versions(session, names)
+    if statement is not None:
+        session.execute(statement)
+
+
+def _change_seq(session, *names: str) -> int:
+    # Один номер на транзакцию. SQLite допускает только одного писателя, поэтому
+    # закоммиченное значение счётчика N означает, что все изменения с номерами
+    # не больше N уже видны читателям. Версии коллекций names увеличиваются
+    # тем же запросом; bump_version после успешной записи их уже не трогает.
+    seq = session.info.get("change_seq")
+    if seq is None:
+        statement = _increment_versions(session, (CHANGES,) + names)
+        versions = dict(session.execute(statement.returning(CollectionVersion.name, CollectionVersion.version)).all())
+        seq = session.info["change_seq"] = versions[CHANGES]
+    else:
+        statement = _increment_versions(session, names)
+        if statement is not None:
+            session.execute(statement)
+    return seq
+
+
+def _add_tombstones(session, ids: Iterable[int], names: Iterable[str] = ()) -> None:
+    ids = list(ids)
+    if not ids:
+        return
+    seq, now = _change_seq(session, *names), utc_now()
+    _record_changes(session, "delete", ids, now)
+    statement = sqlite_insert(NoteTombstone).values(
+        [{"note_id": id, "seq": seq, "deleted_date": now} for id in ids]
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[NoteTombstone.note_id],
+        set_={"seq": statement.excluded.seq, "deleted_date": statement.excluded.deleted_date}
+    )
+    session.execute(statement)
+
+
+def get_version(session, name: str) -> int:
+    version = session.scalar(select(CollectionVersion.version).where(CollectionVersion.name == name))
+    return version or 0
+
+
+LIVE = NoteBase.deleted_date.is_(None)
+TRASHED = NoteBase.deleted_date.is_not(None)
+
+
+def _get_live(session, id: int) -> Optional[NoteBase]:
+    note = session.get(NoteBase, id)
+    return note if note is not None and note.deleted_date is None else None
+
+
+def _allocate_ids(session, number: int) -> Optional[List[int]]:
+    # В шарде index из total id заметок сравнимы с index по модулю total:
+    # по id всегда понятно, в каком файле заметка. Вызывается после
+    # _change_seq, когда транзакция уже держит блокировку записи шарда
+    shard = session.info.get("shard")
+    if shard is None:
+        return None
+    index, total = shard
+    start = (session.scalar(select(func.max(NoteBase.id))) or 0) + 1
+    first = start + (index - start) % total
+    return [first + total * i for i in range(number)]
 
 
 def create_note(note: NoteBase, session) -> NoteBase:
+    note.preview = make_preview(note.text)
+    note.change_seq = _change_seq(session, NOTES)
+    if note.id is None:
+        ids = _allocate_ids(session, 1)
+        note.id = ids[0] if ids else None
     session.add(note)
+    session.flush()
+    _record_changes(session, "create", [note.id], note.created_date)
+    bump_version(session, NOTES)
     session.commit()
-    session.refresh(note)
     return note
 
 
-def change_note(id: int, session, new_data: dict) -> Optional[NoteBase]:
-    note = session.get(NoteBase, id)
-    if note is None:
-        return None
+class VersionConflict(Exception):
+    """Заметка изменена после того, как клиент прочитал её версию."""
 
+    def __init__(self, id: int, version: int):
+        super().__init__(f"Заметка {id} изменена: текущая версия {version}")
+        self.id = id
+        self.version = version
+
+
+def _changed_values(new_data: dict) -> dict:
+    values = {"change_date": utc_now()}
     if "new_headline" in new_data:
-        note.headline = new_data["new_headline"]
+        values["headline"] = new_data["new_headline"]
     if "text" in new_data:
-        note.text = new_data["text"]
+        values["text"] = new_data["text"]
+        values["preview"] = make_preview(new_data["text"])
     if "improtance" in new_data:
-        note.improtance = new_data["improtance"]
+        values["improtance"] = new_data["improtance"]
+    return values
+
+
+def _apply_changes(note: NoteBase, new_data: dict) -> None:
+    for name, value in _changed_values(new_data).items():
+        setattr(note, name, value)
+    note.version += 1
+
+
+def change_note(id: int, session, new_data: dict, expected_version: Optional[int] = None) -> Optional[NoteBase]:
+    """Изменяет заметку одним UPDATE ... RETURNING без предварительного чтения.
 
-    note.change_date = datetime.now()
+    С expected_version запись выполняется, только если версия заметки не
+    изменилась, иначе VersionConflict. None - заметки нет или она в корзине.
+    """
+    where = [NoteBase.id == id, LIVE]
+    if expected_version is not None:
+        where.append(NoteBase.version == expected_version)
+    note = session.scalars(
+        update(NoteBase)
+        .where(*where)
+        .values(**_changed_values(new_data), version=NoteBase.version + 1, change_seq=_change_seq(session, NOTES))
+        .returning(NoteBase)
+        .execution_options(populate_existing=True)
+    ).first()
+    if note is None:
+        if expected_version is not None:
+            # Причину отказа выясняет только неудачная запись
+            current = session.scalar(select(NoteBase.version).where(NoteBase.id == id, LIVE))
+            if current is not None:
+                raise VersionConflict(id, current)
+        return None
+
+    _record_changes(session, "update", [id], note.change_date)
+    bump_version(session, NOTES, note_ids=[id])
     return note
 
 
 def delete_note(id: int, session) -> bool:
-    note = session.get(NoteBase, id)
-    if note is None:
+    deleted = session.scalar(delete(NoteBase).where(NoteBase.id == id, LIVE).returning(NoteBase.id))
+    if deleted is None:
         return False
 
-    session.delete(note)
+    _add_tombstones(session, [id], names=[NOTES])
+    bump_version(session, NOTES, note_ids=[id])
     return True
 
 
 def get_all_notes(session) -> List[NoteBase]:
-    return session.query(NoteBase).order_by(NoteBase.created_date.desc()).all()
+    return session.query(NoteBase).where(LIVE).order_by(NoteBase.created_date.desc()).all()
+
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps(values, default=datetime.isoformat).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Некорректный курсор") from e
+    if not isinstance(values, list):
+        raise ValueError("Некорректный курсор")
+    return values
+
+
+# Дата последнего изменения: для ни разу не изменённых заметок - дата создания.
+# Выражение совпадает с индексом ix_notes_last_modified_id.
+LAST_MODIFIED = func.coalesce(NoteBase.change_date, NoteBase.created_date, type_=DateTime)
+
+NOTE_SORTS = {
+    "created": NoteBase.created_date,
+    "changed": LAST_MODIFIED,
+    "headline": NoteBase.headline,
+    "importance": NoteBase.improtance,
+}
+
+
+@dataclass
+class NoteFilters:
+    importance: Optional[List[int]] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+    changed_from: Optional[datetime] = None
+    changed_to: Optional[datetime] = None
+
+
+def _to_naive_utc(value: datetime) -> datetime:
+    # Даты в базе хранятся без часового пояса, в UTC
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _apply_note_filters(query, filters: Optional[NoteFilters]):
+    if filters is None:
+        return query
+    if filters.importance:
+        query = query.where(NoteBase.improtance.in_(filters.importance))
+    if filters.created_from is not None:
+        query = query.where(NoteBase.created_date >= _to_naive_utc(filters.created_from))
+    if filters.created_to is not None:
+        query = query.where(NoteBase.created_date < _to_naive_utc(filters.created_to))
+    if filters.changed_from is not None:
+        query = query.where(LAST_MODIFIED >= _to_naive_utc(filters.changed_from))
+    if filters.changed_to is not None:
+        query = query.where(LAST_MODIFIED < _to_naive_utc(filters.changed_to))
+    return query
+
+
+def _keyset_query(query, sort_column, id_column, descending: bool, tag: str,
+                  limit: Optional[int], after: Optional[str]):
+    direction = desc if descending else asc
+    query = query.add_columns(sort_column.label("sort_value"))
+    query = query.order_by(direction(sort_column), direction(id_column))
+
+    if after is not None:
+        cursor = decode_cursor(after)
+        if len(cursor) != 3 or cursor[0] != tag:
+            raise ValueError("Курсор не соответствует сортировке")
+        _, value, id = cursor
+        # Значения курсора попадают в SQL: типы проверяются, как у параметров запроса
+        if not isinstance(id, int) or isinstance(id, bool):
+            raise ValueError("Некорректный курсор")
+        if isinstance(sort_column.type, DateTime):
+            if not isinstance(value, str):
+                raise ValueError("Некорректный курсор")
+            value = datetime.fromisoformat(value)
+        elif value is not None and (not isinstance(value, (str, int)) or isinstance(value, bool)):
+            raise ValueError("Некорректный курсор")
+        key = tuple_(sort_column, id_column)
+        bound = tuple_(value, id)
+        query = query.where(key < bound if descending else key > bound)
+
+    if limit is not None:
+        query = query.limit(limit + 1)
+    return query
+
+
+def _keyset_rows(session, query, columns: Optional[Tuple[str, ...]] = None) -> List[tuple]:
+    # Строки (значение сортировки, id, заметка или словарь столбцов)
+    rows = session.execute(query).all()
+    if columns is None:
+        return [(row.sort_value, row[0].id, row[0]) for row in rows]
+    return [(row.sort_value, row.id, {name: getattr(row, name) for name in columns}) for row in rows]
+
+
+def _page(rows: List[tuple], tag: str, limit: Optional[int]):
+    items = [item for _, _, item in rows]
+    if limit is None or len(rows) <= limit:
+        return items, None
+    sort_value, last_id, _ = rows[limit - 1]
+    return items[:limit], encode_cursor(tag, sort_value, last_id)
+
+
+def _keyset_page(session, query, tag: str, limit: Optional[int], columns: Optional[Tuple[str, ...]] = None):
+    return _page(_keyset_rows(session, query, columns), tag, limit)
+
+
+# Столбцы, которые можно запросить в списке заметок (?fields=), и краткий вид
+# для карточек (?view=summary): без текста, только с превью
+NOTE_LIST_COLUMNS = ("id", "headline", "preview", "text", "improtance", "created_date", "change_date", "version")
+SUMMARY_COLUMNS = ("id", "headline", "preview", "improtance", "created_date", "change_date", "version")
+
+
+def _notes_page_query(limit: Optional[int], after: Optional[str], sort: str, order: str,
+                      filters: Optional[NoteFilters], columns: Optional[Tuple[str, ...]] = None):
+    if sort not in NOTE_SORTS:
+        raise ValueError(f"Неизвестная сортировка: {sort}")
+    tag = f"{sort}:{order}"
+    if columns is None:
+        query = select(NoteBase)
+    else:
+        unknown = set(columns) - set(NOTE_LIST_COLUMNS)
+        if unknown:
+            raise ValueError(f"Неизвестные поля: {', '.join(sorted(unknown))}")
+        # Только запрошенные столбцы: объекты ORM не создаются, text не читается
+        query = select(*(getattr(NoteBase, name) for name in columns))
+    query = _apply_note_filters(query.where(LIVE), filters)
+    query = _keyset_query(query, NOTE_SORTS[sort], NoteBase.id, order == "desc", tag, limit, after)
+    return query, tag
+
+
+def get_notes_page(session, limit: Optional[int] = None, after: Optional[str] = None,
+                   sort: str = "created", order: str = "desc",
+                   filters: Optional[NoteFilters] = None,
+                   columns: Optional[Tuple[str, ...]] = None) -> Tuple[List[NoteBase], Optional[str]]:
+    query, tag = _notes_page_query(limit, after, sort, order, filters, columns)
+    return _keyset_page(session, query, tag, limit, columns)
+
+
+def explain_notes_page(session, limit: Optional[int] = None, after: Optional[str] = None,
+                       sort: str = "created", order: str = "desc",
+                       filters: Optional[NoteFilters] = None,
+                       columns: Optional[Tuple[str, ...]] = None) -> List[str]:
+    query, _ = _notes_page_query(limit, after, sort, order, filters, columns)
+    compiled = query.compile(dialect=session.bind.dialect, compile_kwargs={"literal_binds": True})
+    rows = session.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))
+    return [row.detail for row in rows]
+
+
+def build_fts_query(query: str) -> Optional[str]:
+    # Каждое слово экранируется как строка FTS5 и ищется по префиксу,
+    # поэтому пользовательский ввод не может сломать синтаксис MATCH.
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return None
+    return " ".join('"%s"*' % term for term in terms)
+
+
+SEARCH_SQL = text("""
+    SELECT notes.id, notes.headline, notes.improtance,
+           notes.created_date, notes.change_date,
+           highlight(notes_fts, 0, '<mark>', '</mark>') AS headline_highlight,
+           snippet(notes_fts, 1, '<mark>', '</mark>', '…', 16) AS snippet,
+           bm25(notes_fts, 5.0, 1.0) AS rank
+    FROM notes_fts
+    JOIN notes ON notes.id = notes_fts.rowid
+    WHERE notes_fts MATCH :query AND notes.deleted_date IS NULL
+    ORDER BY rank, notes.id
+    LIMIT :limit OFFSET :offset
+""").columns(created_date=DateTime, change_date=DateTime)
+
+
+def search_notes(session, query: str, limit: int = 20, offset: int = 0) -> List[dict]:
+    fts_query = build_fts_query(query)
+    if fts_query is None:
+        return []
+    rows = session.execute(SEARCH_SQL, {"query": fts_query, "limit": limit, "offset": offset})
+    return [dict(row) for row in rows.mappings()]
 
 
 def get_note_by_id(id: int, session) -> Optional[NoteBase]:
-    return session.get(NoteBase, id)
+    return _get_live(session, id)
 
 
-def move_to_trash(id: int, session) -> Optional[TrashedNote]:
-    note = session.get(NoteBase, id)
+# Перемещение в корзину и восстановление - один UPDATE deleted_date на месте,
+# id заметки при этом не меняется.
+
+def move_to_trash(id: int, session) -> Optional[NoteBase]:
+    note = session.scalars(
+        update(NoteBase)
+        .where(NoteBase.id == id, LIVE)
+        .values(deleted_date=utc_now(), version=NoteBase.version + 1,
+                change_seq=_change_seq(session, NOTES, TRASH))
+        .returning(NoteBase)
+    ).first()
     if note is None:
         return None
 
-    trashed = TrashedNote(
-        original_id=note.id,
-        improtance=note.improtance,
-        headline=note.headline,
-        text=note.text,
-        created_date=note.created_date,
-        change_date=note.change_date,
-        deleted_date=datetime.now()
-    )
-    session.add(trashed)
-    session.delete(note)
-    return trashed
+    _record_changes(session, "trash", [id], note.deleted_date)
+    bump_version(session, NOTES, TRASH, note_ids=[id])
+    return note
+
+
+def get_all_trashed(session) -> List[NoteBase]:
+    return session.query(NoteBase).where(TRASHED).order_by(NoteBase.deleted_date.desc()).all()
+
+
+TRASH_TAG = "deleted:desc"
 
 
-def get_all_trashed(session) -> List[TrashedNote]:
-    return session.query(TrashedNote).order_by(TrashedNote.deleted_date.desc()).all()
+def _trashed_page_query(limit: Optional[int], after: Optional[str]):
+    return _keyset_query(select(NoteBase).where(TRASHED), NoteBase.deleted_date, NoteBase.id,
+                         True, TRASH_TAG, limit, after)
+
+
+def get_trashed_page(session, limit: Optional[int] = None,
+                     after: Optional[str] = None) -> Tuple[List[NoteBase], Optional[str]]:
+    return _keyset_page(session, _trashed_page_query(limit, after), TRASH_TAG, limit)
 
 
 def restore_from_trash(id: int, session) -> Optional[NoteBase]:
-    trashed = session.get(TrashedNote, id)
-    if trashed is None:
+    note = session.scalars(
+        update(NoteBase)
+        .where(NoteBase.id == id, TRASHED)
+        .values(deleted_date=None, change_date=utc_now(), version=NoteBase.version + 1,
+                change_seq=_change_seq(session, NOTES, TRASH))
+        .returning(NoteBase)
+    ).first()
+    if note is None:
         return None
 
-    note = NoteBase(
-        improtance=trashed.improtance,
-        headline=trashed.headline,
-        text=trashed.text,
-        created_date=trashed.created_date,
-        change_date=datetime.now()
-    )
-    session.add(note)
-    session.delete(trashed)
+    _record_changes(session, "restore", [id], note.change_date)
+    bump_version(session, NOTES, TRASH, note_ids=[id])
     return note
 
 
 def delete_from_trash(id: int, session) -> bool:
-    trashed = session.get(TrashedNote, id)
-    if trashed is None:
+    deleted = session.scalar(delete(NoteBase).where(NoteBase.id == id, TRASHED).returning(NoteBase.id))
+    if deleted is None:
         return False
-    session.delete(trashed)
+    _add_tombstones(session, [id], names=[TRASH])
+    bump_version(session, TRASH)
     return True
+
+
+def count_expired_trash(session, cutoff: datetime) -> int:
+    return session.scalar(select(func.count()).select_from(NoteBase).where(TRASHED, NoteBase.deleted_date < cutoff))
+
+
+def purge_trash_batch(session, cutoff: datetime, batch_size: int) -> int:
+    # Самые старые заметки корзины удаляются порциями по индексу
+    # ix_notes_deleted_date_id, чтобы каждая транзакция была короткой
+    expired = (
+        select(NoteBase.id)
+        .where(TRASHED, NoteBase.deleted_date < cutoff)
+        .order_by(NoteBase.deleted_date, NoteBase.id)
+        .limit(batch_size)
+    )
+    deleted = session.scalars(delete(NoteBase).where(NoteBase.id.in_(expired)).returning(NoteBase.id)).all()
+    if deleted:
+        _add_tombstones(session, deleted, names=[TRASH])
+        bump_version(session, TRASH)
+    return len(deleted)
+
+
+# Журнал изменений для синхронизации клиентов. Изменённые и восстановленные
+# заметки находятся по notes.change_seq, перемещённые в корзину - там же по
+# deleted_date, окончательно удалённые - по отметкам в note_tombstones.
+
+def get_changes(session, since: int, from_start: bool = False) -> dict:
+    versions = dict(session.execute(
+        select(CollectionVersion.name, CollectionVersion.version)
+        .where(CollectionVersion.name.in_([CHANGES, TOMBSTONE_FLOOR]))
+    ).all())
+    seq, floor = versions.get(CHANGES, 0), versions.get(TOMBSTONE_FLOOR, 0)
+    # Клиент без состояния, с состоянием из другой базы или старше сжатых
+    # отметок об удалении должен загрузить список заново. from_start - шард,
+    # в котором клиент ещё не видел изменений: since=0 без сброса
+    if (since <= 0 and not from_start) or since < floor or since > seq:
+        return {"seq": seq, "reset": True, "notes": [], "deleted": []}
+
+    changed = session.scalars(
+        select(NoteBase)
+        .where(NoteBase.change_seq > since, NoteBase.change_seq <= seq)
+        .order_by(NoteBase.change_seq, NoteBase.id)
+    ).all()
+    tombstones = session.scalars(
+        select(NoteTombstone.note_id)
+        .where(NoteTombstone.seq > since, NoteTombstone.seq <= seq)
+        .order_by(NoteTombstone.seq, NoteTombstone.note_id)
+    ).all()
+
+    notes = [note for note in changed if note.deleted_date is None]
+    # SQLite может выдать id удалённой заметки новой: такая заметка жива
+    live_ids = {note.id for note in notes}
+    deleted = [note.id for note in changed if note.deleted_date is not None]
+    deleted.extend(id for id in tombstones if id not in live_ids)
+    return {"seq": seq, "reset": False, "notes": notes, "deleted": list(dict.fromkeys(deleted))}
+
+
+def count_expired_tombstones(session, cutoff: datetime) -> int:
+    return session.scalar(select(func.count()).select_from(NoteTombstone).where(NoteTombstone.deleted_date < cutoff))
+
+
+def compact_tombstones(session, cutoff: datetime) -> int:
+    max_seq = session.scalar(select(func.max(NoteTombstone.seq)).where(NoteTombstone.deleted_date < cutoff))
+    if max_seq is None:
+        return 0
+    removed = session.execute(delete(NoteTombstone).where(NoteTombstone.seq <= max_seq)).rowcount
+    statement = sqlite_insert(CollectionVersion).values(name=TOMBSTONE_FLOOR, version=max_seq)
+    statement = statement.on_conflict_do_update(
+        index_elements=[CollectionVersion.name],
+        set_={"version": func.max(CollectionVersion.version, statement.excluded.version)}
+    )
+    session.execute(statement)
+    return removed
+
+
+# Черновики редактора. Пишутся только буфером drafts.DraftBuffer, пачкой за
+# транзакцию; версии коллекций и журнал изменений заметок они не затрагивают.
+
+DRAFT_COLUMNS = ("key", "note_id", "headline", "improtance", "updated_date", "text")
+
+
+def write_drafts(session, rows: List[dict], deleted: Iterable[str] = ()) -> None:
+    if rows:
+        statement = sqlite_insert(NoteDraft).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[NoteDraft.key],
+            set_={name: statement.excluded[name] for name in DRAFT_COLUMNS if name != "key"}
+        )
+        session.execute(statement)
+    deleted = list(deleted)
+    if deleted:
+        session.execute(delete(NoteDraft).where(NoteDraft.key.in_(deleted)))
+
+
+def get_draft(session, key: str) -> Optional[NoteDraft]:
+    return session.get(NoteDraft, key)
+
+
+def get_drafts(session) -> List[NoteDraft]:
+    return session.scalars(select(NoteDraft).order_by(NoteDraft.updated_date.desc(), NoteDraft.key)).all()
+
+
+# Пакетные операции. Каждая операция - кортеж (op, id, data), подряд идущие
+# операции одного типа выполняются одним набором массовых запросов, а коммит
+# остаётся за вызывающим кодом, поэтому весь пакет - одна транзакция.
+# Результат - id созданной/изменённой записи или None, если запись не найдена.
+
+def _unique_ids(items) -> List[int]:
+    return list(dict.fromkeys(id for _, id, _ in items))
+
+
+def _insert_many(session, model, rows: List[dict]) -> List[int]:
+    # Один многострочный INSERT ... RETURNING. Порядок строк RETURNING в SQLite
+    # не гарантирован, но rowid выдаются по возрастанию в порядке VALUES,
+    # поэтому отсортированные id соответствуют порядку rows.
+    if not rows:
+        return []
+    return sorted(session.scalars(insert(model).values(rows).returning(model.id)))
+
+
+def _columns(obj) -> dict:
+    if isinstance(obj, dict):
+        return obj
+    return {c.key: getattr(obj, c.key) for c in obj.__table__.columns}
+
+
+def _batch_create(session, items, results) -> None:
+    seq = _change_seq(session)
+    rows = [{**data, "preview": make_preview(data.get("text")), "change_seq": seq} for _, _, data in items]
+    for row, id in zip(rows, _allocate_ids(session, len(rows)) or ()):
+        row["id"] = id
+    ids = _insert_many(session, NoteBase, rows)
+    for (index, _, data), id in zip(items, ids):
+        results[index] = id
+        _record_changes(session, "create", [id], data.get("created_date"))
+
+
+def _batch_update(session, items, results) -> None:
+    found = {note.id: note for note in session.scalars(
+        select(NoteBase).where(NoteBase.id.in_(_unique_ids(items)), LIVE)
+    )}
+    for index, id, new_data in items:
+        note = found.get(id)
+        if note is not None:
+            _apply_changes(note, new_data)
+            note.change_seq = _change_seq(session)
+            _record_changes(session, "update", [id], note.change_date)
+            results[index] = id
+    session.flush()
+
+
+def _update_many(session, items, results, where, op: str, values: dict) -> None:
+    # Один UPDATE ... RETURNING на всю группу; повтор того же id внутри
+    # группы получает "не найдено"
+    changed = set(session.scalars(
+        update(NoteBase)
+        .where(NoteBase.id.in_(_unique_ids(items)), where)
+        .values(**values, version=NoteBase.version + 1, change_seq=_change_seq(session))
+        .returning(NoteBase.id)
+        .execution_options(synchronize_session="fetch")
+    ))
+    _record_changes(session, op, sorted(changed), values.get("deleted_date") or values.get("change_date"))
+    for index, id, _ in items:
+        if id in changed:
+            changed.discard(id)
+            results[index] = id
+
+
+def _batch_trash(session, items, results) -> None:
+    _update_many(session, items, results, LIVE, "trash", {"deleted_date": utc_now()})
+
+
+def _batch_restore(session, items, results) -> None:
+    _update_many(session, items, results, TRASHED, "restore", {"deleted_date": None, "change_date": utc_now()})
+
+
+def _batch_delete(session, items, results, where=LIVE) -> None:
+    deleted = set(session.scalars(
+        delete(NoteBase).where(NoteBase.id.in_(_unique_ids(items)), where).returning(NoteBase.id)
+    ))
+    _add_tombstones(session, sorted(deleted))
+    for index, id, _ in items:
+        if id in deleted:
+            deleted.discard(id)
+            results[index] = id
+
+
+def _apply_batch(session, operations: List[tuple], handlers: dict) -> List[Optional[int]]:
+    # handlers: op -> (функция, затрагиваемые коллекции)
+    results = [None] * len(operations)
+    touched = set()
+    indexed = [(index, op, id, data) for index, (op, id, data) in enumerate(operations)]
+    for op, group in groupby(indexed, key=lambda item: item[1]):
+        group = [(index, id, data) for index, _, id, data in group]
+        handler, collections = handlers[op]
+        handler(session, group, results)
+        if any(results[index] is not None for index, _, _ in group):
+            touched.update(collections)
+    if touched:
+        bump_version(session, *sorted(touched), note_ids=[
+            id for (_, id, _), result in zip(operations, results) if id is not None and result is not None
+        ])
+    return results
+
+
+def apply_notes_batch(operations: List[tuple], session) -> List[Optional[int]]:
+    return _apply_batch(session, operations, {
+        "create": (_batch_create, (NOTES,)),
+        "update": (_batch_update, (NOTES,)),
+        "trash": (_batch_trash, (NOTES, TRASH)),
+        "delete": (_batch_delete, (NOTES,)),
+    })
+
+
+def apply_trash_batch(operations: List[tuple], session) -> List[Optional[int]]:
+    return _apply_batch(session, operations, {
+        "restore": (_batch_restore, (NOTES, TRASH)),
+        "delete": (lambda s, items, results: _batch_delete(s, items, results, where=TRASHED), (TRASH,)),
+    })
+
+
+# Асинхронные версии функций. Логика остаётся в синхронных функциях выше,
+# а AsyncSession.run_sync выполняет их поверх aiosqlite без блокировки цикла событий.
+# С ShardedAsyncSession операция с одной заметкой выполняется в её шарде, а
+# чтения списков - во всех шардах со слиянием результатов.
+
+def _route(session, id: int):
+    return session.for_id(id) if isinstance(session, ShardedAsyncSession) else session
+
+
+def _primary(session):
+    return session.shard(0) if isinstance(session, ShardedAsyncSession) else session
+
+
+async def _gather(session, read, merge):
+    if isinstance(session, ShardedAsyncSession):
+        return merge(await session.scatter(read))
+    return await session.run_sync(read)
+
+
+def _merge_rows(parts: List[List[tuple]], descending: bool, limit: Optional[int] = None) -> List[tuple]:
+    # k-way слияние строк (значение сортировки, id, ...), уже упорядоченных в
+    # каждом шарде. NULL в SQLite меньше любого значения, как и здесь
+    merged = heapq.merge(*parts, key=lambda row: (row[0] is not None, row[0], row[1]), reverse=descending)
+    return list(islice(merged, limit))
+
+
+def _merge_page(parts: List[List[tuple]], tag: str, limit: Optional[int], descending: bool):
+    # Каждый шард отдаёт до limit + 1 строк после курсора, поэтому первые
+    # limit + 1 строк слияния - те же, что вернул бы запрос к одной базе
+    return _page(_merge_rows(parts, descending, None if limit is None else limit + 1), tag, limit)
+
+
+def _sum(parts: List[int]) -> int:
+    return sum(parts)
+
+
+async def create_note_async(note: NoteBase, session) -> NoteBase:
+    if isinstance(session, ShardedAsyncSession):
+        session = session.shard(session.next_index())
+    return await session.run_sync(lambda s: create_note(note, s))
+
+
+async def change_note_async(id: int, session, new_data: dict,
+                            expected_version: Optional[int] = None) -> Optional[NoteBase]:
+    return await _route(session, id).run_sync(lambda s: change_note(id, s, new_data, expected_version))
+
+
+async def delete_note_async(id: int, session) -> bool:
+    return await _route(session, id).run_sync(lambda s: delete_note(id, s))
+
+
+async def get_version_async(session, name: str) -> int:
+    # Версии шардов только растут, поэтому их сумма годится для ETag
+    return await _gather(session, lambda s: get_version(s, name), _sum)
+
+
+async def get_event_seq_async(session) -> int:
+    """Номер последнего события /events."""
+    if isinstance(session, ShardedAsyncSession):
+        return session.database.last_event_id
+    return await get_version_async(session, CHANGES)
+
+
+def _snapshot(result):
+    if result is None:
+        return None
+    if isinstance(result, tuple):
+        rows, next_cursor = result
+        return [_columns(row) for row in rows], next_cursor
+    if isinstance(result, list):
+        return [_columns(row) for row in result]
+    return _columns(result)
+
+
+async def _cached(cache: Optional[ReadCache], key: tuple, session, read, merge=None):
+    # С кэшем функции чтения возвращают снимки строк (словари), а не объекты ORM:
+    # один результат отдаётся многим запросам с разными сессиями.
+    # При шардах read выполняется в каждом шарде, merge объединяет результаты
+    snapshot = _snapshot if cache is not None else (lambda result: result)
+
+    async def load():
+        if isinstance(session, ShardedAsyncSession):
+            return snapshot(merge(await session.scatter(read)))
+        return await session.run_sync(lambda s: snapshot(read(s)))
+
+    if cache is None:
+        return await load()
+    return await cache.get_or_load(key, load)
+
+
+async def get_all_notes_async(session, cache: Optional[ReadCache] = None) -> List[NoteBase]:
+    merge = lambda parts: list(heapq.merge(*parts, key=lambda note: note.created_date, reverse=True))
+    return await _cached(cache, (NOTES, "all"), session, get_all_notes, merge)
+
+
+async def get_notes_page_async(session, limit: Optional[int] = None, after: Optional[str] = None,
+                               sort: str = "created", order: str = "desc",
+                               filters: Optional[NoteFilters] = None,
+                               cache: Optional[ReadCache] = None,
+                               version: Optional[int] = None,
+                               columns: Optional[Tuple[str, ...]] = None) -> Tuple[List[NoteBase], Optional[str]]:
+    # Версия коллекции в ключе: между COMMIT и сбросом кэша чужой записью
+    # старый снимок не будет выдан под новым ETag
+    key = (NOTES, "page", limit, after, sort, order, repr(filters), columns, version)
+    if isinstance(session, ShardedAsyncSession):
+        query, tag = _notes_page_query(limit, after, sort, order, filters, columns)
+        return await _cached(cache, key, session, lambda s: _keyset_rows(s, query, columns),
+                             lambda parts: _merge_page(parts, tag, limit, order == "desc"))
+    return await _cached(cache, key, session,
+                         lambda s: get_notes_page(s, limit, after, sort, order, filters, columns))
+
+
+async def explain_notes_page_async(session, limit: Optional[int] = None, after: Optional[str] = None,
+                                   sort: str = "created", order: str = "desc",
+                                   filters: Optional[NoteFilters] = None,
+                                   columns: Optional[Tuple[str, ...]] = None) -> List[str]:
+    # Схема шардов одинакова: план запроса в основном файле тот же, что в остальных
+    return await _primary(session).run_sync(lambda s: explain_notes_page(s, limit, after, sort, order, filters, columns))
+
+
+async def search_notes_async(session, query: str, limit: int = 20, offset: int = 0) -> List[dict]:
+    # Шард отдаёт первые offset + limit совпадений; bm25 считается по статистике
+    # своего шарда, поэтому при шардах порядок совпадений приблизительный
+    if isinstance(session, ShardedAsyncSession):
+        parts = await session.scatter(lambda s: search_notes(s, query, limit + offset, 0))
+        merged = heapq.merge(*parts, key=lambda row: (row["rank"], row["id"]))
+        return list(islice(merged, offset, offset + limit))
+    return await session.run_sync(lambda s: search_notes(s, query, limit, offset))
+
+
+async def get_note_by_id_async(id: int, session, cache: Optional[ReadCache] = None) -> Optional[NoteBase]:
+    # Ключ не зависит от версии коллекции: запись заметки сбрасывает её ключ
+    # (NOTE, id) после коммита, и чтение одной заметки обходится одним запросом
+    return await _cached(cache, (NOTE, id), _route(session, id), lambda s: get_note_by_id(id, s))
+
+
+async def move_to_trash_async(id: int, session) -> Optional[NoteBase]:
+    return await _route(session, id).run_sync(lambda s: move_to_trash(id, s))
+
+
+async def get_all_trashed_async(session, cache: Optional[ReadCache] = None) -> List[NoteBase]:
+    merge = lambda parts: list(heapq.merge(*parts, key=lambda note: note.deleted_date, reverse=True))
+    return await _cached(cache, (TRASH, "all"), session, get_all_trashed, merge)
+
+
+async def get_trashed_page_async(session, limit: Optional[int] = None, after: Optional[str] = None,
+                                 cache: Optional[ReadCache] = None,
+                                 version: Optional[int] = None) -> Tuple[List[NoteBase], Optional[str]]:
+    key = (TRASH, "page", limit, after, version)
+    if isinstance(session, ShardedAsyncSession):
+        query = _trashed_page_query(limit, after)
+        return await _cached(cache, key, session, lambda s: _keyset_rows(s, query),
+                             lambda parts: _merge_page(parts, TRASH_TAG, limit, True))
+    return await _cached(cache, key, session, lambda s: get_trashed_page(s, limit, after))
+
+
+async def restore_from_trash_async(id: int, session) -> Optional[NoteBase]:
+    return await _route(session, id).run_sync(lambda s: restore_from_trash(id, s))
+
+
+async def delete_from_trash_async(id: int, session) -> bool:
+    return await _route(session, id).run_sync(lambda s: delete_from_trash(id, s))
+
+
+async def count_expired_trash_async(session, cutoff: datetime) -> int:
+    return await _gather(session, lambda s: count_expired_trash(s, cutoff), _sum)
+
+
+async def purge_trash_batch_async(session, cutoff: datetime, batch_size: int) -> int:
+    return await _gather(session, lambda s: purge_trash_batch(s, cutoff, batch_size), _sum)
+
+
+def parse_change_cursor(since: Union[int, str], shards: int) -> Optional[List[int]]:
+    # Курсор журнала изменений: номер изменения, при шардах - номера изменений
+    # шардов через точку. Курсор для другого числа шардов - None
+    parts = str(since).split(".")
+    if len(parts) != shards or not all(part.isdigit() for part in parts):
+        return None
+    return [int(part) for part in parts]
+
+
+def _merge_changes(parts: List[dict]) -> dict:
+    return {
+        "seq": ".".join(str(part["seq"]) for part in parts),
+        "reset": any(part["reset"] for part in parts),
+        "notes": [note for part in parts for note in part["notes"]],
+        "deleted": [id for part in parts for id in part["deleted"]],
+    }
+
+
+async def get_changes_async(session, since: Union[int, str]) -> dict:
+    if not isinstance(session, ShardedAsyncSession):
+        seqs = parse_change_cursor(since, 1)
+        return await session.run_sync(lambda s: get_changes(s, seqs[0] if seqs else 0))
+
+    seqs = parse_change_cursor(since, session.count)
+    parts = await asyncio.gather(*(
+        session.shard(index).run_sync(
+            lambda s, index=index: get_changes(s, seqs[index], from_start=True) if seqs else get_changes(s, 0)
+        )
+        for index in range(session.count)
+    ))
+    return _merge_changes(parts)
+
+
+async def count_expired_tombstones_async(session, cutoff: datetime) -> int:
+    return await _gather(session, lambda s: count_expired_tombstones(s, cutoff), _sum)
+
+
+async def compact_tombstones_async(session, cutoff: datetime) -> int:
+    return await _gather(session, lambda s: compact_tombstones(s, cutoff), _sum)
+
+
+# Черновики хранятся в основном файле
+
+async def write_drafts_async(session, rows: List[dict], deleted: Iterable[str] = ()) -> None:
+    await _primary(session).run_sync(lambda s: write_drafts(s, rows, deleted))
+
+
+async def get_draft_async(session, key: str) -> Optional[NoteDraft]:
+    return await _primary(session).run_sync(lambda s: get_draft(s, key))
+
+
+async def get_drafts_async(session) -> List[NoteDraft]:
+    return await _primary(session).run_sync(get_drafts)
+
+
+class _Descending:
+    # Обратный порядок для кучи heapq, которая выдаёт наименьший элемент
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+
+async def _merge_streams(streams: list, key, chunk_size: int):
+    # Слияние потоков порций, упорядоченных по убыванию key в каждом шарде
+    iterators = [stream.__aiter__() for stream in streams]
+    buffers = [deque() for _ in streams]
+
+    async def refill(index: int) -> bool:
+        while not buffers[index]:
+            try:
+                buffers[index].extend(await iterators[index].__anext__())
+            except StopAsyncIteration:
+                return False
+        return True
+
+    heap = []
+    for index in range(len(iterators)):
+        if await refill(index):
+            heap.append((_Descending(key(buffers[index][0])), index))
+    heapq.heapify(heap)
+    partition = []
+    while heap:
+        _, index = heapq.heappop(heap)
+        partition.append(buffers[index].popleft())
+        if len(partition) == chunk_size:
+            yield partition
+            partition = []
+        if await refill(index):
+            heapq.heappush(heap, (_Descending(key(buffers[index][0])), index))
+    if partition:
+        yield partition
+
+
+async def stream_notes_async(session, ids: Optional[List[int]] = None, chunk_size: int = 200):
+    # Заметки читаются порциями через курсор, не загружая всю таблицу в память
+    if isinstance(session, ShardedAsyncSession):
+        streams = [
+            stream_notes_async(session.shard(index),
+                               None if ids is None else [id for id in ids if id % session.count == index],
+                               chunk_size)
+            for index in range(session.count)
+            if ids is None or any(id % session.count == index for id in ids)
+        ]
+        async for partition in _merge_streams(streams, lambda note: (note.created_date, note.id), chunk_size):
+            yield partition
+        return
+
+    query = (
+        select(NoteBase)
+        .where(LIVE)
+        .order_by(NoteBase.created_date.desc(), NoteBase.id.desc())
+        .execution_options(yield_per=chunk_size)
+    )
+    if ids is not None:
+        query = query.where(NoteBase.id.in_(ids))
+    result = await session.stream_scalars(query)
+    async for partition in result.partitions():
+        yield partition
+
+
+async def _apply_batch_async(operations: List[tuple], session, apply) -> List[Optional[int]]:
+    if not isinstance(session, ShardedAsyncSession):
+        return await session.run_sync(lambda s: apply(operations, s))
+
+    # Операции делятся по шардам с сохранением порядка внутри шарда; каждая
+    # часть - одна транзакция своего шарда, но весь пакет не атомарен
+    parts = [[] for _ in range(session.count)]
+    for index, (op, id, data) in enumerate(operations):
+        shard = session.next_index() if id is None else id % session.count
+        parts[shard].append((index, (op, id, data)))
+    results = [None] * len(operations)
+
+    async def run(shard: int, items: list) -> None:
+        shard_results = await session.shard(shard).run_sync(lambda s: apply([op for _, op in items], s))
+        for (index, _), result in zip(items, shard_results):
+            results[index] = result
+
+    await asyncio.gather(*(run(shard, items) for shard, items in enumerate(parts) if items))
+    return results
+
+
+async def apply_notes_batch_async(operations: List[tuple], session) -> List[Optional[int]]:
+    return await _apply_batch_async(operations, session, apply_notes_batch)
+
+
+async def apply_trash_batch_async(operations: List[tuple], session) -> List[Optional[int]]:
+    return await _apply_batch_async(operations, session, apply_trash_batch)
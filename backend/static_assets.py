@@ -0,0 +1,135 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from dataclasses import dataclass, field, replace
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен, без него отдаются gzip и исходные файлы
+    brotli = None
+
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend")
+STATIC_PREFIX = "/static/"
+
+# Файлы с отпечатком не меняются никогда, HTML всегда перепроверяется по ETag
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+PAGES = ("index.html", "trash.html", "404.html")
+ASSETS = ("style.css", "script.js", "image.png")
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+MEDIA_TYPES = {".js": "application/javascript", ".css": "text/css", ".html": "text/html; charset=utf-8"}
+
+
+@dataclass
+class Asset:
+    name: str
+    url: str
+    media_type: str
+    etag: str
+    cache_control: str
+    variants: Dict[str, bytes] = field(default_factory=dict)
+
+    def negotiate(self, accept_encoding: str) -> str:
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and accepted.get(encoding, accepted.get("*", 0)) > 0:
+                return encoding
+        return "identity"
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    accepted = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        match = re.search(r"q=([0-9.]+)", params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    return accepted
+
+
+def _compress(body: bytes, media_type: str) -> Dict[str, bytes]:
+    variants = {"identity": body}
+    if not media_type.startswith(COMPRESSIBLE_TYPES):
+        return variants
+    # mtime=0: одинаковый файл всегда сжимается в одинаковые байты
+    candidates = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        candidates["br"] = brotli.compress(body, quality=11)
+    for encoding, compressed in candidates.items():
+        if len(compressed) < len(body):
+            variants[encoding] = compressed
+    return variants
+
+
+def _media_type(name: str) -> str:
+    extension = os.path.splitext(name)[1]
+    return MEDIA_TYPES.get(extension) or mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+class StaticAssets:
+    """Файлы фронтенда в памяти: с отпечатком содержимого в имени и заранее сжатые."""
+
+    def __init__(self, root: str = FRONTEND_DIR):
+        self.root = root
+        self.by_url: Dict[str, Asset] = {}
+        self.fingerprints: Dict[str, str] = {}
+        self.loaded = False
+
+    def _read(self, name: str) -> bytes:
+        with open(os.path.join(self.root, name), "rb") as file:
+            return file.read()
+
+    def _add(self, name: str, body: bytes, url: str, cache_control: str) -> Asset:
+        media_type = _media_type(name)
+        digest = hashlib.sha256(body).hexdigest()
+        asset = Asset(
+            name=name,
+            url=url,
+            media_type=media_type,
+            etag=f'"{digest[:16]}"',
+            cache_control=cache_control,
+            variants=_compress(body, media_type)
+        )
+        self.by_url[url] = asset
+        return asset
+
+    def load(self) -> None:
+        self.by_url, self.fingerprints = {}, {}
+        for name in ASSETS:
+            body = self._read(name)
+            stem, extension = os.path.splitext(name)
+            digest = hashlib.sha256(body).hexdigest()[:10]
+            asset = self._add(name, body, f"{STATIC_PREFIX}{stem}.{digest}{extension}", IMMUTABLE_CACHE)
+            self.fingerprints[name] = asset.url
+            # Старые адреса без отпечатка продолжают работать, но перепроверяются
+            alias = replace(asset, url=f"/{name}", cache_control=REVALIDATE_CACHE)
+            self.by_url[alias.url] = alias
+
+        names = "|".join(re.escape(name) for name in self.fingerprints)
+        pattern = re.compile(r'(href|src)="(?:\./|/)?(%s)"' % names)
+        for name in PAGES:
+            html = self._read(name).decode("utf-8")
+            html = pattern.sub(lambda m: f'{m.group(1)}="{self.fingerprints[m.group(2)]}"', html)
+            self._add(name, html.encode("utf-8"), f"/{name}", REVALIDATE_CACHE)
+        self.loaded = True
+
+    def get(self, url: str) -> Optional[Asset]:
+        if not self.loaded:
+            self.load()
+        return self.by_url.get(url)
+
+    def url_for(self, name: str) -> str:
+        if not self.loaded:
+            self.load()
+        return self.fingerprints.get(name, f"/{name}")
@@ -1,12 +1,21 @@
 """Конфигурация pytest и общие фикстуры."""
 
 import pytest
+import pytest_asyncio
+import shutil
 import sys
 import os
+import tempfile
+import time
 
 # Добавляем родительскую директорию в путь для импорта модулей
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# Тесты работают с временной базой, а не с db/data.db. Переменная задаётся
+# до импорта main.py: main.app и его хранилище создаются при импорте
+TEST_DB_DIR = tempfile.mkdtemp(prefix="notes-tests-")
+os.environ.setdefault("NOTES_DB_DATABASE", os.path.join(TEST_DB_DIR, "data.db"))
+
 
 @pytest.fixture(autouse=True)
 def setup_path():
@@ -15,3 +24,75 @@ def setup_path():
     if backend_dir not in sys.path:
         sys.path.insert(0, backend_dir)
     yield
+
+
+@pytest.fixture(scope="session", autouse=True)
+def test_database():
+    """Создаёт схему временной базы один раз на запуск тестов."""
+    from main import app
+
+    app.state.database.ensure_schemas()
+    yield
+    app.state.database.engine.dispose()
+    shutil.rmtree(TEST_DB_DIR, ignore_errors=True)
+
+
+@pytest_asyncio.fixture
+async def async_test_session():
+    """Создает асинхронную тестовую сессию поверх aiosqlite."""
+    from models.models import Base
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from sqlalchemy.pool import StaticPool
+
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    AsyncSession = async_sessionmaker(bind=engine, expire_on_commit=False)
+    async with AsyncSession() as session:
+        yield session
+    await engine.dispose()
+
+
+@pytest.fixture
+def local_timezone(monkeypatch):
+    """Переводит процесс в часовой пояс, отличный от UTC (с летним временем)."""
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+class QueryCounter:
+    """Собирает SQL-запросы, выполненные движками приложения."""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(" ".join(statement.split()))
+
+    def __len__(self):
+        return len(self.statements)
+
+    def reset(self):
+        self.statements.clear()
+
+    def report(self) -> str:
+        return "\n".join(self.statements)
+
+
+@pytest.fixture
+def query_counter():
+    """Считает запросы к базе приложения: лишний запрос в обработчике роняет тест."""
+    from sqlalchemy import event
+    from main import app
+
+    counter = QueryCounter()
+    database = app.state.database
+    targets = (database.engine, database.async_engine.sync_engine)
+    for target in targets:
+        event.listen(target, "before_cursor_execute", counter)
+    yield counter
+    for target in targets:
+        event.remove(target, "before_cursor_execute", counter)
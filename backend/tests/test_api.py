@@ -3,8 +3,13 @@
 import pytest
 from fastapi.testclient import TestClient
 from datetime import datetime
+import io
+import json
+import re
 import sys
 import os
+import time
+import zipfile
 
 sys.path.insert(0, '..')
 
@@ -43,6 +48,55 @@ class TestStaticRoutes:
         assert response.status_code == 200
 
 
+class TestStaticAssets:
+    """Тесты для раздачи статики из памяти."""
+
+    def _asset_url(self, client, name):
+        html = client.get("/").text
+        match = re.search(r'"(/static/%s\.[0-9a-f]+\.%s)"' % tuple(name.split(".")), html)
+        assert match, name
+        return match.group(1)
+
+    def test_html_references_fingerprinted_assets(self, client):
+        """Тест: HTML ссылается на файлы с отпечатком содержимого."""
+        for name in ["style.css", "script.js", "image.png"]:
+            url = self._asset_url(client, name)
+            response = client.get(url)
+            assert response.status_code == 200
+            assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+
+    def test_gzip_negotiation(self, client):
+        """Тест: сжатый вариант отдается только при поддержке клиентом."""
+        url = self._asset_url(client, "script.js")
+
+        compressed = client.get(url, headers={"Accept-Encoding": "gzip"})
+        assert compressed.headers["content-encoding"] == "gzip"
+        assert "Accept-Encoding" in compressed.headers["vary"]
+        assert int(compressed.headers["content-length"]) < len(compressed.content)
+
+        plain = client.get(url, headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in plain.headers
+        assert plain.content == compressed.content
+
+    def test_png_not_compressed(self, client):
+        """Тест: уже сжатые изображения не сжимаются повторно."""
+        response = client.get("/image.png", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-type"] == "image/png"
+        assert "content-encoding" not in response.headers
+
+    def test_html_revalidation(self, client):
+        """Тест: HTML перепроверяется по ETag и отдает 304."""
+        etag = client.get("/").headers["etag"]
+        response = client.get("/", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert client.get("/").headers["cache-control"] == "no-cache"
+
+    def test_unknown_static_asset(self, client):
+        """Тест: неизвестный файл статики - 404."""
+        response = client.get("/static/style.0000000000.css")
+        assert response.status_code == 404
+
+
 class TestNotesAPI:
     """Тесты для API заметок."""
 
@@ -241,6 +295,912 @@ class TestTrashAPI:
         trash_ids = [item["id"] for item in get_trash_response.json()]
         assert trash_id not in trash_ids
 
+    def test_trash_keeps_note_id(self, client):
+        """Тест: заметка в корзине и после восстановления сохраняет свой id."""
+        note_id = client.post("/notes/", json={"headline": "Стабильный id"}).json()["id"]
+
+        trashed = client.post(f"/notes/{note_id}/trash").json()
+        assert trashed["id"] == note_id
+        assert trashed["original_id"] == note_id
+        assert client.put(f"/notes/{note_id}", json={"text": "x"}).status_code == 404
+
+        listed = [item for item in client.get("/trash/").json() if item["id"] == note_id]
+        assert listed[0]["original_id"] == note_id
+
+        assert client.post(f"/trash/{note_id}/restore").json()["id"] == note_id
+        assert client.post(f"/trash/{note_id}/restore").status_code == 404
+        assert client.delete(f"/trash/{note_id}").status_code == 404
+
+
+class TestTrashPurgeAPI:
+    """Тесты для ручного запуска очистки корзины."""
+
+    def _trash(self, client, count):
+        ids = []
+        for i in range(count):
+            note_id = client.post("/notes/", json={"headline": f"Очистка {i}"}).json()["id"]
+            client.post(f"/notes/{note_id}/trash")
+            ids.append(note_id)
+        return ids
+
+    def test_dry_run_keeps_notes(self, client):
+        """Тест: пробный запуск только считает заметки."""
+        ids = self._trash(client, 2)
+
+        response = client.post("/trash/purge", params={"dry_run": True, "max_age_days": 0})
+        assert response.status_code == 200
+        report = response.json()
+        assert report["dry_run"] is True
+        assert report["removed"] >= 2
+        assert report["tombstones_removed"] >= 0
+        assert report["batches"] == []
+
+        trash_ids = [item["id"] for item in client.get("/trash/").json()]
+        assert set(ids) <= set(trash_ids)
+
+    def test_purge_in_batches(self, client, monkeypatch):
+        """Тест: очистка удаляет заметки порциями и сообщает о каждой."""
+        from dataclasses import replace
+        retention = app.state.trash_retention
+        monkeypatch.setattr(retention, "settings", replace(retention.settings, batch_size=2, pause=0))
+        ids = self._trash(client, 3)
+
+        report = client.post("/trash/purge", params={"max_age_days": 0}).json()
+        assert report["dry_run"] is False
+        assert report["removed"] >= 3
+        assert len(report["batches"]) >= 2
+        assert all(batch["removed"] <= 2 for batch in report["batches"])
+        assert sum(batch["removed"] for batch in report["batches"]) == report["removed"]
+
+        trash_ids = [item["id"] for item in client.get("/trash/").json()]
+        assert not set(ids) & set(trash_ids)
+        assert client.get("/trash/purge").json()["removed"] == report["removed"]
+
+    def test_default_age_keeps_recent(self, client):
+        """Тест: недавно удаленные заметки не попадают под очистку по умолчанию."""
+        ids = self._trash(client, 1)
+        client.post("/trash/purge")
+        trash_ids = [item["id"] for item in client.get("/trash/").json()]
+        assert ids[0] in trash_ids
+
+
+class TestNoteChangesAPI:
+    """Тесты для синхронизации через /notes/changes."""
+
+    def test_since_zero_returns_reset(self, client):
+        """Тест: первый запрос возвращает текущий номер и требует полной загрузки."""
+        response = client.get("/notes/changes", params={"since": 0})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["reset"] is True
+        assert data["notes"] == []
+        assert data["seq"] >= 0
+
+    def test_changes_after_writes(self, client):
+        """Тест: создание, изменение и перемещение в корзину приходят как дельта."""
+        kept = client.post("/notes/", json={"headline": "Синхронизация"}).json()["id"]
+        trashed = client.post("/notes/", json={"headline": "В корзину"}).json()["id"]
+        seq = client.get("/notes/changes", params={"since": 0}).json()["seq"]
+
+        created = client.post("/notes/", json={"headline": "Новая"}).json()["id"]
+        client.put(f"/notes/{kept}", json={"text": "Новый текст"})
+        client.post(f"/notes/{trashed}/trash")
+
+        data = client.get("/notes/changes", params={"since": seq}).json()
+        assert data["reset"] is False
+        assert data["seq"] >= seq + 3
+        changed = {note["id"]: note for note in data["notes"]}
+        assert {kept, created} <= set(changed)
+        assert changed[kept]["text"] == "Новый текст"
+        assert trashed in data["deleted"]
+        assert trashed not in changed
+
+        again = client.get("/notes/changes", params={"since": data["seq"]}).json()
+        assert again["reset"] is False
+        assert not {kept, created, trashed} & {note["id"] for note in again["notes"]}
+
+    def test_negative_since_rejected(self, client):
+        """Тест: отрицательный since отклоняется."""
+        assert client.get("/notes/changes", params={"since": -1}).status_code == 422
+        assert client.get("/notes/changes").status_code == 422
+
+
+class TestPagination:
+    """Тесты курсорной пагинации списков."""
+
+    def test_notes_pagination(self, client):
+        """Тест: страницы связаны курсором из заголовка X-Next-Cursor."""
+        created_ids = []
+        for i in range(3):
+            response = client.post("/notes/", json={"headline": f"Страница {i}"})
+            created_ids.append(response.json()["id"])
+
+        first = client.get("/notes/", params={"limit": 2})
+        assert first.status_code == 200
+        assert [n["id"] for n in first.json()] == created_ids[:0:-1]
+        cursor = first.headers["X-Next-Cursor"]
+
+        second = client.get("/notes/", params={"limit": 2, "after": cursor})
+        assert second.status_code == 200
+        assert second.json()[0]["id"] == created_ids[0]
+
+    def test_summary_view(self, client):
+        """Тест: краткий вид не содержит текста и намного меньше полного."""
+        for i in range(3):
+            client.post("/notes/", json={"headline": f"Кратко {i}", "text": "Длинный текст заметки " * 400})
+
+        full = client.get("/notes/", params={"limit": 3})
+        summary = client.get("/notes/", params={"limit": 3, "view": "summary"})
+        assert summary.status_code == 200
+        item = summary.json()[0]
+        assert "text" not in item
+        assert item["preview"].startswith("Длинный текст заметки")
+        assert [n["id"] for n in summary.json()] == [n["id"] for n in full.json()]
+        assert len(summary.content) * 10 < len(full.content)
+        assert summary.headers["etag"] != full.headers["etag"]
+
+        opened = client.get(f"/notes/{item['id']}").json()
+        assert opened["text"].startswith("Длинный текст заметки")
+
+    def test_fields_projection(self, client):
+        """Тест: ?fields= возвращает только перечисленные поля и id."""
+        client.post("/notes/", json={"headline": "Поля"})
+        response = client.get("/notes/", params={"limit": 1, "fields": "headline,change_date"})
+        assert response.status_code == 200
+        assert set(response.json()[0]) == {"id", "headline", "change_date"}
+
+        assert client.get("/notes/", params={"fields": "headline,secret"}).status_code == 400
+
+    def test_trash_pagination(self, client):
+        """Тест: пагинация корзины."""
+        for i in range(2):
+            note_id = client.post("/notes/", json={"headline": f"Корзина {i}"}).json()["id"]
+            client.post(f"/notes/{note_id}/trash")
+
+        response = client.get("/trash/", params={"limit": 1})
+        assert response.status_code == 200
+        assert len(response.json()) == 1
+        assert "X-Next-Cursor" in response.headers
+
+    def test_invalid_cursor(self, client):
+        """Тест: некорректный курсор возвращает 400."""
+        response = client.get("/notes/", params={"limit": 2, "after": "мусор"})
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize("path, tag, value", [
+        ("/notes/", "created:desc", 12345),
+        ("/notes/", "created:desc", ["2024-01-01"]),
+        ("/notes/", "created:desc", "2024-01-01T00:00:00"),
+        ("/trash/", "deleted:desc", None),
+        ("/trash/", "deleted:desc", "2024-01-01T00:00:00"),
+    ])
+    @pytest.mark.parametrize("id", [[1], {"id": 1}, None, 1])
+    def test_malformed_cursor_values(self, client, path, tag, value, id):
+        """Тест: подделанный курсор с неверными типами значений - 400, а не 500."""
+        from sql import encode_cursor
+
+        response = client.get(path, params={"limit": 2, "after": encode_cursor(tag, value, id)})
+        valid = isinstance(value, str) and id == 1
+        assert response.status_code == (200 if valid else 400)
+
+    def test_limit_out_of_range(self, client):
+        """Тест: limit вне допустимого диапазона."""
+        response = client.get("/notes/", params={"limit": 0})
+        assert response.status_code == 422
+
+
+class TestSortingAPI:
+    """Тесты серверной сортировки и фильтрации."""
+
+    def test_sort_and_filter(self, client):
+        """Тест: фильтр по важности и сортировка по заголовку."""
+        response = client.get("/notes/", params={
+            "sort": "headline", "order": "asc", "importance": [2, 3]
+        })
+        assert response.status_code == 200
+        notes = response.json()
+        assert all(n["improtance"] in (2, 3) for n in notes)
+        headlines = [n["headline"] for n in notes]
+        assert headlines == sorted(headlines)
+
+    def test_debug_reports_query_plan(self, client):
+        """Тест: при debug ответ содержит план запроса."""
+        response = client.get("/notes/", params={"sort": "importance", "limit": 5, "debug": True})
+        assert response.status_code == 200
+        assert "ix_notes_improtance_id" in response.headers["X-Query-Plan"]
+
+    def test_unknown_sort(self, client):
+        """Тест: неизвестная сортировка - ошибка валидации."""
+        response = client.get("/notes/", params={"sort": "color"})
+        assert response.status_code == 422
+
+
+class TestBatchAPI:
+    """Тесты пакетных эндпоинтов."""
+
+    def test_notes_batch(self, client):
+        """Тест: пакет создания, изменения и удаления в корзину."""
+        response = client.post("/notes/batch", json={"operations": [
+            {"op": "create", "note": {"headline": "Пакет 1"}},
+            {"op": "create", "note": {"headline": "Пакет 2", "improtance": 3}},
+        ]})
+        assert response.status_code == 200
+        created = response.json()["results"]
+        assert [r["status"] for r in created] == [201, 201]
+        first_id, second_id = created[0]["result_id"], created[1]["result_id"]
+
+        response = client.post("/notes/batch", json={"operations": [
+            {"op": "update", "id": first_id, "note": {"headline": "Изменён"}},
+            {"op": "trash", "id": second_id},
+            {"op": "delete", "id": 999999},
+        ]})
+        results = response.json()["results"]
+        assert [r["status"] for r in results] == [200, 200, 404]
+        assert client.get(f"/notes/{first_id}").json()["headline"] == "Изменён"
+        assert client.get(f"/notes/{second_id}").status_code == 404
+
+        trash_id = results[1]["result_id"]
+        response = client.post("/trash/batch", json={"operations": [
+            {"op": "restore", "id": trash_id},
+        ]})
+        restored_id = response.json()["results"][0]["result_id"]
+        assert client.get(f"/notes/{restored_id}").json()["headline"] == "Пакет 2"
+
+    def test_batch_validation(self, client):
+        """Тест: неизвестная операция и пустой пакет отклоняются."""
+        assert client.post("/notes/batch", json={"operations": []}).status_code == 422
+        response = client.post("/notes/batch", json={"operations": [{"op": "restore", "id": 1}]})
+        assert response.status_code == 422
+
+
+class TestExportAPI:
+    """Тесты потокового экспорта."""
+
+    def test_export_json(self, client):
+        """Тест: экспорт выбранных заметок в JSON."""
+        first = client.post("/notes/", json={"headline": "Экспорт 1", "text": "один"}).json()["id"]
+        second = client.post("/notes/", json={"headline": "Экспорт 2", "improtance": 3}).json()["id"]
+
+        response = client.get("/notes/export", params={"format": "json", "ids": f"{first},{second}"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/json")
+        assert "attachment" in response.headers["content-disposition"]
+        data = response.json()
+        assert {item["headline"] for item in data} == {"Экспорт 1", "Экспорт 2"}
+        assert {item["importance"] for item in data} == {1, 3}
+
+    def test_export_ndjson_and_txt(self, client):
+        """Тест: форматы NDJSON и TXT."""
+        note_id = client.post("/notes/", json={"headline": "Строка", "text": "тело"}).json()["id"]
+
+        ndjson = client.get("/notes/export", params={"format": "ndjson", "ids": str(note_id)})
+        lines = ndjson.text.strip().split("\n")
+        assert len(lines) == 1
+        assert json.loads(lines[0])["headline"] == "Строка"
+
+        txt = client.get("/notes/export", params={"format": "txt", "ids": str(note_id)})
+        assert "Заголовок: Строка" in txt.text
+        assert "тело" in txt.text
+
+    def test_export_empty_selection(self, client):
+        """Тест: экспорт несуществующих заметок даёт пустой массив."""
+        response = client.get("/notes/export", params={"format": "json", "ids": "999999"})
+        assert response.json() == []
+
+    def test_export_invalid_params(self, client):
+        """Тест: неверный формат или список id."""
+        assert client.get("/notes/export", params={"format": "pdf"}).status_code == 422
+        assert client.get("/notes/export", params={"ids": "1,abc"}).status_code == 400
+
+
+class TestExportJobsAPI:
+    """Тесты фоновых задач экспорта."""
+
+    @pytest.fixture
+    def jobs_client(self, tmp_path, monkeypatch):
+        """Клиент с запущенным циклом событий и временной папкой для файлов."""
+        monkeypatch.setattr(app.state.export_jobs, "spool_dir", str(tmp_path))
+        with TestClient(app) as client:
+            yield client
+
+    def _wait(self, client, job_id):
+        for _ in range(200):
+            response = client.get(f"/exports/{job_id}")
+            if response.status_code != 202:
+                return response
+            time.sleep(0.05)
+        raise AssertionError("Задача экспорта не завершилась")
+
+    def test_zip_export_job(self, jobs_client):
+        """Тест: задача выполняется и отдаёт архив, повтор берётся из кэша."""
+        import main
+        note_id = jobs_client.post("/notes/", json={"headline": "Архив", "text": "в архиве"}).json()["id"]
+
+        response = jobs_client.post("/exports", json={"format": "zip", "ids": [note_id]})
+        assert response.status_code == 202
+        job_id = response.json()["id"]
+
+        result = self._wait(jobs_client, job_id)
+        assert result.status_code == 200
+        assert result.headers["content-type"] == "application/zip"
+        with zipfile.ZipFile(io.BytesIO(result.content)) as archive:
+            assert "Заголовок: Архив" in archive.read("00001.txt").decode()
+
+        repeat_id = jobs_client.post("/exports", json={"format": "zip", "ids": [note_id]}).json()["id"]
+        assert self._wait(jobs_client, repeat_id).status_code == 200
+        assert app.state.export_jobs.get(repeat_id).cached
+
+    def test_failed_job(self, jobs_client, monkeypatch):
+        """Тест: задача с ошибкой отдаётся как результат опроса, а не как ошибка сервера."""
+        import export_jobs
+
+        def fail(items, path):
+            raise OSError("диск заполнен")
+
+        monkeypatch.setitem(export_jobs.RENDERERS, "zip", fail)
+        job_id = jobs_client.post("/exports", json={"format": "zip", "ids": [1]}).json()["id"]
+        result = self._wait(jobs_client, job_id)
+        assert result.status_code == 200
+        assert result.json()["status"] == "failed"
+        assert result.json()["error"] == "диск заполнен"
+
+    def test_unknown_job(self, jobs_client):
+        """Тест: неизвестная задача - 404."""
+        assert jobs_client.get("/exports/нет-такой").status_code == 404
+
+    def test_invalid_format(self, jobs_client):
+        """Тест: неподдерживаемый формат задачи."""
+        assert jobs_client.post("/exports", json={"format": "docx"}).status_code == 422
+
+    def test_garbage_collection(self, jobs_client, tmp_path):
+        """Тест: просроченные файлы удаляются."""
+        stale = tmp_path / "stale.zip"
+        stale.write_bytes(b"old")
+        os.utime(stale, (0, 0))
+
+        assert app.state.export_jobs.collect_garbage() == 1
+        assert not stale.exists()
+
+
+class TestConditionalGet:
+    """Тесты для ETag и условных запросов."""
+
+    def test_list_returns_etag(self, client):
+        """Тест: список заметок отдается с ETag."""
+        response = client.get("/notes/")
+        assert response.status_code == 200
+        assert response.headers["etag"].startswith('"n')
+        assert response.headers["cache-control"] == "no-cache"
+
+    def test_list_not_modified(self, client):
+        """Тест: совпадающий If-None-Match дает 304 без тела."""
+        etag = client.get("/notes/", params={"limit": 5}).headers["etag"]
+
+        response = client.get("/notes/", params={"limit": 5}, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+
+    def test_etag_depends_on_params(self, client):
+        """Тест: разные параметры списка дают разные ETag."""
+        first = client.get("/notes/", params={"sort": "created"}).headers["etag"]
+        second = client.get("/notes/", params={"sort": "headline"}).headers["etag"]
+        assert first != second
+
+    def test_write_changes_etag(self, client):
+        """Тест: после записи старый ETag больше не подходит."""
+        etag = client.get("/notes/").headers["etag"]
+        trash_etag = client.get("/trash/").headers["etag"]
+        note_id = client.post("/notes/", json={"headline": "ETag"}).json()["id"]
+
+        response = client.get("/notes/", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+        # Создание заметки корзину не затрагивает
+        assert client.get("/trash/", headers={"If-None-Match": trash_etag}).status_code == 304
+
+        client.post(f"/notes/{note_id}/trash")
+        assert client.get("/trash/", headers={"If-None-Match": trash_etag}).status_code == 200
+
+    def test_single_note_not_modified(self, client):
+        """Тест: условный запрос одной заметки."""
+        note_id = client.post("/notes/", json={"headline": "Одна"}).json()["id"]
+        etag = client.get(f"/notes/{note_id}").headers["etag"]
+
+        assert client.get(f"/notes/{note_id}", headers={"If-None-Match": etag}).status_code == 304
+
+        client.put(f"/notes/{note_id}", json={"text": "Изменена"})
+        response = client.get(f"/notes/{note_id}", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.json()["text"] == "Изменена"
+
+
+class TestOptimisticConcurrency:
+    """Тесты для изменения заметки с If-Match."""
+
+    def test_etag_tracks_note_version(self, client):
+        """Тест: ETag заметки не меняется от записи в другие заметки."""
+        note_id = client.post("/notes/", json={"headline": "Своя версия"}).json()["id"]
+        etag = client.get(f"/notes/{note_id}").headers["etag"]
+        assert etag == f'"n{note_id}-v1"'
+
+        client.post("/notes/", json={"headline": "Другая"})
+        assert client.get(f"/notes/{note_id}", headers={"If-None-Match": etag}).status_code == 304
+
+    def test_if_match(self, client):
+        """Тест: запись со старым ETag отклоняется с 412 и текущим ETag."""
+        note_id = client.post("/notes/", json={"headline": "Два редактора"}).json()["id"]
+        etag = client.get(f"/notes/{note_id}").headers["etag"]
+
+        first = client.put(f"/notes/{note_id}", json={"text": "Первый"}, headers={"If-Match": etag})
+        assert first.status_code == 200
+        assert first.json()["version"] == 2
+        assert first.headers["etag"] == f'"n{note_id}-v2"'
+
+        second = client.put(f"/notes/{note_id}", json={"text": "Второй"}, headers={"If-Match": etag})
+        assert second.status_code == 412
+        assert second.headers["etag"] == first.headers["etag"]
+        assert client.get(f"/notes/{note_id}").json()["text"] == "Первый"
+
+    def test_if_match_other_forms(self, client):
+        """Тест: If-Match: * и ETag другой заметки."""
+        note_id = client.post("/notes/", json={"headline": "Звёздочка"}).json()["id"]
+        assert client.put(f"/notes/{note_id}", json={"text": "а"}, headers={"If-Match": "*"}).status_code == 200
+        other = f'"n{note_id + 1}-v2"'
+        assert client.put(f"/notes/{note_id}", json={"text": "б"}, headers={"If-Match": other}).status_code == 412
+        assert client.put("/notes/999999", json={"text": "в"}, headers={"If-Match": '"n999999-v1"'}).status_code == 404
+
+
+class TestQueryCounts:
+    """Тесты числа SQL-запросов на запрос к API.
+
+    Запись - один запрос к счётчикам collection_versions и один
+    INSERT/UPDATE/DELETE ... RETURNING; 404 определяется по результату
+    самой записи, без предварительного чтения.
+    """
+
+    def _count(self, query_counter, call):
+        query_counter.reset()
+        response = call()
+        return response, len(query_counter)
+
+    @pytest.mark.parametrize("method, path, body, status, budget", [
+        ("put", "/notes/{id}", {"text": "Изменена"}, 200, 2),
+        ("post", "/notes/{id}/trash", None, 200, 2),
+        ("delete", "/notes/{id}", None, 204, 3),
+        ("get", "/notes/{id}", None, 200, 2),
+        ("put", "/notes/999999", {"text": "Нет"}, 404, 2),
+        ("delete", "/notes/999999", None, 404, 1),
+        ("post", "/notes/999999/trash", None, 404, 2),
+    ])
+    def test_note_endpoints(self, client, query_counter, method, path, body, status, budget):
+        """Тест: обработчики заметок укладываются в бюджет запросов."""
+        query_counter.reset()
+        note_id = client.post("/notes/", json={"headline": "Запросы"}).json()["id"]
+        assert len(query_counter) <= 2, query_counter.report()
+
+        kwargs = {"json": body} if body is not None else {}
+        response, count = self._count(query_counter, lambda: getattr(client, method)(path.format(id=note_id), **kwargs))
+        assert response.status_code == status
+        assert count <= budget, query_counter.report()
+
+    def test_trash_endpoints(self, client, query_counter):
+        """Тест: восстановление и удаление из корзины укладываются в бюджет запросов."""
+        note_id = client.post("/notes/", json={"headline": "Корзина"}).json()["id"]
+        client.post(f"/notes/{note_id}/trash")
+
+        response, count = self._count(query_counter, lambda: client.post(f"/trash/{note_id}/restore"))
+        assert response.status_code == 200
+        assert count <= 2, query_counter.report()
+
+        client.post(f"/notes/{note_id}/trash")
+        response, count = self._count(query_counter, lambda: client.delete(f"/trash/{note_id}"))
+        assert response.status_code == 204
+        assert count <= 3, query_counter.report()
+
+        response, count = self._count(query_counter, lambda: client.delete(f"/trash/{note_id}"))
+        assert response.status_code == 404
+        assert count <= 1, query_counter.report()
+
+    def test_batch_does_not_grow_with_size(self, client, query_counter):
+        """Тест: пакет одного типа операций - постоянное число запросов."""
+        def create(count):
+            operations = [{"op": "create", "note": {"headline": f"Пакет {i}"}} for i in range(count)]
+            return self._count(query_counter, lambda: client.post("/notes/batch", json={"operations": operations}))
+
+        _, small = create(2)
+        response, large = create(50)
+        assert response.status_code == 200
+        assert large == small, query_counter.report()
+
+
+class TestFastResponses:
+    """Тесты для быстрой сериализации и сжатия списков."""
+
+    @pytest.fixture(autouse=True)
+    def fast_responses(self, monkeypatch):
+        import main
+        monkeypatch.setattr(main, "FAST_RESPONSES", True)
+
+    def _fill(self, client):
+        for i in range(5):
+            client.post("/notes/", json={"headline": f"Сжатие {i}", "text": "Длинный текст " * 100})
+
+    def test_same_body_as_models(self, client, monkeypatch):
+        """Тест: быстрый путь отдает то же, что и сериализация через pydantic."""
+        import main
+        self._fill(client)
+        fast = client.get("/notes/", params={"limit": 50}).json()
+        monkeypatch.setattr(main, "FAST_RESPONSES", False)
+        slow = client.get("/notes/", params={"limit": 50}).json()
+        assert fast == slow
+
+        slow_trash = client.get("/trash/", params={"limit": 50}).json()
+        monkeypatch.setattr(main, "FAST_RESPONSES", True)
+        assert client.get("/trash/", params={"limit": 50}).json() == slow_trash
+
+    def test_disabled_by_default(self, client, monkeypatch):
+        """Тест: без NOTES_FAST_RESPONSES=1 списки не сжимаются."""
+        import main
+        monkeypatch.setattr(main, "FAST_RESPONSES", False)
+        self._fill(client)
+        for params in ({}, {"fields": "id,text"}):
+            response = client.get("/notes/", params=params, headers={"Accept-Encoding": "gzip"})
+            assert "content-encoding" not in response.headers
+
+    def test_fields_json_when_disabled(self, client, monkeypatch):
+        """Тест: без NOTES_FAST_RESPONSES=1 выборка полей отдаётся в JSON при любом Accept."""
+        import main
+        import serialization
+        from types import SimpleNamespace
+
+        monkeypatch.setattr(main, "FAST_RESPONSES", False)
+        monkeypatch.setattr(serialization, "msgpack", SimpleNamespace(packb=lambda rows, **kwargs: b"\x90"))
+        self._fill(client)
+        params = {"fields": "id,text"}
+        as_json = client.get("/notes/", params=params)
+        response = client.get("/notes/", params=params, headers={"Accept": "application/msgpack"})
+        assert response.headers["content-type"] == "application/json"
+        assert response.json() == as_json.json()
+        assert "Accept" not in response.headers.get("vary", "")
+        assert response.headers["etag"] == as_json.headers["etag"]
+
+    def test_large_list_gzipped(self, client):
+        """Тест: большой список сжимается, у сжатого варианта свой ETag."""
+        self._fill(client)
+        response = client.get("/notes/", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["vary"]
+        assert response.headers["etag"].endswith('-gzip"')
+        assert len(response.json()) >= 3
+
+        cached = client.get("/notes/", headers={
+            "Accept-Encoding": "gzip", "If-None-Match": response.headers["etag"]
+        })
+        assert cached.status_code == 304
+
+    def test_identity_not_compressed(self, client):
+        """Тест: без gzip в Accept-Encoding ответ не сжимается."""
+        self._fill(client)
+        response = client.get("/notes/", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers
+        assert not response.headers["etag"].endswith('-gzip"')
+
+
+class TestDraftsAPI:
+    """Тесты для автосохранения черновиков /drafts."""
+
+    def test_save_read_delete(self, client):
+        """Тест: сохранённый черновик сразу читается, после удаления - 404."""
+        commits = app.state.draft_buffer.commits
+        for text in ("Ч", "Че", "Чер"):
+            response = client.put("/drafts/api-test", json={"headline": "Черновик", "text": text, "improtance": 2})
+            assert response.status_code == 202
+        assert response.json()["text"] == "Чер"
+        assert app.state.draft_buffer.commits == commits
+
+        assert client.get("/drafts/api-test").json()["text"] == "Чер"
+        assert "api-test" in [draft["key"] for draft in client.get("/drafts/").json()]
+
+        assert client.delete("/drafts/api-test").status_code == 204
+        assert client.get("/drafts/api-test").status_code == 404
+
+    def test_invalid_draft(self, client):
+        """Тест: недопустимый ключ и поля черновика отклоняются."""
+        assert client.put("/drafts/a.b", json={"text": "x"}).status_code == 422
+        assert client.put("/drafts/" + "k" * 65, json={"text": "x"}).status_code == 422
+        assert client.put("/drafts/1", json={"improtance": 5}).status_code == 422
+
+    def test_stats(self, client):
+        """Тест: статистика буфера черновиков."""
+        stats = client.get("/drafts/stats").json()
+        assert {"entries", "dirty", "puts", "coalesced", "commits"} <= set(stats)
+
+
+class TestReadCacheAPI:
+    """Тесты для кэша чтений на уровне API."""
+
+    def test_cache_stats(self, client):
+        """Тест: повторное чтение заметки попадает в кэш."""
+        note_id = client.post("/notes/", json={"headline": "Кэш"}).json()["id"]
+        client.get(f"/notes/{note_id}")
+        before = client.get("/cache/stats").json()["hits"]
+
+        client.get(f"/notes/{note_id}")
+        stats = client.get("/cache/stats").json()
+        assert stats["hits"] == before + 1
+        assert {"misses", "evictions", "size"} <= stats.keys()
+
+    def test_update_visible_after_cache(self, client):
+        """Тест: изменение заметки сразу видно, несмотря на кэш."""
+        note_id = client.post("/notes/", json={"headline": "До"}).json()["id"]
+        client.get(f"/notes/{note_id}")
+        client.get("/notes/")
+
+        client.put(f"/notes/{note_id}", json={"headline": "После"})
+        assert client.get(f"/notes/{note_id}").json()["headline"] == "После"
+        headlines = [n["headline"] for n in client.get("/notes/").json()]
+        assert "После" in headlines and "До" not in headlines
+
+    def test_note_cache_per_note(self, client):
+        """Тест: запись другой заметки не сбрасывает кэш заметки, перемещение в корзину - сбрасывает."""
+        note_id = client.post("/notes/", json={"headline": "Своя"}).json()["id"]
+        client.get(f"/notes/{note_id}")
+        client.post("/notes/", json={"headline": "Чужая"})
+        before = client.get("/cache/stats").json()["hits"]
+
+        assert client.get(f"/notes/{note_id}").json()["headline"] == "Своя"
+        assert client.get("/cache/stats").json()["hits"] == before + 1
+
+        client.delete(f"/notes/{note_id}")
+        assert client.get(f"/notes/{note_id}").status_code == 404
+
+
+class TestMetricsAPI:
+    """Тесты для /metrics."""
+
+    def test_metrics_exposition(self, client):
+        """Тест: задержка маршрута и время SQL в формате Prometheus."""
+        note_id = client.post("/notes/", json={"headline": "Метрики"}).json()["id"]
+        client.get(f"/notes/{note_id}")
+
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        body = response.text
+        assert 'notes_http_requests_total{method="GET",route="/notes/{note_id}",status="200"}' in body
+        assert 'notes_http_request_db_seconds_count{method="POST",route="/notes/"}' in body
+        assert "notes_db_statement_duration_seconds_bucket" in body
+        assert "notes_db_pool_wait_seconds_count" in body
+        assert "notes_cache_hits_total" in body
+
+    def test_metrics_disabled(self, monkeypatch):
+        """Тест: без метрик /metrics отвечает 404."""
+        import main
+
+        monkeypatch.setattr(main, "METRICS_ENABLED", False)
+        assert TestClient(main.create_app()).get("/metrics").status_code == 404
+
+
+class TestAppFactory:
+    """Тесты для create_app и запуска приложения."""
+
+    @pytest.fixture
+    def isolated_app(self, tmp_path):
+        from dataclasses import replace
+        from main import create_app
+
+        return create_app(replace(app.state.database.settings, database=str(tmp_path / "isolated.db")))
+
+    def test_isolated_database(self, isolated_app, tmp_path):
+        """Тест: приложение из фабрики работает со своей базой, схему создаёт lifespan."""
+        import sql
+
+        assert not (tmp_path / "isolated.db").exists()
+        with TestClient(isolated_app) as client:
+            assert isolated_app.state.database.settings.database == str(tmp_path / "isolated.db")
+            assert client.get("/notes/").json() == []
+            note_id = client.post("/notes/", json={"headline": "Изолированная"}).json()["id"]
+            assert client.get(f"/notes/{note_id}").json()["headline"] == "Изолированная"
+        assert sql.get_schema_version(isolated_app.state.database.engine) == sql.SCHEMA_VERSION
+        assert app.state.database.settings.database != str(tmp_path / "isolated.db")
+
+    def test_apps_do_not_share_state(self, isolated_app):
+        """Тест: у каждого приложения свои кэш, события и черновики; запись в одном не видна другому."""
+        with TestClient(isolated_app) as isolated, TestClient(app) as shared:
+            for name in ("database", "read_cache", "event_hub", "draft_buffer", "export_jobs", "assets"):
+                assert getattr(isolated_app.state, name) is not getattr(app.state, name)
+            note_id = shared.post("/notes/", json={"headline": "Общая"}).json()["id"]
+            shared.get(f"/notes/{note_id}")
+            published = isolated.get("/events/stats").json()["published"]
+
+            created = isolated.post("/notes/", json={"headline": "Своя"}).json()
+            assert isolated.get("/events/stats").json()["published"] == published + 1
+            if created["id"] == note_id:
+                assert shared.get(f"/notes/{note_id}").json()["headline"] == "Общая"
+            isolated.put("/drafts/isolated", json={"text": "Только здесь"})
+            assert shared.get("/drafts/isolated").status_code == 404
+
+    def test_shutdown_closes_connections(self, isolated_app):
+        """Тест: остановка приложения закрывает соединения его пулов."""
+        with TestClient(isolated_app) as client:
+            client.get("/notes/")
+        for shard in isolated_app.state.database.shards:
+            for engine in (shard.engine, shard.async_engine.sync_engine):
+                assert engine.pool.checkedin() == 0
+
+    def test_startup_timings(self, isolated_app):
+        """Тест: этапы запуска измеряются и попадают в /metrics."""
+        startup = isolated_app.state.startup
+        with TestClient(isolated_app) as client:
+            assert startup["schema_migrated"] is True
+            assert startup["ready_ms"] >= startup["import_ms"] > 0
+            body = client.get("/metrics").text
+            assert "notes_startup_ready_ms" in body and "notes_startup_schema_ms" in body
+        # Второй запуск на той же базе схему не трогает
+        with TestClient(isolated_app):
+            assert startup["schema_migrated"] is False
+
+
+class TestShardedStorage:
+    """Тесты для хранилища с заметками в нескольких файлах (NOTES_DB_SHARDS)."""
+
+    @pytest.fixture
+    def storage_path(self, tmp_path):
+        return tmp_path / "sharded.db"
+
+    @pytest.fixture
+    def sharded_client(self, storage_path):
+        from dataclasses import replace
+        from main import create_app
+
+        settings = replace(app.state.database.settings, database=str(storage_path), shards=2)
+        with TestClient(create_app(settings)) as client:
+            yield client
+
+    def test_notes_routed_by_id(self, sharded_client, storage_path):
+        """Тест: новые заметки распределяются по шардам, каждая лежит в шарде id % 2."""
+        from sqlalchemy import select
+        from models.models import NoteBase
+
+        ids = [sharded_client.post("/notes/", json={"headline": f"Шард {i}"}).json()["id"] for i in range(6)]
+        assert {id % 2 for id in ids} == {0, 1}
+        assert (storage_path.parent / "sharded.shard1.db").exists()
+        for shard in sharded_client.app.state.database.shards:
+            with shard.engine.connect() as conn:
+                stored = conn.scalars(select(NoteBase.id)).all()
+            assert stored and all(id % 2 == shard.index for id in stored)
+        for i, id in enumerate(ids):
+            assert sharded_client.get(f"/notes/{id}").json()["headline"] == f"Шард {i}"
+
+        assert sharded_client.put(f"/notes/{ids[1]}", json={"headline": "Изменена"}).status_code == 200
+        assert sharded_client.post(f"/notes/{ids[2]}/trash").status_code == 200
+        assert [n["id"] for n in sharded_client.get("/trash/").json()] == [ids[2]]
+        assert sharded_client.post(f"/trash/{ids[2]}/restore").status_code == 200
+        assert sharded_client.delete(f"/notes/{ids[3]}").status_code == 204
+        assert sharded_client.get(f"/notes/{ids[3]}").status_code == 404
+
+    def test_pages_merged(self, sharded_client):
+        """Тест: страницы из шардов сливаются в тот же порядок, что и в одной базе."""
+        ids = [sharded_client.post("/notes/", json={"headline": f"Заметка {i % 3}", "improtance": i % 3 + 1})
+               .json()["id"] for i in range(7)]
+        for params, expected in [
+            ({}, ids[::-1]),
+            ({"sort": "headline", "order": "asc"},
+             sorted(ids, key=lambda id: (f"Заметка {ids.index(id) % 3}", id))),
+        ]:
+            seen, cursor = [], None
+            while True:
+                response = sharded_client.get("/notes/", params={**params, "limit": 3,
+                                                                 **({"after": cursor} if cursor else {})})
+                seen.extend(note["id"] for note in response.json())
+                cursor = response.headers.get("X-Next-Cursor")
+                if cursor is None:
+                    break
+            assert seen == expected
+
+        results = sharded_client.get("/notes/search", params={"q": "Заметка", "limit": 4}).json()
+        assert len(results) == 4 and len({r["id"] for r in results}) == 4
+
+    def test_batch_and_export(self, sharded_client):
+        """Тест: пакет делится по шардам, результаты возвращаются в порядке операций."""
+        created = sharded_client.post("/notes/batch", json={"operations": [
+            {"op": "create", "note": {"headline": f"Пакет {i}"}} for i in range(4)
+        ]}).json()["results"]
+        ids = [result["result_id"] for result in created]
+        assert len(set(ids)) == 4 and {id % 2 for id in ids} == {0, 1}
+
+        results = sharded_client.post("/notes/batch", json={"operations": [
+            {"op": "update", "id": ids[0], "note": {"headline": "Изменён"}},
+            {"op": "trash", "id": ids[1]},
+            {"op": "delete", "id": 999999},
+        ]}).json()["results"]
+        assert [r["status"] for r in results] == [200, 200, 404]
+
+        # Заметки одного пакета могут получить одну и ту же дату создания: порядок
+        # при равенстве задаёт id, как и в списке /notes/
+        exported = sharded_client.get("/notes/export", params={"format": "json"}).json()
+        listed = sharded_client.get("/notes/").json()
+        assert [item["headline"] for item in exported] == [note["headline"] for note in listed]
+        assert sorted(item["headline"] for item in exported) == ["Изменён", "Пакет 2", "Пакет 3"]
+
+    def test_changes_cursor(self, sharded_client):
+        """Тест: курсор журнала изменений - номера изменений шардов через точку."""
+        first = sharded_client.get("/notes/changes", params={"since": 0}).json()
+        assert first["reset"] is True and first["seq"] == "0.0"
+        ids = [sharded_client.post("/notes/", json={"headline": f"Журнал {i}"}).json()["id"] for i in range(2)]
+
+        changes = sharded_client.get("/notes/changes", params={"since": first["seq"]}).json()
+        assert changes["reset"] is False
+        assert sorted(note["id"] for note in changes["notes"]) == sorted(ids)
+        sharded_client.post(f"/notes/{ids[0]}/trash")
+        later = sharded_client.get("/notes/changes", params={"since": changes["seq"]}).json()
+        assert later["deleted"] == [ids[0]] and later["notes"] == []
+        assert sharded_client.get("/notes/changes", params={"since": "1.x"}).status_code == 422
+
+    def test_rebalance(self, storage_path):
+        """Тест: база без шардов не открывается с NOTES_DB_SHARDS=2 до manage.py rebalance."""
+        import sql
+        from dataclasses import replace
+        from sqlalchemy import select, func
+        from models.models import NoteBase
+
+        single = sql.Database(replace(app.state.database.settings, database=str(storage_path)))
+        single.ensure_schemas()
+        with single.Session() as session:
+            sql.apply_notes_batch([("create", None, {"headline": f"Старая {i}", "improtance": 1,
+                                                     "created_date": datetime.now()}) for i in range(5)], session)
+            session.commit()
+
+        sharded = sql.Database(replace(single.settings, shards=2))
+        with pytest.raises(sql.SchemaError, match="rebalance"):
+            sharded.ensure_schemas()
+        assert sharded.rebalance(batch_size=2) == 3
+        sharded.ensure_schemas()
+        for shard in sharded.shards:
+            with shard.engine.connect() as conn:
+                stored = conn.scalars(select(NoteBase.id)).all()
+            assert all(id % 2 == shard.index for id in stored)
+
+        # Обратно к одному файлу
+        assert single.rebalance() == 3
+        single.ensure_schemas()
+        with single.Session() as session:
+            assert session.scalar(select(func.count()).select_from(NoteBase)) == 5
+
+
+class TestSearchAPI:
+    """Тесты для полнотекстового поиска."""
+
+    def test_search_finds_note(self, client):
+        """Тест: созданная заметка находится поиском."""
+        note_id = client.post("/notes/", json={
+            "headline": "Поиск",
+            "text": "уникальноеслово внутри текста"
+        }).json()["id"]
+
+        response = client.get("/notes/search", params={"q": "уникальноесл"})
+        assert response.status_code == 200
+        results = response.json()
+        assert note_id in [r["id"] for r in results]
+        assert "<mark>" in results[0]["snippet"]
+
+    def test_search_excludes_trashed(self, client):
+        """Тест: заметки в корзине не попадают в поиск."""
+        note_id = client.post("/notes/", json={
+            "headline": "Корзинапоиск",
+        }).json()["id"]
+        client.post(f"/notes/{note_id}/trash")
+
+        response = client.get("/notes/search", params={"q": "Корзинапоиск"})
+        assert note_id not in [r["id"] for r in response.json()]
+
+    def test_search_requires_query(self, client):
+        """Тест: пустой запрос - ошибка валидации."""
+        response = client.get("/notes/search", params={"q": ""})
+        assert response.status_code == 422
+
 
 class TestErrorHandling:
     """Тесты обработки ошибок."""
@@ -0,0 +1,37 @@
+"""Тесты для расчётов набора замеров benchmarks/bench_api.py."""
+
+import sys
+sys.path.insert(0, '..')
+
+from benchmarks.bench_api import compare, make_corpus, percentile, summarize
+
+
+class TestBenchmarkStats:
+    """Тесты для перцентилей и сравнения с базовым запуском."""
+
+    def test_percentiles(self):
+        """Тест: перцентили методом ближайшего ранга."""
+        values = [i / 1000 for i in range(1, 101)]
+        assert percentile(values, 50) == 0.05
+        assert percentile(values, 99) == 0.099
+        result = summarize(list(reversed(values)))
+        assert (result["p50_ms"], result["p95_ms"], result["count"]) == (50.0, 95.0, 100)
+        # Медианы серий: 75.0 и 25.0 мс; выброс в одной серии не сдвигает минимум
+        assert summarize(list(reversed(values)), rounds=2)["p50_min_ms"] == 25.0
+        assert summarize(values[:50] + [1.0] * 50, rounds=2)["p50_min_ms"] == 25.0
+
+    def test_compare_thresholds(self):
+        """Тест: регрессия - замедление больше порога и больше минимальной разницы."""
+        baseline = {"a": {"p50_ms": 10.0}, "b": {"p50_ms": 0.02}, "c": {"p50_ms": 5.0}}
+        results = {"a": {"p50_ms": 13.0}, "b": {"p50_ms": 0.05}, "c": {"p50_ms": 5.5}, "new": {"p50_ms": 1.0}}
+        assert compare(results, baseline, threshold=0.25, metric="p50_ms") == [("a", 10.0, 13.0, 1.3)]
+        assert compare(results, baseline, threshold=0.05, metric="p50_ms", min_delta_ms=0.01) == [
+            ("a", 10.0, 13.0, 1.3), ("b", 0.02, 0.05, 2.5), ("c", 5.0, 5.5, 1.1)
+        ]
+
+    def test_corpus_is_reproducible(self):
+        """Тест: корпус с тем же seed одинаков, длины текстов разные."""
+        first, second = make_corpus(50, seed=7), make_corpus(50, seed=7)
+        assert first == second
+        assert len({len(note["text"]) for note in first}) > 10
+        assert all(len(note["headline"]) <= 45 and len(note["text"]) <= 10000 for note in first)
@@ -0,0 +1,208 @@
+"""Тесты для кэша чтений ReadCache."""
+
+import asyncio
+import pytest
+from datetime import datetime
+import sys
+sys.path.insert(0, '..')
+
+from cache import ReadCache
+from models.models import NoteBase
+
+
+def loader(value, calls):
+    async def load():
+        calls.append(value)
+        await asyncio.sleep(0)
+        return value
+    return load
+
+
+class TestReadCache:
+    """Тесты для LRU, TTL и объединения промахов."""
+
+    @pytest.mark.asyncio
+    async def test_hit_after_miss(self):
+        """Тест: повторное чтение берется из кэша."""
+        cache, calls = ReadCache(), []
+
+        assert await cache.get_or_load(("notes", 1), loader("a", calls)) == "a"
+        assert await cache.get_or_load(("notes", 1), loader("b", calls)) == "a"
+        assert calls == ["a"]
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    @pytest.mark.asyncio
+    async def test_lru_eviction(self):
+        """Тест: при переполнении вытесняется давно не использованный ключ."""
+        cache, calls = ReadCache(maxsize=2), []
+        await cache.get_or_load(("notes", 1), loader(1, calls))
+        await cache.get_or_load(("notes", 2), loader(2, calls))
+        await cache.get_or_load(("notes", 1), loader(1, calls))
+        await cache.get_or_load(("notes", 3), loader(3, calls))
+
+        assert cache.stats()["evictions"] == 1
+        await cache.get_or_load(("notes", 1), loader(1, calls))
+        await cache.get_or_load(("notes", 2), loader(2, calls))
+        assert calls == [1, 2, 3, 2]
+
+    @pytest.mark.asyncio
+    async def test_ttl_expiry(self):
+        """Тест: устаревшая запись загружается заново."""
+        cache, calls = ReadCache(ttl=0), []
+        await cache.get_or_load(("notes",), loader(1, calls))
+        await cache.get_or_load(("notes",), loader(1, calls))
+        assert calls == [1, 1]
+
+    @pytest.mark.asyncio
+    async def test_concurrent_misses_coalesced(self):
+        """Тест: одновременные промахи по одному ключу выполняют один запрос."""
+        cache, calls = ReadCache(), []
+        results = await asyncio.gather(*[
+            cache.get_or_load(("notes", "page"), loader("page", calls)) for _ in range(10)
+        ])
+
+        assert results == ["page"] * 10
+        assert calls == ["page"]
+        assert cache.stats()["coalesced"] == 9
+
+    @pytest.mark.asyncio
+    async def test_leader_cancelled(self):
+        """Тест: отмена ведущего запроса не отменяет ожидающий, он загружает значение сам."""
+        cache, started, calls = ReadCache(), asyncio.Event(), []
+
+        async def slow():
+            calls.append("slow")
+            started.set()
+            await asyncio.sleep(10)
+
+        leader = asyncio.create_task(cache.get_or_load(("notes",), slow))
+        await started.wait()
+        waiter = asyncio.create_task(cache.get_or_load(("notes",), loader("page", calls)))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        assert await waiter == "page"
+        assert leader.cancelled()
+        assert calls == ["slow", "page"]
+
+    @pytest.mark.asyncio
+    async def test_waiter_cancelled(self):
+        """Тест: отмена ожидающего запроса не затрагивает ведущий."""
+        cache, started = ReadCache(), asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(0.01)
+            return "page"
+
+        leader = asyncio.create_task(cache.get_or_load(("notes",), slow))
+        await started.wait()
+        waiter = asyncio.create_task(cache.get_or_load(("notes",), slow))
+        await asyncio.sleep(0)
+        waiter.cancel()
+
+        assert await leader == "page"
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    @pytest.mark.asyncio
+    async def test_loader_error_not_cached(self):
+        """Тест: ошибка загрузки передается всем ожидающим и не кэшируется."""
+        cache = ReadCache()
+
+        async def failing():
+            await asyncio.sleep(0)
+            raise ValueError("Ошибка")
+
+        results = await asyncio.gather(
+            cache.get_or_load(("notes",), failing),
+            cache.get_or_load(("notes",), failing),
+            return_exceptions=True
+        )
+        assert all(isinstance(r, ValueError) for r in results)
+        assert len(cache) == 0
+
+    @pytest.mark.asyncio
+    async def test_none_not_cached(self):
+        """Тест: отсутствующая запись не кэшируется."""
+        cache, calls = ReadCache(), []
+        await cache.get_or_load(("note", 5), loader(None, calls))
+        await cache.get_or_load(("note", 5), loader(None, calls))
+        assert calls == [None, None]
+
+    @pytest.mark.asyncio
+    async def test_invalidate_namespace_and_keys(self):
+        """Тест: сброс пространства имен и отдельных ключей."""
+        cache, calls = ReadCache(), []
+        for key in [("notes", "page"), ("trash", "page"), ("note", 1), ("note", 2)]:
+            await cache.get_or_load(key, loader(key, calls))
+
+        cache.invalidate(["notes"], [("note", 1)])
+        assert len(cache) == 2
+        await cache.get_or_load(("trash", "page"), loader("x", calls))
+        await cache.get_or_load(("note", 2), loader("x", calls))
+        assert "x" not in calls
+
+    @pytest.mark.asyncio
+    async def test_invalidate_key_prefix(self):
+        """Тест: ключ сбрасывает и версионированные записи, начинающиеся с него."""
+        cache, calls = ReadCache(), []
+        for key in [("note", 1, 5), ("note", 1, 6), ("note", 10, 5)]:
+            await cache.get_or_load(key, loader(key, calls))
+
+        cache.invalidate(keys=[("note", 1)])
+        assert len(cache) == 1
+        await cache.get_or_load(("note", 10, 5), loader("x", calls))
+        assert "x" not in calls
+
+    @pytest.mark.asyncio
+    async def test_read_started_before_write_not_stored(self):
+        """Тест: результат чтения, пересекшегося с записью, не попадает в кэш."""
+        cache = ReadCache()
+
+        async def slow():
+            cache.invalidate(["notes"])
+            return "stale"
+
+        assert await cache.get_or_load(("notes",), slow) == "stale"
+        assert len(cache) == 0
+
+
+class TestCacheInvalidation:
+    """Тесты сброса кэша функциями записи из sql.py."""
+
+    @pytest.mark.asyncio
+    async def test_commit_invalidates_note(self, async_test_session):
+        """Тест: изменение заметки после коммита сбрасывает ее запись в кэше."""
+        from sql import create_note_async, change_note_async, get_note_by_id_async, get_all_notes_async
+
+        cache = ReadCache()
+        created = await create_note_async(
+            NoteBase(headline="Кэш", improtance=1, created_date=datetime.now()), async_test_session
+        )
+        assert (await get_note_by_id_async(created.id, async_test_session, cache=cache))["headline"] == "Кэш"
+        assert len(await get_all_notes_async(async_test_session, cache=cache)) == 1
+
+        await change_note_async(created.id, async_test_session, {"new_headline": "Новый"})
+        # До коммита кэш не сбрасывается
+        assert len(cache) == 2
+        await async_test_session.commit()
+
+        assert len(cache) == 0
+        assert (await get_note_by_id_async(created.id, async_test_session, cache=cache))["headline"] == "Новый"
+
+    @pytest.mark.asyncio
+    async def test_rollback_keeps_cache(self, async_test_session):
+        """Тест: откат транзакции не сбрасывает кэш."""
+        from sql import create_note_async, delete_note_async, get_note_by_id_async
+
+        cache = ReadCache()
+        created = await create_note_async(
+            NoteBase(headline="Откат", improtance=1, created_date=datetime.now()), async_test_session
+        )
+        await get_note_by_id_async(created.id, async_test_session, cache=cache)
+
+        await delete_note_async(created.id, async_test_session)
+        await async_test_session.rollback()
+        assert len(cache) == 1
@@ -1,14 +1,21 @@
 """Тесты для функций работы с базой данных."""
 
 import pytest
-from datetime import datetime
-from sqlalchemy import create_engine
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 import sys
 sys.path.insert(0, '..')
 
-from models.models import Base, NoteBase
-from sql import create_note, change_note, delete_note
+from models.models import Base, NoteBase, PREVIEW_LENGTH
+from sql import (
+    create_note, change_note, delete_note, get_notes_page, decode_cursor,
+    search_notes, build_fts_query, move_to_trash, explain_notes_page, NoteFilters,
+    apply_notes_batch, apply_trash_batch, get_version, NOTES, TRASH,
+    get_note_by_id, get_all_trashed, restore_from_trash, init_db,
+    purge_trash_batch, count_expired_trash, get_changes, compact_tombstones,
+    count_expired_tombstones, delete_from_trash, SUMMARY_COLUMNS, VersionConflict
+)
 
 
 @pytest.fixture
@@ -140,6 +147,50 @@ class TestChangeNote:
         updated = test_session.get(NoteBase, created.id)
         assert updated.change_date is not None
 
+    def test_dates_in_utc(self, test_session, local_timezone):
+        """Тест: даты изменения и удаления пишутся в UTC, как дата создания, и фильтры их находят."""
+        now = datetime.now(timezone.utc)
+        created = create_note(NoteBase(headline="UTC", improtance=1, created_date=now), test_session)
+        changed = change_note(created.id, test_session, {"new_headline": "Изменена"})
+        trashed = move_to_trash(created.id, test_session)
+        test_session.commit()
+        for value in (changed.change_date, trashed.deleted_date):
+            assert abs(value - created.created_date) < timedelta(minutes=1)
+
+        restore_from_trash(created.id, test_session)
+        test_session.commit()
+        moscow = timezone(timedelta(hours=3))
+        since = NoteFilters(changed_from=(now - timedelta(minutes=1)).astimezone(moscow))
+        assert [n.id for n in get_notes_page(test_session, filters=since)[0]] == [created.id]
+        later = NoteFilters(changed_from=(now + timedelta(minutes=1)).astimezone(moscow))
+        assert get_notes_page(test_session, filters=later)[0] == []
+
+    def test_version_increments(self, test_session):
+        """Тест: каждое изменение, перемещение в корзину и восстановление меняют версию."""
+        created = create_note(NoteBase(headline="Версия", improtance=1, created_date=datetime.now()), test_session)
+        assert created.version == 1
+
+        assert change_note(created.id, test_session, {"text": "Новый"}).version == 2
+        assert move_to_trash(created.id, test_session).version == 3
+        assert restore_from_trash(created.id, test_session).version == 4
+        apply_notes_batch([("update", created.id, {"improtance": 2})], test_session)
+        test_session.commit()
+        assert test_session.get(NoteBase, created.id).version == 5
+
+    def test_conditional_change(self, test_session):
+        """Тест: изменение с ожидаемой версией выполняется только для неё."""
+        created = create_note(NoteBase(headline="Условие", improtance=1, created_date=datetime.now()), test_session)
+
+        updated = change_note(created.id, test_session, {"new_headline": "Первый"}, expected_version=1)
+        assert (updated.headline, updated.version) == ("Первый", 2)
+        with pytest.raises(VersionConflict) as conflict:
+            change_note(created.id, test_session, {"new_headline": "Второй"}, expected_version=1)
+        assert conflict.value.version == 2
+        test_session.commit()
+
+        assert test_session.get(NoteBase, created.id).headline == "Первый"
+        assert change_note(999, test_session, {"new_headline": "Нет"}, expected_version=1) is None
+
     def test_change_nonexistent_note(self, test_session, capsys):
         """Тест изменения несуществующей заметки."""
         change_note(999, test_session, {"new_headline": "Тест"})
@@ -233,3 +284,726 @@ class TestNoteModel:
         # ID должны быть последовательными
         for i in range(len(ids) - 1):
             assert ids[i+1] > ids[i]
+
+
+class TestNotesPagination:
+    """Тесты для курсорной пагинации get_notes_page."""
+
+    def test_pages_cover_all_notes_once(self, test_session):
+        """Тест: страницы не пересекаются и покрывают все заметки."""
+        for i in range(7):
+            create_note(NoteBase(headline=f"Заметка {i}", improtance=1,
+                                 created_date=datetime(2026, 1, 1 + i)), test_session)
+
+        seen = []
+        page, cursor = get_notes_page(test_session, limit=3)
+        seen.extend(n.id for n in page)
+        while cursor:
+            page, cursor = get_notes_page(test_session, limit=3, after=cursor)
+            seen.extend(n.id for n in page)
+
+        assert len(seen) == 7
+        assert len(set(seen)) == 7
+
+    def test_pages_ordered_newest_first_with_id_tiebreak(self, test_session):
+        """Тест: порядок по дате создания, при равных датах - по id."""
+        same_date = datetime(2026, 1, 1)
+        ids = [create_note(NoteBase(headline=f"Заметка {i}", improtance=1,
+                                    created_date=same_date), test_session).id
+               for i in range(4)]
+
+        first, cursor = get_notes_page(test_session, limit=2)
+        second, last_cursor = get_notes_page(test_session, limit=2, after=cursor)
+
+        assert [n.id for n in first + second] == sorted(ids, reverse=True)
+        assert last_cursor is None
+
+    def test_no_limit_returns_everything(self, test_session):
+        """Тест: без limit возвращается весь список и нет курсора."""
+        for i in range(3):
+            create_note(NoteBase(headline=f"Заметка {i}", improtance=1,
+                                 created_date=datetime.now()), test_session)
+
+        notes, cursor = get_notes_page(test_session)
+        assert len(notes) == 3
+        assert cursor is None
+
+    def test_invalid_cursor(self, test_session):
+        """Тест: испорченный курсор вызывает ValueError."""
+        with pytest.raises(ValueError):
+            decode_cursor("не-курсор")
+        with pytest.raises(ValueError):
+            get_notes_page(test_session, limit=2, after="bm90LWpzb24")
+
+
+class TestNotePreview:
+    """Тесты для превью текста и выборки столбцов списка."""
+
+    def test_preview_maintained_on_write(self, test_session):
+        """Тест: превью вычисляется при создании и обновляется при изменении текста."""
+        note = create_note(NoteBase(headline="Превью", text="Первая  строка\nвторая", improtance=1,
+                                    created_date=datetime.now()), test_session)
+        assert note.preview == "Первая строка вторая"
+
+        change_note(note.id, test_session, {"text": "Новый текст " * 100})
+        assert note.preview == ("Новый текст " * 100)[:PREVIEW_LENGTH]
+        change_note(note.id, test_session, {"new_headline": "Только заголовок"})
+        assert note.preview.startswith("Новый текст")
+        change_note(note.id, test_session, {"text": ""})
+        assert note.preview is None
+
+    def test_batch_create_sets_preview(self, test_session):
+        """Тест: пакетное создание тоже заполняет превью."""
+        ids = apply_notes_batch([
+            ("create", None, {"headline": "Пакет", "text": "Текст пакета", "improtance": 1,
+                              "created_date": datetime.now()})
+        ], test_session)
+        assert get_note_by_id(ids[0], test_session).preview == "Текст пакета"
+
+    def test_summary_columns_skip_text(self, test_session):
+        """Тест: краткий вид возвращает словари без текста и с тем же курсором."""
+        for i in range(3):
+            create_note(NoteBase(headline=f"Заметка {i}", text="Текст " * 500, improtance=1,
+                                 created_date=datetime(2026, 1, 1 + i)), test_session)
+
+        page, cursor = get_notes_page(test_session, limit=2, columns=SUMMARY_COLUMNS)
+        assert set(page[0]) == set(SUMMARY_COLUMNS)
+        assert page[0]["headline"] == "Заметка 2"
+        assert page[0]["preview"] == ("Текст " * 500).strip()[:PREVIEW_LENGTH]
+        rest, _ = get_notes_page(test_session, limit=2, after=cursor, columns=SUMMARY_COLUMNS)
+        assert [n["headline"] for n in rest] == ["Заметка 0"]
+
+    def test_unknown_column_rejected(self, test_session):
+        """Тест: неизвестное поле отклоняется."""
+        with pytest.raises(ValueError, match="Неизвестные поля"):
+            get_notes_page(test_session, columns=("id", "deleted_date"))
+
+    def test_migration_moves_text_last(self, tmp_path):
+        """Тест: миграция переносит text в конец записи и заполняет превью."""
+        import sqlite3
+        path = str(tmp_path / "old.db")
+        connection = sqlite3.connect(path)
+        connection.execute(
+            "CREATE TABLE notes (id INTEGER PRIMARY KEY, headline VARCHAR(45), text VARCHAR(10000), "
+            "improtance INTEGER, created_date DATETIME, change_date DATETIME)"
+        )
+        connection.execute("INSERT INTO notes VALUES (7, 'Старая', 'Текст  старой', 1, '2024-01-01 00:00:00', NULL)")
+        connection.commit()
+        connection.close()
+
+        engine = create_engine(f"sqlite:///{path}")
+        init_db(engine)
+        init_db(engine)
+        session = sessionmaker(bind=engine)()
+        columns = [row[1] for row in session.execute(text("PRAGMA table_info(notes)"))]
+        assert columns[-1] == "text"
+        note = get_note_by_id(7, session)
+        assert note.preview == "Текст старой"
+        assert note.version == 1
+        assert [r["id"] for r in search_notes(session, "старой")] == [7]
+        session.close()
+
+
+class TestNotesSorting:
+    """Тесты для сортировки и фильтрации списка заметок."""
+
+    @pytest.fixture
+    def notes(self, test_session):
+        data = [
+            ("Бета", 2, datetime(2026, 1, 1), datetime(2026, 3, 1)),
+            ("Альфа", 3, datetime(2026, 1, 2), None),
+            ("Гамма", 1, datetime(2026, 1, 3), datetime(2026, 1, 4)),
+            ("Дельта", 3, datetime(2026, 1, 4), None),
+        ]
+        return [create_note(NoteBase(headline=h, improtance=imp, created_date=c, change_date=ch),
+                            test_session) for h, imp, c, ch in data]
+
+    def _collect(self, session, **kwargs):
+        result = []
+        page, cursor = get_notes_page(session, limit=1, **kwargs)
+        result.extend(page)
+        while cursor:
+            page, cursor = get_notes_page(session, limit=1, after=cursor, **kwargs)
+            result.extend(page)
+        return [n.headline for n in result]
+
+    def test_sort_by_headline(self, test_session, notes):
+        """Тест: сортировка по алфавиту в обе стороны."""
+        assert self._collect(test_session, sort="headline", order="asc") == ["Альфа", "Бета", "Гамма", "Дельта"]
+        assert self._collect(test_session, sort="headline", order="desc") == ["Дельта", "Гамма", "Бета", "Альфа"]
+
+    def test_sort_by_changed_falls_back_to_created(self, test_session, notes):
+        """Тест: сортировка по дате изменения учитывает дату создания."""
+        assert self._collect(test_session, sort="changed") == ["Бета", "Дельта", "Гамма", "Альфа"]
+
+    def test_sort_by_importance(self, test_session, notes):
+        """Тест: сортировка по важности с разрешением равенства по id."""
+        assert self._collect(test_session, sort="importance") == ["Дельта", "Альфа", "Бета", "Гамма"]
+
+    def test_filters(self, test_session, notes):
+        """Тест: фильтры по важности и диапазонам дат."""
+        only_urgent = NoteFilters(importance=[3])
+        assert self._collect(test_session, filters=only_urgent) == ["Дельта", "Альфа"]
+
+        created_range = NoteFilters(created_from=datetime(2026, 1, 2), created_to=datetime(2026, 1, 4))
+        assert self._collect(test_session, filters=created_range) == ["Гамма", "Альфа"]
+
+        changed_since = NoteFilters(changed_from=datetime(2026, 1, 4))
+        assert self._collect(test_session, filters=changed_since) == ["Дельта", "Гамма", "Бета"]
+
+    def test_cursor_bound_to_sort(self, test_session, notes):
+        """Тест: курсор одной сортировки нельзя использовать с другой."""
+        _, cursor = get_notes_page(test_session, limit=1, sort="headline", order="asc")
+        with pytest.raises(ValueError):
+            get_notes_page(test_session, limit=1, after=cursor, sort="created")
+
+    def test_explain_uses_index(self, test_session, notes):
+        """Тест: план запроса использует индекс сортировки."""
+        plan = " ".join(explain_notes_page(test_session, limit=10, sort="headline"))
+        assert "ix_notes_headline_id" in plan
+
+
+class TestSearchNotes:
+    """Тесты для полнотекстового поиска search_notes."""
+
+    def _create(self, session, headline, text=None):
+        note = NoteBase(headline=headline, text=text, improtance=1, created_date=datetime.now())
+        return create_note(note, session)
+
+    def test_search_by_text_and_headline(self, test_session):
+        """Тест: поиск находит совпадения в заголовке и тексте."""
+        by_headline = self._create(test_session, "Список покупок", "молоко")
+        by_text = self._create(test_session, "Дела", "купить покупки на неделю")
+        self._create(test_session, "Другое", "ничего общего")
+
+        results = search_notes(test_session, "покуп")
+        ids = [r["id"] for r in results]
+
+        assert set(ids) == {by_headline.id, by_text.id}
+        # совпадение в заголовке весит больше
+        assert ids[0] == by_headline.id
+
+    def test_search_highlights_matches(self, test_session):
+        """Тест: совпадения подсвечиваются в сниппете."""
+        self._create(test_session, "Заголовок", "встреча с командой в пятницу")
+
+        result = search_notes(test_session, "команд")[0]
+        assert "<mark>командой</mark>" in result["snippet"]
+
+    def test_search_follows_updates_and_trash(self, test_session):
+        """Тест: индекс синхронизируется при изменении и удалении в корзину."""
+        note = self._create(test_session, "Черновик", "старое слово")
+
+        change_note(note.id, test_session, {"text": "новое слово"})
+        test_session.commit()
+        assert search_notes(test_session, "старое") == []
+        assert len(search_notes(test_session, "новое")) == 1
+
+        move_to_trash(note.id, test_session)
+        test_session.commit()
+        assert search_notes(test_session, "новое") == []
+
+    def test_search_pagination(self, test_session):
+        """Тест: limit и offset."""
+        for i in range(5):
+            self._create(test_session, f"Отчёт {i}")
+
+        first = search_notes(test_session, "отчёт", limit=3)
+        second = search_notes(test_session, "отчёт", limit=3, offset=3)
+
+        assert len(first) == 3
+        assert len(second) == 2
+        assert not {r["id"] for r in first} & {r["id"] for r in second}
+
+    def test_build_fts_query_escapes_syntax(self):
+        """Тест: спецсимволы FTS5 не попадают в запрос."""
+        assert build_fts_query('foo" OR bar*') == '"foo"* "OR"* "bar"*'
+        assert build_fts_query("   ***  ") is None
+
+
+class TestBatchOperations:
+    """Тесты для пакетных операций apply_notes_batch и apply_trash_batch."""
+
+    def _new(self, headline):
+        return {"headline": headline, "text": None, "improtance": 1, "created_date": datetime.now()}
+
+    def test_batch_create_keeps_order(self, test_session):
+        """Тест: id созданных заметок соответствуют порядку операций."""
+        ids = apply_notes_batch([("create", None, self._new(f"Пакет {i}")) for i in range(5)], test_session)
+        test_session.commit()
+
+        assert [test_session.get(NoteBase, id).headline for id in ids] == [f"Пакет {i}" for i in range(5)]
+
+    def test_batch_mixed_operations(self, test_session):
+        """Тест: обновление, удаление в корзину и удаление в одном пакете."""
+        ids = apply_notes_batch([("create", None, self._new(f"Заметка {i}")) for i in range(3)], test_session)
+
+        results = apply_notes_batch([
+            ("update", ids[0], {"new_headline": "Обновлена"}),
+            ("trash", ids[1], None),
+            ("delete", ids[2], None),
+            ("delete", 999, None),
+        ], test_session)
+        test_session.commit()
+
+        assert results[0] == ids[0]
+        assert test_session.get(NoteBase, ids[0]).headline == "Обновлена"
+        assert results[1] == ids[1]
+        assert test_session.get(NoteBase, ids[1]).deleted_date is not None
+        assert get_note_by_id(ids[1], test_session) is None
+        assert results[2] == ids[2]
+        assert test_session.get(NoteBase, ids[2]) is None
+        assert results[3] is None
+
+    def test_batch_duplicate_ids(self, test_session):
+        """Тест: повторная операция над тем же id не выполняется дважды."""
+        ids = apply_notes_batch([("create", None, self._new("Дубль"))], test_session)
+
+        results = apply_notes_batch([("trash", ids[0], None), ("trash", ids[0], None)], test_session)
+        test_session.commit()
+
+        assert results[0] is not None
+        assert results[1] is None
+        assert len(get_all_trashed(test_session)) == 1
+
+    def test_trash_batch_restore_and_delete(self, test_session):
+        """Тест: восстановление и окончательное удаление пакетом."""
+        ids = apply_notes_batch([("create", None, self._new(f"Корзина {i}")) for i in range(2)], test_session)
+        trash_ids = apply_notes_batch([("trash", id, None) for id in ids], test_session)
+
+        results = apply_trash_batch([
+            ("restore", trash_ids[0], None),
+            ("delete", trash_ids[1], None),
+        ], test_session)
+        test_session.commit()
+
+        assert results[0] == ids[0]
+        assert get_note_by_id(ids[0], test_session).headline == "Корзина 0"
+        assert results[1] == trash_ids[1]
+        assert test_session.get(NoteBase, ids[1]) is None
+        assert get_all_trashed(test_session) == []
+
+
+class TestSoftDeleteTrash:
+    """Тесты для корзины как состояния заметки (deleted_date)."""
+
+    def _new(self, headline):
+        return NoteBase(headline=headline, improtance=1, created_date=datetime.now())
+
+    def test_trash_keeps_id(self, test_session):
+        """Тест: заметка остается в notes под тем же id."""
+        note = create_note(self._new("В корзину"), test_session)
+
+        trashed = move_to_trash(note.id, test_session)
+        test_session.commit()
+
+        assert trashed.id == note.id
+        assert trashed.deleted_date is not None
+        assert get_note_by_id(note.id, test_session) is None
+        assert [n.id for n in get_all_trashed(test_session)] == [note.id]
+        assert note.id not in [n.id for n in get_notes_page(test_session)[0]]
+
+    def test_restore_keeps_id(self, test_session):
+        """Тест: восстановленная заметка сохраняет id."""
+        note = create_note(self._new("Вернуть"), test_session)
+        move_to_trash(note.id, test_session)
+
+        restored = restore_from_trash(note.id, test_session)
+        test_session.commit()
+
+        assert restored.id == note.id
+        assert restored.deleted_date is None
+        assert restored.change_date is not None
+        assert get_note_by_id(note.id, test_session).headline == "Вернуть"
+
+    def test_trashed_note_not_editable(self, test_session):
+        """Тест: заметку в корзине нельзя изменить или удалить как обычную."""
+        note = create_note(self._new("Только корзина"), test_session)
+        move_to_trash(note.id, test_session)
+
+        assert change_note(note.id, test_session, {"text": "x"}) is None
+        assert delete_note(note.id, test_session) is False
+        assert move_to_trash(note.id, test_session) is None
+        assert restore_from_trash(999, test_session) is None
+
+    def test_trash_page_uses_partial_index(self, test_session):
+        """Тест: выборка корзины использует частичный индекс."""
+        from sqlalchemy import text
+
+        plan = test_session.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id FROM notes WHERE deleted_date IS NOT NULL "
+            "ORDER BY deleted_date DESC, id DESC"
+        )).all()
+        assert "ix_notes_deleted_date_id" in " ".join(row.detail for row in plan)
+
+    def test_migration_folds_trashed_notes(self, tmp_path):
+        """Тест: миграция переносит старую таблицу корзины в notes."""
+        from sqlalchemy import text
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE notes (id INTEGER PRIMARY KEY, headline VARCHAR(45), text VARCHAR(10000), "
+                "improtance INTEGER, created_date DATETIME, change_date DATETIME)"
+            ))
+            conn.execute(text("CREATE INDEX ix_notes_created_date_id ON notes (created_date, id)"))
+            conn.execute(text(
+                "CREATE TABLE trashed_notes (id INTEGER PRIMARY KEY, original_id INTEGER, "
+                "headline VARCHAR(45), text VARCHAR(10000), improtance INTEGER, created_date DATETIME, "
+                "change_date DATETIME, deleted_date DATETIME)"
+            ))
+            conn.execute(text(
+                "INSERT INTO notes VALUES (1, 'Живая', NULL, 1, '2024-01-01 00:00:00', NULL)"
+            ))
+            conn.execute(text(
+                "INSERT INTO trashed_notes VALUES "
+                "(1, 5, 'Свободный id', NULL, 2, '2024-01-02 00:00:00', NULL, '2024-02-01 00:00:00'), "
+                "(2, 1, 'Занятый id', 'текст', 3, '2024-01-03 00:00:00', NULL, '2024-02-02 00:00:00')"
+            ))
+
+        init_db(engine)
+        init_db(engine)
+
+        session = sessionmaker(bind=engine)()
+        trashed = {n.headline: n for n in get_all_trashed(session)}
+        assert set(trashed) == {"Свободный id", "Занятый id"}
+        assert trashed["Свободный id"].id == 5
+        assert trashed["Занятый id"].id not in (1, 5)
+        assert [n.headline for n in get_notes_page(session)[0]] == ["Живая"]
+        assert search_notes(session, "текст") == []
+
+        index_sql = session.execute(text(
+            "SELECT sql FROM sqlite_master WHERE name = 'ix_notes_created_date_id'"
+        )).scalar()
+        assert "WHERE" in index_sql
+        assert session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'trashed_notes'"
+        )).first() is None
+        session.close()
+        engine.dispose()
+
+
+class TestTrashRetention:
+    """Тесты для очистки старых заметок из корзины."""
+
+    def _trashed(self, session, headline, deleted_date):
+        note = create_note(NoteBase(headline=headline, improtance=1, created_date=datetime.now()), session)
+        move_to_trash(note.id, session)
+        note.deleted_date = deleted_date
+        session.commit()
+        return note.id
+
+    def test_purge_removes_only_expired(self, test_session):
+        """Тест: удаляются только заметки корзины старше границы."""
+        old = [self._trashed(test_session, f"Старая {i}", datetime(2020, 1, i + 1)) for i in range(5)]
+        fresh = self._trashed(test_session, "Свежая", datetime(2030, 1, 1))
+        live = create_note(NoteBase(headline="Живая", improtance=1, created_date=datetime(2019, 1, 1)), test_session)
+        cutoff = datetime(2025, 1, 1)
+
+        assert count_expired_trash(test_session, cutoff) == 5
+        assert purge_trash_batch(test_session, cutoff, 2) == 2
+        # Первыми удаляются самые старые
+        assert test_session.get(NoteBase, old[0]) is None
+        assert test_session.get(NoteBase, old[2]) is not None
+
+        assert purge_trash_batch(test_session, cutoff, 2) == 2
+        assert purge_trash_batch(test_session, cutoff, 2) == 1
+        assert purge_trash_batch(test_session, cutoff, 2) == 0
+        test_session.commit()
+
+        assert [n.id for n in get_all_trashed(test_session)] == [fresh]
+        assert get_note_by_id(live.id, test_session) is not None
+
+    def test_purge_bumps_trash_version(self, test_session):
+        """Тест: очистка меняет версию корзины только если что-то удалено."""
+        self._trashed(test_session, "Старая", datetime(2020, 1, 1))
+        version = get_version(test_session, TRASH)
+
+        purge_trash_batch(test_session, datetime(2000, 1, 1), 10)
+        assert get_version(test_session, TRASH) == version
+        purge_trash_batch(test_session, datetime(2025, 1, 1), 10)
+        assert get_version(test_session, TRASH) == version + 1
+
+
+class TestCollectionVersions:
+    """Тесты для версий коллекций, на которых построены ETag."""
+
+    def _new(self, headline):
+        return NoteBase(headline=headline, improtance=1, created_date=datetime.now())
+
+    def test_version_starts_at_zero(self, test_session):
+        """Тест: без записей версия равна нулю."""
+        assert get_version(test_session, NOTES) == 0
+        assert get_version(test_session, TRASH) == 0
+
+    def test_writes_bump_versions(self, test_session):
+        """Тест: каждая запись увеличивает версию своих коллекций."""
+        note = create_note(self._new("Версия"), test_session)
+        assert get_version(test_session, NOTES) == 1
+
+        change_note(note.id, test_session, {"text": "Новый текст"})
+        test_session.commit()
+        assert get_version(test_session, NOTES) == 2
+
+        move_to_trash(note.id, test_session)
+        assert get_version(test_session, NOTES) == 3
+        assert get_version(test_session, TRASH) == 1
+
+    def test_transaction_bumps_once(self, test_session):
+        """Тест: несколько записей в одной транзакции увеличивают версию один раз."""
+        note = create_note(self._new("Транзакция"), test_session)
+        change_note(note.id, test_session, {"text": "Первый"})
+        change_note(note.id, test_session, {"text": "Второй"})
+        move_to_trash(note.id, test_session)
+        test_session.commit()
+        assert get_version(test_session, NOTES) == 2
+        assert get_version(test_session, TRASH) == 1
+
+    def test_missing_note_keeps_version(self, test_session):
+        """Тест: операция над несуществующей заметкой не меняет версию."""
+        delete_note(999, test_session)
+        apply_notes_batch([("update", 999, {"text": "x"})], test_session)
+        assert get_version(test_session, NOTES) == 0
+
+    def test_batch_bumps_once(self, test_session):
+        """Тест: пакет увеличивает версию один раз."""
+        apply_notes_batch([
+            ("create", None, {"headline": f"Пакет {i}", "text": None, "improtance": 1, "created_date": datetime.now()})
+            for i in range(5)
+        ], test_session)
+        assert get_version(test_session, NOTES) == 1
+        assert get_version(test_session, TRASH) == 0
+
+
+class TestChangeLog:
+    """Тесты для журнала изменений, по которому синхронизируются клиенты."""
+
+    def _create(self, session, headline):
+        note = create_note(NoteBase(headline=headline, improtance=1, created_date=datetime.now()), session)
+        session.commit()
+        return note.id
+
+    def test_since_zero_requires_reset(self, test_session):
+        """Тест: клиент без состояния получает только текущий номер."""
+        self._create(test_session, "Первая")
+        changes = get_changes(test_session, 0)
+        assert changes["reset"] is True
+        assert changes["seq"] == 1
+        assert changes["notes"] == []
+
+    def test_one_seq_per_transaction(self, test_session):
+        """Тест: все изменения одной транзакции получают один номер."""
+        apply_notes_batch([
+            ("create", None, {"headline": f"Пакет {i}", "text": None, "improtance": 1, "created_date": datetime.now()})
+            for i in range(3)
+        ], test_session)
+        test_session.commit()
+        self._create(test_session, "Отдельная")
+
+        changes = get_changes(test_session, 1)
+        assert changes["seq"] == 2
+        assert [note.headline for note in changes["notes"]] == ["Отдельная"]
+
+    def test_returns_only_changed_notes(self, test_session):
+        """Тест: возвращаются только заметки, измененные после since."""
+        first = self._create(test_session, "Первая")
+        second = self._create(test_session, "Вторая")
+        since = get_changes(test_session, 0)["seq"]
+
+        change_note(first, test_session, {"new_headline": "Изменена"})
+        test_session.commit()
+
+        changes = get_changes(test_session, since)
+        assert changes["reset"] is False
+        assert [note.id for note in changes["notes"]] == [first]
+        assert changes["deleted"] == []
+        assert get_changes(test_session, changes["seq"])["notes"] == []
+        assert second not in [note.id for note in changes["notes"]]
+
+    def test_trash_and_delete_reported(self, test_session):
+        """Тест: перемещение в корзину и удаление попадают в deleted."""
+        trashed = self._create(test_session, "В корзину")
+        removed = self._create(test_session, "Удалить")
+        since = get_changes(test_session, 0)["seq"]
+
+        move_to_trash(trashed, test_session)
+        delete_note(removed, test_session)
+        test_session.commit()
+
+        changes = get_changes(test_session, since)
+        assert changes["notes"] == []
+        assert sorted(changes["deleted"]) == sorted([trashed, removed])
+
+        delete_from_trash(trashed, test_session)
+        test_session.commit()
+        assert get_changes(test_session, changes["seq"])["deleted"] == [trashed]
+
+    def test_restored_note_reappears(self, test_session):
+        """Тест: восстановленная заметка снова приходит как измененная."""
+        note_id = self._create(test_session, "Восстановить")
+        move_to_trash(note_id, test_session)
+        test_session.commit()
+        since = get_changes(test_session, 0)["seq"]
+
+        restore_from_trash(note_id, test_session)
+        test_session.commit()
+        changes = get_changes(test_session, since)
+        assert [note.id for note in changes["notes"]] == [note_id]
+        assert changes["deleted"] == []
+
+    def test_compaction_forces_reset(self, test_session):
+        """Тест: клиент старше сжатых отметок об удалении загружает список заново."""
+        note_id = self._create(test_session, "Старая")
+        since = get_changes(test_session, 0)["seq"]
+        delete_note(note_id, test_session)
+        test_session.commit()
+        self._create(test_session, "Новая")
+        seq = get_changes(test_session, 0)["seq"]
+
+        assert count_expired_tombstones(test_session, datetime(2000, 1, 1)) == 0
+        assert compact_tombstones(test_session, datetime(2000, 1, 1)) == 0
+        assert count_expired_tombstones(test_session, datetime(2100, 1, 1)) == 1
+        assert compact_tombstones(test_session, datetime(2100, 1, 1)) == 1
+        test_session.commit()
+
+        assert get_changes(test_session, since)["reset"] is True
+        # Клиент, видевший удаление, продолжает синхронизироваться
+        assert get_changes(test_session, seq)["reset"] is False
+
+    def test_future_since_requires_reset(self, test_session):
+        """Тест: номер больше текущего (другая база) требует полной загрузки."""
+        self._create(test_session, "Заметка")
+        assert get_changes(test_session, 100)["reset"] is True
+
+
+class TestSchema:
+    """Тесты для проверки и миграции схемы при запуске."""
+
+    def _settings(self, path, **changes):
+        from dataclasses import replace
+        from settings import StorageSettings
+        return replace(StorageSettings(database=str(path)), **changes)
+
+    def test_creates_once(self, tmp_path):
+        """Тест: новая база получает схему и версию, повторный запуск ничего не делает."""
+        from sql import ensure_schema, get_schema_version, SCHEMA_VERSION
+        path = tmp_path / "nested" / "new.db"
+        engine = create_engine(f"sqlite:///{path}")
+        assert ensure_schema(engine, self._settings(path)) is True
+        assert get_schema_version(engine) == SCHEMA_VERSION
+        assert ensure_schema(engine, self._settings(path)) is False
+        session = sessionmaker(bind=engine)()
+        create_note(NoteBase(headline="Новая", text="после миграции", improtance=1,
+                                    created_date=datetime.now()), session)
+        session.commit()
+        assert [r["headline"] for r in search_notes(session, "миграции")] == ["Новая"]
+        session.close()
+        engine.dispose()
+
+    def test_check_mode(self, tmp_path):
+        """Тест: в режиме check устаревшая схема останавливает запуск, а не мигрируется."""
+        from sql import ensure_schema, get_schema_version, SchemaError
+        path = tmp_path / "old.db"
+        engine = create_engine(f"sqlite:///{path}")
+        with pytest.raises(SchemaError, match="manage.py migrate"):
+            ensure_schema(engine, self._settings(path, schema="check"))
+        assert get_schema_version(engine) == 0
+        ensure_schema(engine, self._settings(path))
+        assert ensure_schema(engine, self._settings(path, schema="check")) is False
+        engine.dispose()
+
+    def test_local_dates_migrated(self, tmp_path, local_timezone):
+        """Тест: даты, записанные до версии 2 в местном времени, переводятся в UTC."""
+        from sql import ensure_schema, get_schema_version, SCHEMA_VERSION
+        path = tmp_path / "local.db"
+        engine = create_engine(f"sqlite:///{path}")
+        ensure_schema(engine, self._settings(path))
+        with engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO notes (id, headline, improtance, created_date, change_date, deleted_date) "
+                "VALUES (1, 'Старая', 1, '2024-07-01 16:00:00.000000', "
+                "'2024-07-01 12:00:00.000000', '2024-01-15 12:30:00.250000')"
+            ))
+            conn.execute(text("PRAGMA user_version = 1"))
+
+        assert ensure_schema(engine, self._settings(path)) is True
+        assert get_schema_version(engine) == SCHEMA_VERSION
+        session = sessionmaker(bind=engine)()
+        note = session.get(NoteBase, 1)
+        # Летом Нью-Йорк отстаёт от UTC на 4 часа, зимой - на 5
+        assert note.change_date == datetime(2024, 7, 1, 16, 0)
+        assert note.deleted_date == datetime(2024, 1, 15, 17, 30, 0, 250000)
+        assert note.created_date == datetime(2024, 7, 1, 16, 0)
+        session.close()
+        engine.dispose()
+
+    def test_newer_schema_rejected(self, tmp_path):
+        """Тест: база от более новой версии приложения не открывается."""
+        from sql import ensure_schema, SchemaError, SCHEMA_VERSION
+        path = tmp_path / "future.db"
+        engine = create_engine(f"sqlite:///{path}")
+        with engine.begin() as conn:
+            conn.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION + 1}"))
+        with pytest.raises(SchemaError, match="новее"):
+            ensure_schema(engine, self._settings(path))
+        engine.dispose()
+
+
+class TestAsyncFunctions:
+    """Тесты для асинхронных версий функций работы с базой данных."""
+
+    @pytest.mark.asyncio
+    async def test_create_note_async(self, async_test_session):
+        """Тест асинхронного создания заметки."""
+        from sql import create_note_async, get_note_by_id_async
+
+        note = NoteBase(headline="Асинхронная", improtance=2, created_date=datetime.now())
+        created = await create_note_async(note, async_test_session)
+
+        assert created.id is not None
+        found = await get_note_by_id_async(created.id, async_test_session)
+        assert found.headline == "Асинхронная"
+
+    @pytest.mark.asyncio
+    async def test_change_note_async(self, async_test_session):
+        """Тест асинхронного изменения заметки."""
+        from sql import create_note_async, change_note_async
+
+        note = NoteBase(headline="Старый", improtance=1, created_date=datetime.now())
+        created = await create_note_async(note, async_test_session)
+
+        changed = await change_note_async(created.id, async_test_session, {"new_headline": "Новый"})
+        await async_test_session.commit()
+
+        assert changed.headline == "Новый"
+        assert changed.change_date is not None
+
+    @pytest.mark.asyncio
+    async def test_trash_and_restore_async(self, async_test_session):
+        """Тест асинхронного перемещения в корзину и восстановления."""
+        from sql import (
+            create_note_async, move_to_trash_async, get_all_trashed_async,
+            restore_from_trash_async, get_all_notes_async
+        )
+
+        note = NoteBase(headline="В корзину", improtance=1, created_date=datetime.now())
+        created = await create_note_async(note, async_test_session)
+
+        trashed = await move_to_trash_async(created.id, async_test_session)
+        await async_test_session.commit()
+        assert trashed.id == created.id
+        assert len(await get_all_trashed_async(async_test_session)) == 1
+        assert await get_all_notes_async(async_test_session) == []
+
+        restored = await restore_from_trash_async(trashed.id, async_test_session)
+        await async_test_session.commit()
+        assert restored.headline == "В корзину"
+        assert await get_all_trashed_async(async_test_session) == []
+
+    @pytest.mark.asyncio
+    async def test_delete_nonexistent_async(self, async_test_session):
+        """Тест асинхронного удаления несуществующей заметки."""
+        from sql import delete_note_async, delete_from_trash_async
+
+        assert await delete_note_async(999, async_test_session) is False
+        assert await delete_from_trash_async(999, async_test_session) is False
@@ -0,0 +1,143 @@
+"""Тесты для буфера отложенной записи черновиков."""
+
+import asyncio
+import pytest
+import pytest_asyncio
+import sys
+sys.path.insert(0, '..')
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from drafts import DraftBuffer
+from models.models import Base, NoteDraft
+from settings import DraftSettings
+
+
+@pytest_asyncio.fixture
+async def session_factory():
+    """Фабрика сессий поверх общей базы в памяти."""
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield async_sessionmaker(bind=engine, expire_on_commit=False)
+    await engine.dispose()
+
+
+async def stored(session_factory) -> dict:
+    async with session_factory() as session:
+        return {draft.key: draft.text for draft in (await session.scalars(select(NoteDraft))).all()}
+
+
+def keystrokes(buffer, key, text):
+    for end in range(1, len(text) + 1):
+        buffer.put(key, {"headline": "Черновик", "text": text[:end], "improtance": 1})
+
+
+class TestDraftBuffer:
+    """Тесты для слияния сохранений и записи пачками."""
+
+    @pytest.mark.asyncio
+    async def test_coalesces_keystrokes(self, session_factory):
+        """Тест: сотни сохранений двух черновиков записываются одной транзакцией."""
+        buffer = DraftBuffer(session_factory, DraftSettings())
+        keystrokes(buffer, "1", "Автосохранение на каждое нажатие клавиши" * 5)
+        keystrokes(buffer, "new-1", "Новая заметка")
+        assert await stored(session_factory) == {}
+        assert buffer.dirty == 2
+
+        assert await buffer.flush() == 2
+        assert buffer.commits == 1
+        assert await stored(session_factory) == {
+            "1": "Автосохранение на каждое нажатие клавиши" * 5, "new-1": "Новая заметка"
+        }
+        assert buffer.stats()["coalesced"] == buffer.puts - 2
+        assert await buffer.flush() == 0
+        assert buffer.commits == 1
+
+    @pytest.mark.asyncio
+    async def test_read_your_writes(self, session_factory):
+        """Тест: незаписанный черновик сразу виден в чтении и списке."""
+        buffer = DraftBuffer(session_factory, DraftSettings())
+        buffer.put("1", {"text": "старый"})
+        await buffer.flush()
+        buffer.put("1", {"text": "новый"})
+        buffer.put("2", {"text": "второй"})
+
+        assert (await buffer.get("1"))["text"] == "новый"
+        assert [draft["key"] for draft in await buffer.list()] == ["2", "1"]
+        assert await stored(session_factory) == {"1": "старый"}
+
+    @pytest.mark.asyncio
+    async def test_save_during_flush_stays_dirty(self, session_factory):
+        """Тест: сохранение во время записи не теряется и уходит следующей пачкой."""
+        buffer = DraftBuffer(session_factory, DraftSettings())
+        buffer.put("1", {"text": "до записи"})
+        flushing = asyncio.ensure_future(buffer.flush())
+        await asyncio.sleep(0)
+        buffer.put("1", {"text": "во время записи"})
+        await flushing
+
+        assert buffer.dirty == 1
+        await buffer.flush()
+        assert await stored(session_factory) == {"1": "во время записи"}
+
+    @pytest.mark.asyncio
+    async def test_delete(self, session_factory):
+        """Тест: удаление записывается в базу и скрывает черновик до записи."""
+        buffer = DraftBuffer(session_factory, DraftSettings())
+        buffer.put("1", {"text": "удалить"})
+        buffer.put("2", {"text": "оставить"})
+        await buffer.flush()
+
+        buffer.delete("1")
+        assert await buffer.get("1") is None
+        assert [draft["key"] for draft in await buffer.list()] == ["2"]
+        await buffer.flush()
+        assert await stored(session_factory) == {"2": "оставить"}
+        assert buffer.stats()["entries"] == 1
+
+    @pytest.mark.asyncio
+    async def test_evicts_only_clean(self, session_factory):
+        """Тест: сверх лимита вытесняются записанные черновики, а не изменённые."""
+        buffer = DraftBuffer(session_factory, DraftSettings(max_entries=3, max_dirty=3))
+        for key in "abc":
+            buffer.put(key, {"text": key})
+        await buffer.flush()
+        for key in "de":
+            buffer.put(key, {"text": key})
+
+        assert buffer.stats()["entries"] == 3
+        assert buffer.evicted == 2
+        await buffer.flush()
+        assert len(await stored(session_factory)) == 5
+        # Вытесненный черновик читается из базы
+        assert (await buffer.get("a"))["text"] == "a"
+
+    @pytest.mark.asyncio
+    async def test_loop_flushes_early_when_many_dirty(self, session_factory):
+        """Тест: фоновая запись начинается раньше интервала при max_dirty изменённых."""
+        buffer = DraftBuffer(session_factory, DraftSettings(flush_interval=60, max_dirty=3))
+        loop = asyncio.ensure_future(buffer.run_loop())
+        await asyncio.sleep(0)
+        for key in "abc":
+            buffer.put(key, {"text": key})
+        for _ in range(100):
+            if buffer.commits:
+                break
+            await asyncio.sleep(0.01)
+        loop.cancel()
+
+        assert buffer.commits == 1
+        assert buffer.dirty == 0
+
+    @pytest.mark.asyncio
+    async def test_shutdown_flushes(self, session_factory):
+        """Тест: при остановке незаписанные черновики записываются в базу."""
+        buffer = DraftBuffer(session_factory, DraftSettings(flush_interval=60))
+        buffer.put("1", {"text": "последняя правка"})
+        await buffer.shutdown()
+
+        async with session_factory() as session:
+            assert await session.scalar(select(func.count()).select_from(NoteDraft)) == 1
@@ -0,0 +1,162 @@
+"""Тесты для рассылки изменений заметок через SSE."""
+
+import asyncio
+import json
+import pytest
+from datetime import datetime
+from types import SimpleNamespace
+import sys
+sys.path.insert(0, '..')
+
+from events import EventHub
+from models.models import NoteBase
+
+
+async def next_frame(stream):
+    return await asyncio.wait_for(stream.__anext__(), 1)
+
+
+def parse_frame(frame):
+    fields = dict(line.split(": ", 1) for line in frame.strip().split("\n"))
+    return int(fields["id"]), fields["event"], json.loads(fields["data"])
+
+
+class TestEventHub:
+    """Тесты для общего буфера событий и подписчиков."""
+
+    @pytest.mark.asyncio
+    async def test_subscriber_receives_published(self):
+        """Тест: подписчик получает события, опубликованные после подключения."""
+        hub = EventHub()
+        hub.prime(10)
+        stream = hub.stream(10)
+        pending = asyncio.ensure_future(next_frame(stream))
+        await asyncio.sleep(0.01)
+
+        hub.publish(11, [(1, "update", datetime(2024, 1, 1))])
+        seq, event, data = parse_frame(await pending)
+        assert (seq, event) == (11, "change")
+        assert data["changes"] == [{"id": 1, "op": "update", "change_date": "2024-01-01T00:00:00"}]
+        assert hub.subscribers == 1
+        await stream.aclose()
+        assert hub.subscribers == 0
+
+    @pytest.mark.asyncio
+    async def test_resume_from_buffer(self):
+        """Тест: подписчик с Last-Event-ID получает пропущенные события из буфера."""
+        hub = EventHub()
+        for seq in range(1, 5):
+            hub.publish(seq, [(seq, "create", None)])
+
+        stream = hub.stream(2)
+        assert [parse_frame(await next_frame(stream))[0] for _ in range(2)] == [3, 4]
+        await stream.aclose()
+
+    @pytest.mark.asyncio
+    async def test_slow_consumer_gets_reset(self):
+        """Тест: отставший дальше буфера подписчик получает reset, а не очередь событий."""
+        hub = EventHub(history=3)
+        hub.prime(0)
+        stream = hub.stream(0)
+        for seq in range(1, 11):
+            hub.publish(seq, [(seq, "update", None)])
+
+        seq, event, data = parse_frame(await next_frame(stream))
+        assert (seq, event, data) == (10, "reset", {"seq": 10})
+        assert hub.stats()["buffered"] == 3
+        assert hub.resets == 1
+        await stream.aclose()
+
+    @pytest.mark.asyncio
+    async def test_heartbeat(self):
+        """Тест: без событий подписчику уходит комментарий-пинг."""
+        hub = EventHub(heartbeat=0.01)
+        hub.prime(0)
+        stream = hub.stream(0)
+        assert await next_frame(stream) == ": ping\n\n"
+        await stream.aclose()
+
+    @pytest.mark.asyncio
+    async def test_many_idle_subscribers(self):
+        """Тест: одно событие будит всех подписчиков, у каждого нет своей очереди."""
+        hub = EventHub()
+        hub.prime(0)
+        streams = [hub.stream(0) for _ in range(1000)]
+        pending = [asyncio.ensure_future(next_frame(stream)) for stream in streams]
+        await asyncio.sleep(0.01)
+        assert hub.subscribers == 1000
+
+        hub.publish(1, [(1, "trash", None)])
+        frames = await asyncio.gather(*pending)
+        assert {parse_frame(frame)[0] for frame in frames} == {1}
+        for stream in streams:
+            await stream.aclose()
+
+
+class TestCommitPublishes:
+    """Тесты публикации событий функциями записи из sql.py."""
+
+    @pytest.mark.asyncio
+    async def test_commit_publishes_changes(self, async_test_session):
+        """Тест: после коммита публикуется одно событие на транзакцию."""
+        from sql import create_note_async, move_to_trash_async, apply_notes_batch_async
+
+        hub = EventHub()
+        created = await create_note_async(
+            NoteBase(headline="Событие", improtance=1, created_date=datetime.now()), async_test_session
+        )
+        await move_to_trash_async(created.id, async_test_session)
+        assert hub.stats()["published"] == 1
+        await async_test_session.commit()
+
+        await apply_notes_batch_async([
+            ("create", None, {"headline": "Пакет", "text": None, "improtance": 1, "created_date": datetime.now()}),
+            ("delete", 999, None),
+        ], async_test_session)
+        await async_test_session.commit()
+
+        frames = list(hub._history)
+        assert [seq for seq, _ in frames] == [1, 2, 3]
+        assert [c["op"] for c in json.loads(frames[1][1])["changes"]] == ["trash"]
+        assert [c["op"] for c in json.loads(frames[2][1])["changes"]] == ["create"]
+
+    @pytest.mark.asyncio
+    async def test_rollback_publishes_nothing(self, async_test_session):
+        """Тест: откат транзакции не публикует событий."""
+        from sql import create_note_async, delete_note_async
+
+        hub = EventHub()
+        created = await create_note_async(
+            NoteBase(headline="Откат", improtance=1, created_date=datetime.now()), async_test_session
+        )
+        await delete_note_async(created.id, async_test_session)
+        await async_test_session.rollback()
+        assert hub.stats()["published"] == 1
+
+
+class TestEventsEndpoint:
+    """Тесты для GET /events."""
+
+    @pytest.mark.asyncio
+    async def test_resume_after_future_id_resets(self):
+        """Тест: Last-Event-ID из другой базы приводит к reset."""
+        import main
+
+        response = await main.events(SimpleNamespace(app=main.app), last_event_id="999999999")
+        assert response.media_type == "text/event-stream"
+        frames = response.body_iterator
+        assert await next_frame(frames) == "retry: 3000\n\n"
+        _, event, data = parse_frame(await next_frame(frames))
+        assert event == "reset"
+        await frames.aclose()
+
+    @pytest.mark.asyncio
+    async def test_too_many_subscribers(self, monkeypatch):
+        """Тест: сверх лимита подписчиков возвращается 503."""
+        import main
+        from fastapi import HTTPException
+
+        monkeypatch.setattr(main.app.state.event_hub, "max_subscribers", 0)
+        with pytest.raises(HTTPException) as error:
+            await main.events(SimpleNamespace(app=main.app), last_event_id=None)
+        assert error.value.status_code == 503
@@ -0,0 +1,138 @@
+"""Тесты для генератора нагрузки benchmarks/load_generator.py."""
+
+import random
+import sys
+sys.path.insert(0, '..')
+
+import httpx
+import pytest
+
+from benchmarks.load_generator import (
+    OPERATIONS, Report, Workload, arrival_times, choose_operations, load_workloads, run_load, validate_workload
+)
+
+
+class FakeClient:
+    """Клиент с фиксированными ответами вместо приложения."""
+
+    def __init__(self, fail_path=None):
+        self.fail_path = fail_path
+        self.requests = []
+
+    async def _respond(self, method, path, **kwargs):
+        self.requests.append((method, path))
+        response = self._response(method, path)
+        response.request = httpx.Request(method, "http://load" + path)
+        return response
+
+    def _response(self, method, path):
+        if path == self.fail_path:
+            return httpx.Response(500, text="sqlite3.OperationalError: database is locked")
+        if path == "/notes/" and method == "GET":
+            return httpx.Response(200, json=[{"id": i} for i in range(1, 11)])
+        if path == "/notes/changes":
+            return httpx.Response(200, json={"seq": 5})
+        if path == "/notes/" and method == "POST":
+            return httpx.Response(201, json={"id": 100})
+        if path.startswith("/trash/") and path.endswith("/restore"):
+            return httpx.Response(200, json={"id": int(path.split("/")[2])})
+        return httpx.Response(200, json=[] if path == "/trash/" else {})
+
+    async def get(self, path, **kwargs):
+        return await self._respond("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self._respond("POST", path, **kwargs)
+
+    async def put(self, path, **kwargs):
+        return await self._respond("PUT", path, **kwargs)
+
+
+class TestWorkloads:
+    """Тесты для профилей нагрузки."""
+
+    def test_bundled_profiles_are_valid(self):
+        """Тест: профили из workloads.toml загружаются и используют только известные операции."""
+        workloads = load_workloads()
+        assert {"read_heavy", "write_heavy", "smoke"} <= set(workloads)
+        assert set(workloads["smoke"].mix) == set(OPERATIONS)
+
+    def test_unknown_parameter(self, tmp_path):
+        """Тест: опечатка в параметре профиля - ошибка, а не молчаливое значение по умолчанию."""
+        path = tmp_path / "workloads.toml"
+        path.write_text('[workloads.bad]\nrps = 10\nmix = { list = 1 }\n', encoding="utf-8")
+        with pytest.raises(ValueError, match="rps"):
+            load_workloads(str(path))
+
+    @pytest.mark.parametrize("changes", [
+        {"rate": 0}, {"users": 0}, {"arrivals": "burst"}, {"mix": {"list": 0}}, {"mix": {"upload": 1}},
+    ])
+    def test_validation(self, changes):
+        """Тест: недопустимые значения профиля отклоняются."""
+        values = {"name": "test", "mix": {"list": 1}}
+        values.update(changes)
+        with pytest.raises(ValueError):
+            validate_workload(Workload(**values))
+
+    def test_arrivals(self):
+        """Тест: расписание воспроизводимо, частота близка к заданной."""
+        workload = Workload(name="test", mix={"list": 1}, rate=200, duration=10)
+        times = arrival_times(workload, random.Random(1))
+        assert times == arrival_times(workload, random.Random(1))
+        assert 1800 < len(times) < 2200
+        assert times == sorted(times) and times[-1] < 10
+        uniform = arrival_times(Workload(name="test", mix={"list": 1}, rate=4, duration=1, arrivals="uniform"),
+                                random.Random(1))
+        assert uniform == [0, 0.25, 0.5, 0.75]
+
+    def test_mix_weights(self):
+        """Тест: доли операций соответствуют весам, нулевые веса не выбираются."""
+        workload = Workload(name="test", mix={"list": 9, "create": 1, "trash": 0})
+        counts = {name: 0 for name in workload.mix}
+        for name in choose_operations(workload, 10000, random.Random(1)):
+            counts[name] += 1
+        assert counts["trash"] == 0
+        assert 0.08 < counts["create"] / 10000 < 0.12
+
+
+class TestReport:
+    """Тесты для отчёта о прогоне."""
+
+    def test_summary(self):
+        """Тест: ошибки, блокировки, гистограмма и разбивка по времени."""
+        report = Report(interval=1.0)
+        report.record("list", 0.5, 0.002, 0.001)
+        report.record("list", 1.5, 0.004, 0.003)
+        report.record("create", 1.7, 0.2, 0.1, error="HTTP 500", locked=True)
+        report.elapsed = 2.0
+        result = report.summary()
+        assert (result["completed"], result["errors"], result["database_locked"]) == (3, 1, 1)
+        assert result["error_rate"] == pytest.approx(1 / 3, abs=1e-4)
+        assert result["throughput_rps"] == 1.5
+        assert result["operations"]["list"]["p50_ms"] == 2.0
+        assert sum(count for _, count in result["histogram"]) == 3
+        assert [(slot["t"], slot["rps"], slot["errors"]) for slot in result["timeline"]] == [(0, 1.0, 0), (1, 2.0, 1)]
+
+
+class TestRunLoad:
+    """Тесты для выполнения нагрузки."""
+
+    @pytest.mark.asyncio
+    async def test_runs_schedule(self):
+        """Тест: выполняются все запланированные запросы, ошибки с блокировкой SQLite считаются."""
+        client = FakeClient(fail_path="/notes/search")
+        workload = Workload(name="test", mix={"list": 1, "read": 1, "search": 1, "create": 1, "trash": 1},
+                            rate=500, users=4, duration=0.2, arrivals="uniform")
+        report = await run_load(client, workload, seed=3)
+        result = report.summary()
+        assert result["completed"] + sum(result["skipped"].values()) == 100
+        assert result["errors"] == result["operations"]["search"]["count"] == result["database_locked"]
+        assert result["errors_by_kind"] == {"HTTP 500": result["errors"]}
+
+    @pytest.mark.asyncio
+    async def test_skips_without_notes(self):
+        """Тест: восстановление при пустой корзине пропускается, а не считается ошибкой."""
+        workload = Workload(name="test", mix={"restore": 1}, rate=100, users=2, duration=0.05, arrivals="uniform")
+        report = await run_load(FakeClient(), workload)
+        assert report.summary()["skipped"] == {"restore": 5}
+        assert report.summary()["errors"] == 0
@@ -0,0 +1,131 @@
+"""Тесты для метрик Prometheus."""
+
+import pytest
+import sys
+sys.path.insert(0, '..')
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from metrics import Counter, Histogram, Metrics, MetricsMiddleware, RequestTiming, _current_request
+
+
+class TestExposition:
+    """Тесты для текстового формата метрик."""
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Тест: корзины гистограммы накопительные, +Inf равна количеству."""
+        histogram = Histogram("latency_seconds", "Задержка", ("route",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3.0):
+            histogram.observe(value, ("/notes/",))
+
+        lines = histogram.render()
+        assert 'latency_seconds_bucket{route="/notes/",le="0.1"} 1' in lines
+        assert 'latency_seconds_bucket{route="/notes/",le="1.0"} 3' in lines
+        assert 'latency_seconds_bucket{route="/notes/",le="+Inf"} 4' in lines
+        assert 'latency_seconds_count{route="/notes/"} 4' in lines
+        assert histogram.sum(("/notes/",)) == pytest.approx(4.25)
+
+    def test_counter_escapes_labels(self):
+        """Тест: кавычки и переводы строк в метках экранируются."""
+        counter = Counter("requests_total", "Запросы", ("route",))
+        counter.inc(('/a"b\n',), 2)
+        assert counter.render()[-1] == 'requests_total{route="/a\\"b\\n"} 2'
+
+    def test_stats_collectors(self):
+        """Тест: числовые поля stats() выгружаются как счётчики и датчики."""
+        metrics = Metrics()
+        metrics.register_stats("notes_cache", lambda: {"hits": 3, "size": 2, "ttl": None, "name": "x"},
+                               counters=("hits",))
+        output = metrics.render()
+        assert "# TYPE notes_cache_hits_total counter\nnotes_cache_hits_total 3" in output
+        assert "notes_cache_size 2" in output
+        assert "notes_cache_ttl" not in output and "notes_cache_name" not in output
+
+
+class TestInstrumentation:
+    """Тесты для хуков SQLAlchemy и middleware."""
+
+    def test_statements_attributed_to_request(self):
+        """Тест: время SQL учитывается по операциям и в текущем запросе."""
+        metrics = Metrics()
+        engine = create_engine("sqlite://")
+        metrics.instrument_engine(engine, "sync")
+
+        timing = RequestTiming()
+        token = _current_request.set(timing)
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                conn.execute(text("CREATE TABLE t (id INTEGER)"))
+        finally:
+            _current_request.reset(token)
+
+        assert timing.db_statements == 2
+        assert timing.db_seconds > 0
+        assert metrics.statements.count(("SELECT",)) == 1
+        assert metrics.statements.count(("OTHER",)) == 1
+        assert 'notes_db_statement_duration_seconds_count{operation="SELECT"} 1' in metrics.render()
+
+    def test_engine_instrumented_once(self):
+        """Тест: повторная инструментация движка не удваивает замеры."""
+        metrics = Metrics()
+        engine = create_engine("sqlite://")
+        metrics.instrument_engine(engine, "sync")
+        metrics.instrument_engine(engine, "sync")
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        assert metrics.statements.count(("SELECT",)) == 1
+
+    def test_failed_statement_keeps_timer_stack(self):
+        """Тест: ошибка запроса не оставляет незакрытый таймер."""
+        metrics = Metrics()
+        engine = create_engine("sqlite://")
+        metrics.instrument_engine(engine, "sync")
+        with engine.connect() as conn:
+            with pytest.raises(Exception):
+                conn.execute(text("SELECT * FROM missing"))
+            assert conn.info["query_started"] == []
+
+    def test_middleware_labels_route_template(self):
+        """Тест: метка маршрута - шаблон пути, неизвестные пути сводятся в одну."""
+        metrics = Metrics()
+        app = FastAPI()
+        app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+        @app.get("/items/{item_id}")
+        async def item(item_id: int):
+            return {"id": item_id}
+
+        client = TestClient(app)
+        client.get("/items/1")
+        client.get("/items/2")
+        client.get("/items/x")
+        client.get("/random/path")
+
+        assert metrics.requests.value(("GET", "/items/{item_id}", "200")) == 2
+        assert metrics.requests.value(("GET", "/items/{item_id}", "422")) == 1
+        assert metrics.requests.value(("GET", "<unmatched>", "404")) == 1
+        assert metrics.latency.count(("GET", "/items/{item_id}")) == 3
+
+    def test_event_stream_timed_to_first_byte(self):
+        """Тест: для потока событий в задержку маршрута идёт время до начала ответа, а не весь поток."""
+        import asyncio
+        from fastapi.responses import StreamingResponse
+
+        metrics = Metrics()
+        app = FastAPI()
+        app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+        @app.get("/events")
+        async def events():
+            async def body():
+                for _ in range(3):
+                    await asyncio.sleep(0.1)
+                    yield "data: x\n\n"
+            return StreamingResponse(body(), media_type="text/event-stream")
+
+        assert TestClient(app).get("/events").text.count("data: x") == 3
+        assert metrics.latency.count(("GET", "/events")) == 1
+        assert metrics.latency.sum(("GET", "/events")) < 0.1
@@ -0,0 +1,92 @@
+"""Тесты для быстрой сериализации списков заметок."""
+
+import json
+import pytest
+from datetime import datetime
+import sys
+sys.path.insert(0, '..')
+
+import serialization
+from serialization import (
+    project, encode_json, negotiate_media_type, accepts_gzip, NOTE_FIELDS, TRASHED_FIELDS, JSON_MEDIA_TYPE
+)
+from models.models import NoteBase
+
+
+def make_row(id, **extra):
+    row = {
+        "id": id, "headline": "Заголовок", "text": "Текст", "improtance": 2,
+        "created_date": datetime(2024, 5, 1, 12, 30, 0, 123456), "change_date": None,
+        "deleted_date": None, "change_seq": 7, "version": 1,
+    }
+    row.update(extra)
+    return row
+
+
+class TestProjection:
+    """Тесты для выборки полей ответа из строк."""
+
+    def test_dict_and_orm_give_same_rows(self):
+        """Тест: снимок кэша и объект ORM дают одинаковые строки."""
+        row = make_row(1)
+        note = NoteBase(**row)
+        assert project([row], NOTE_FIELDS) == project([note], NOTE_FIELDS)
+        assert list(project([row], NOTE_FIELDS)[0]) == ["id", "headline", "text", "improtance",
+                                                       "created_date", "change_date", "version"]
+
+    def test_trashed_fields(self):
+        """Тест: у заметки корзины original_id совпадает с id."""
+        item = project([make_row(5, deleted_date=datetime(2024, 6, 1))], TRASHED_FIELDS)[0]
+        assert item["original_id"] == 5
+        assert item["deleted_date"] == datetime(2024, 6, 1)
+        assert "change_seq" not in item
+
+
+class TestEncoding:
+    """Тесты для кодировщиков JSON."""
+
+    def test_matches_stdlib_json(self):
+        """Тест: результат совпадает с сериализацией через модели."""
+        rows = project([make_row(1), make_row(2, change_date=datetime(2024, 5, 2))], NOTE_FIELDS)
+        data = json.loads(encode_json(rows))
+        assert data[0]["created_date"] == "2024-05-01T12:30:00.123456"
+        assert data[1]["change_date"] == "2024-05-02T00:00:00"
+        assert data[0]["headline"] == "Заголовок"
+
+    def test_fallback_without_orjson(self, monkeypatch):
+        """Тест: без orjson используется стандартный json с тем же результатом."""
+        rows = project([make_row(1)], NOTE_FIELDS)
+        fast = encode_json(rows)
+        monkeypatch.setattr(serialization, "orjson", None)
+        assert json.loads(encode_json(rows)) == json.loads(fast)
+
+    def test_msgpack_roundtrip(self):
+        """Тест: MessagePack содержит те же данные, даты - строками ISO."""
+        msgpack = pytest.importorskip("msgpack")
+        rows = project([make_row(1)], NOTE_FIELDS)
+        data = msgpack.unpackb(serialization.encode_msgpack(rows), raw=False)
+        assert data[0]["created_date"] == "2024-05-01T12:30:00.123456"
+
+
+class TestNegotiation:
+    """Тесты для выбора формата и сжатия."""
+
+    def test_json_by_default(self):
+        """Тест: браузерный Accept получает JSON."""
+        assert negotiate_media_type("text/html,*/*;q=0.8") == JSON_MEDIA_TYPE
+        assert negotiate_media_type(None) == JSON_MEDIA_TYPE
+
+    def test_msgpack_when_requested(self, monkeypatch):
+        """Тест: MessagePack выбирается только если он установлен и запрошен."""
+        monkeypatch.setattr(serialization, "msgpack", object())
+        assert negotiate_media_type("application/msgpack") == "application/msgpack"
+        assert negotiate_media_type("application/json, application/msgpack;q=0.5") == JSON_MEDIA_TYPE
+        monkeypatch.setattr(serialization, "msgpack", None)
+        assert negotiate_media_type("application/msgpack") == JSON_MEDIA_TYPE
+
+    def test_accepts_gzip(self):
+        """Тест: разбор Accept-Encoding для gzip."""
+        assert accepts_gzip("gzip, deflate, br")
+        assert accepts_gzip("*")
+        assert not accepts_gzip("gzip;q=0")
+        assert not accepts_gzip("")
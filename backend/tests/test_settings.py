@@ -0,0 +1,127 @@
+"""Тесты для настроек хранилища SQLite."""
+
+import pytest
+import sys
+sys.path.insert(0, '..')
+
+from sqlalchemy import create_engine, event, text
+
+from settings import load_storage_settings, load_retention_settings, load_draft_settings, apply_pragmas, PRESETS
+
+
+class TestStorageSettings:
+    """Тесты для загрузки профилей и переопределений."""
+
+    def test_default_profile(self):
+        """Тест: без настроек используется профиль durable."""
+        settings = load_storage_settings({})
+        assert settings == PRESETS["durable"]
+        assert settings.journal_mode == "WAL"
+        assert settings.synchronous == "FULL"
+
+    def test_throughput_profile(self):
+        """Тест: профиль throughput ослабляет fsync и включает mmap."""
+        settings = load_storage_settings({"NOTES_DB_PROFILE": "throughput"})
+        assert settings.synchronous == "NORMAL"
+        assert settings.mmap_size > 0
+
+    def test_env_overrides(self):
+        """Тест: переменные окружения переопределяют значения профиля."""
+        settings = load_storage_settings({
+            "NOTES_DB_PROFILE": "throughput",
+            "NOTES_DB_BUSY_TIMEOUT": "250",
+            "NOTES_DB_SYNCHRONOUS": "off",
+            "NOTES_DB_DATABASE": "/tmp/notes.db",
+        })
+        assert settings.busy_timeout == 250
+        assert settings.synchronous == "OFF"
+        assert settings.database == "/tmp/notes.db"
+        assert settings.temp_store == "MEMORY"
+
+    def test_config_file(self, tmp_path):
+        """Тест: файл конфигурации TOML, переменные окружения важнее него."""
+        config = tmp_path / "storage.toml"
+        config.write_text('[storage]\nprofile = "throughput"\ncache_size = -1000\npool = "null"\n')
+
+        settings = load_storage_settings({
+            "NOTES_DB_CONFIG": str(config),
+            "NOTES_DB_CACHE_SIZE": "-500",
+        })
+        assert settings.profile == "throughput"
+        assert settings.pool == "null"
+        assert settings.cache_size == -500
+
+    @pytest.mark.parametrize("environ", [
+        {"NOTES_DB_PROFILE": "fast"},
+        {"NOTES_DB_JOURNAL_MODE": "fast"},
+        {"NOTES_DB_BUSY_TIMEOUT": "долго"},
+        {"NOTES_DB_POOL": "static"},
+        {"NOTES_DB_SCHEMA": "skip"},
+        {"NOTES_DB_SHARDS": "0"},
+    ])
+    def test_invalid_values(self, environ):
+        """Тест: недопустимые значения отклоняются."""
+        with pytest.raises(ValueError):
+            load_storage_settings(environ)
+
+    def test_pragmas_applied_on_connect(self, tmp_path):
+        """Тест: PRAGMA применяются к каждому новому соединению."""
+        settings = load_storage_settings({"NOTES_DB_PROFILE": "throughput", "NOTES_DB_BUSY_TIMEOUT": "1234"})
+        engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+        event.listen(engine, "connect", lambda conn, _: apply_pragmas(conn, settings))
+
+        with engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 1234
+            assert conn.execute(text("PRAGMA temp_store")).scalar() == 2
+        engine.dispose()
+
+
+class TestRetentionSettings:
+    """Тесты для настроек очистки корзины."""
+
+    def test_defaults(self):
+        """Тест: по умолчанию хранится 30 дней."""
+        settings = load_retention_settings({})
+        assert settings.max_age_days == 30
+        assert settings.enabled is True
+
+    def test_env_overrides(self):
+        """Тест: переопределение через переменные окружения."""
+        settings = load_retention_settings({
+            "NOTES_TRASH_MAX_AGE_DAYS": "7",
+            "NOTES_TRASH_BATCH_SIZE": "50",
+            "NOTES_TRASH_ENABLED": "false",
+        })
+        assert settings.max_age_days == 7
+        assert settings.batch_size == 50
+        assert settings.enabled is False
+
+    def test_invalid_batch_size(self):
+        """Тест: размер порции должен быть положительным."""
+        with pytest.raises(ValueError):
+            load_retention_settings({"NOTES_TRASH_BATCH_SIZE": "0"})
+        with pytest.raises(ValueError):
+            load_retention_settings({"NOTES_TRASH_BATCH_SIZE": "много"})
+
+
+class TestDraftSettings:
+    """Тесты для настроек записи черновиков."""
+
+    def test_env_overrides(self):
+        """Тест: переопределение через переменные окружения."""
+        settings = load_draft_settings({"NOTES_DRAFTS_FLUSH_INTERVAL": "2.5", "NOTES_DRAFTS_MAX_DIRTY": "10"})
+        assert settings.flush_interval == 2.5
+        assert settings.max_dirty == 10
+        assert settings.max_entries == 1000
+
+    @pytest.mark.parametrize("environ", [
+        {"NOTES_DRAFTS_FLUSH_INTERVAL": "0"},
+        {"NOTES_DRAFTS_MAX_DIRTY": "5000"},
+        {"NOTES_DRAFTS_MAX_ENTRIES": "много"},
+    ])
+    def test_invalid_values(self, environ):
+        """Тест: недопустимые значения отклоняются."""
+        with pytest.raises(ValueError):
+            load_draft_settings(environ)
@@ -4,12 +4,21 @@ let currentNote = null;
 let hasUnsavedChanges = false;
 let currentSort = 'date_desc';
 let currentTheme = 'dark';
+let searchResults = null;
+let searchTimer = null;
+let nextCursor = null;
+let loadingMore = false;
+let changeSeq = 0;
+let syncing = false;
+let syncPending = false;
+let openingNoteId = null;
 const selectedNotesForExport = new Set();
 const DRAFTS_KEY = 'zametki_drafts';
 
 const isTrashPage = !!document.getElementById('trash_list');
 
 const notesList = document.getElementById('notes_list');
+const notesContainer = document.querySelector('.notes_container');
 const emptyState = document.getElementById('empty_state');
 const noSelection = document.getElementById('no_selection');
 const editor = document.getElementById('editor');
@@ -40,6 +49,23 @@ const btnRestore = document.getElementById('btn_restore');
 const btnDeleteForever = document.getElementById('btn_delete_forever');
 
 const API_BASE = '';
+const PAGE_SIZE = 200;
+const SEARCH_DELAY = 200;
+const LOAD_MORE_THRESHOLD = 200;
+const EXPORT_POLL_INTERVAL = 1000;
+const SYNC_INTERVAL = 30000;
+// Черновик отправляется на сервер после паузы в наборе, а не на каждое нажатие
+const DRAFT_UPLOAD_DELAY = 2000;
+const draftUploads = {};
+
+const SORT_PARAMS = {
+  date_desc: { sort: 'changed', order: 'desc' },
+  date_asc: { sort: 'changed', order: 'asc' },
+  alpha_asc: { sort: 'headline', order: 'asc' },
+  alpha_desc: { sort: 'headline', order: 'desc' },
+  importance_desc: { sort: 'importance', order: 'desc' },
+  importance_asc: { sort: 'importance', order: 'asc' }
+};
 
 function getDrafts() {
   try {
@@ -51,8 +77,57 @@ function getDrafts() {
 
 function saveDraft(noteId, headline, text, improtance) {
   const drafts = getDrafts();
-  drafts[noteId] = { headline: headline, text: text, improtance: improtance };
+  drafts[noteId] = { headline: headline, text: text, improtance: improtance, updated: Date.now() };
   localStorage.setItem(DRAFTS_KEY, JSON.stringify(drafts));
+  scheduleDraftUpload(noteId);
+}
+
+function scheduleDraftUpload(noteId) {
+  clearTimeout(draftUploads[noteId]);
+  draftUploads[noteId] = setTimeout(function() {
+    delete draftUploads[noteId];
+    uploadDraft(noteId);
+  }, DRAFT_UPLOAD_DELAY);
+}
+
+async function uploadDraft(noteId) {
+  const draft = getDraft(noteId);
+  if (!draft) return;
+  try {
+    await fetch(API_BASE + '/drafts/' + encodeURIComponent(noteId), {
+      method: 'PUT',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        note_id: Number(noteId) || null,
+        headline: draft.headline,
+        text: draft.text,
+        improtance: draft.improtance
+      })
+    });
+  } catch (error) {
+    // Черновик остается в localStorage и уйдет со следующим сохранением
+    console.error('Error uploading draft:', error);
+  }
+}
+
+// Черновики с других устройств заменяют локальные, если они новее
+async function loadServerDrafts() {
+  try {
+    const response = await fetch(API_BASE + '/drafts/');
+    if (!response.ok) return;
+    const serverDrafts = await response.json();
+    const drafts = getDrafts();
+    for (let i = 0; i < serverDrafts.length; i++) {
+      const draft = serverDrafts[i];
+      const updated = Date.parse(draft.updated_date);
+      const local = drafts[draft.key];
+      if (local && local.updated >= updated) continue;
+      drafts[draft.key] = { headline: draft.headline, text: draft.text, improtance: draft.improtance, updated: updated };
+    }
+    localStorage.setItem(DRAFTS_KEY, JSON.stringify(drafts));
+  } catch (error) {
+    console.error('Error loading drafts:', error);
+  }
 }
 
 function getDraft(noteId) {
@@ -64,6 +139,11 @@ function deleteDraft(noteId) {
   const drafts = getDrafts();
   delete drafts[noteId];
   localStorage.setItem(DRAFTS_KEY, JSON.stringify(drafts));
+  clearTimeout(draftUploads[noteId]);
+  delete draftUploads[noteId];
+  fetch(API_BASE + '/drafts/' + encodeURIComponent(noteId), { method: 'DELETE' }).catch(function(error) {
+    console.error('Error deleting draft:', error);
+  });
 }
 
 function hasDraft(noteId) {
@@ -79,6 +159,15 @@ document.addEventListener('DOMContentLoaded', function() {
     loadTrash();
   } else {
     loadNotes();
+    if (window.EventSource) {
+      subscribeToChanges();
+    } else {
+      setInterval(syncNotes, SYNC_INTERVAL);
+    }
+    window.addEventListener('focus', syncNotes);
+    document.addEventListener('visibilitychange', function() {
+      if (!document.hidden) syncNotes();
+    });
   }
 });
 
@@ -108,27 +197,187 @@ function toggleTheme() {
   applyTheme();
 }
 
+async function fetchPage(path, params, cursor) {
+  const query = new URLSearchParams(params || {});
+  query.set('limit', PAGE_SIZE);
+  if (cursor) query.set('after', cursor);
+
+  const response = await fetch(API_BASE + path + '?' + query.toString());
+  if (!response.ok) throw new Error('HTTP ' + response.status);
+  return {
+    items: await response.json(),
+    cursor: response.headers.get('X-Next-Cursor')
+  };
+}
+
+async function fetchAllPages(path, params) {
+  let items = [];
+  let cursor = null;
+  do {
+    const page = await fetchPage(path, params, cursor);
+    items = items.concat(page.items);
+    cursor = page.cursor;
+  } while (cursor);
+  return items;
+}
+
+// Список загружается без текста, только с превью; текст заметки запрашивается при открытии
+function listParams() {
+  return Object.assign({ view: 'summary' }, SORT_PARAMS[currentSort]);
+}
+
+function previewSource(note) {
+  return note.text !== undefined ? note.text : note.preview;
+}
+
+async function fetchNote(id) {
+  const response = await fetch(API_BASE + '/notes/' + id);
+  if (!response.ok) throw new Error('HTTP ' + response.status);
+  return response.json();
+}
+
+async function openNoteBody(id) {
+  openingNoteId = id;
+  try {
+    const full = await fetchNote(id);
+    const note = notes.find(function(n) { return n.id === id; });
+    if (note) Object.assign(note, full);
+    // Пока загружался текст, пользователь мог открыть другую заметку
+    if (openingNoteId === id) selectNote(id);
+  } catch (error) {
+    console.error('Error loading note:', error);
+    showToast('Ошибка загрузки заметки', 'error');
+  } finally {
+    if (openingNoteId === id) openingNoteId = null;
+  }
+}
+
+async function withNoteBodies(list) {
+  return Promise.all(list.map(function(note) {
+    return note.text !== undefined ? note : fetchNote(note.id);
+  }));
+}
+
+async function fetchChanges(since) {
+  const response = await fetch(API_BASE + '/notes/changes?since=' + since);
+  if (!response.ok) throw new Error('HTTP ' + response.status);
+  return response.json();
+}
+
 async function loadNotes() {
   try {
-    const response = await fetch(API_BASE + '/notes/');
-    if (response.ok) {
-      notes = await response.json();
+    // Номер изменения запоминается до загрузки списка: то, что изменится
+    // во время загрузки, придет при следующей синхронизации
+    changeSeq = (await fetchChanges(0)).seq;
+    const [page] = await Promise.all([fetchPage('/notes/', listParams(), null), loadServerDrafts()]);
+    notes = page.items;
+    nextCursor = page.cursor;
+    renderNotesList(searchInput ? searchInput.value : '');
+  } catch (error) {
+    console.error('Error loading notes:', error);
+    showToast('Ошибка загрузки заметок', 'error');
+  }
+}
+
+// Сервер сообщает о каждом изменении, сами заметки загружаются через /notes/changes.
+// После разрыва EventSource переподключается сам и передает Last-Event-ID.
+function subscribeToChanges() {
+  const source = new EventSource(API_BASE + '/events');
+  source.addEventListener('change', function(event) {
+    // При шардах changeSeq - строка с номерами изменений шардов, и номер
+    // события с ним не сравнить: синхронизация на каждое событие
+    if (typeof changeSeq === 'string' || Number(event.lastEventId) > changeSeq) syncNotes();
+  });
+  source.addEventListener('reset', function() {
+    loadNotes();
+  });
+}
+
+// Подтягивает изменения, сделанные в других вкладках и на других устройствах
+async function syncNotes() {
+  if (!changeSeq || document.hidden) return;
+  if (syncing) {
+    syncPending = true;
+    return;
+  }
+
+  syncing = true;
+  try {
+    const changes = await fetchChanges(changeSeq);
+    if (changes.reset) {
+      await loadNotes();
+      return;
+    }
+
+    // Несохраненные правки в открытой заметке не перезаписываются
+    const editing = currentNote && hasUnsavedChanges ? currentNote.id : null;
+    const deleted = new Set(changes.deleted);
+    deleted.delete(editing);
+    notes = notes.filter(function(n) { return !deleted.has(n.id); });
+    changes.notes.forEach(function(note) {
+      if (note.id === editing) return;
+      const index = notes.findIndex(function(n) { return n.id === note.id; });
+      if (index === -1) {
+        notes.push(note);
+      } else {
+        notes[index] = note;
+      }
+    });
+    changeSeq = changes.seq;
+
+    if (currentNote && currentNote.id !== editing) {
+      if (deleted.has(currentNote.id)) {
+        currentNote = null;
+        if (noSelection) noSelection.style.display = 'flex';
+        if (editor) editor.style.display = 'none';
+      } else {
+        const updated = changes.notes.find(function(n) { return n.id === currentNote.id; });
+        // Перерисовка редактора сбрасывает курсор: только если текст действительно изменился
+        if (updated && (updated.headline !== currentNote.headline || updated.text !== currentNote.text ||
+            updated.improtance !== currentNote.improtance)) {
+          selectNote(currentNote.id);
+        } else if (updated) {
+          currentNote = updated;
+        }
+      }
+    }
+
+    if (changes.notes.length || deleted.size) {
       sortNotes();
-      renderNotesList();
+      renderNotesList(searchInput ? searchInput.value : '');
     }
+  } catch (error) {
+    console.error('Error syncing notes:', error);
+  } finally {
+    syncing = false;
+    if (syncPending) {
+      syncPending = false;
+      syncNotes();
+    }
+  }
+}
+
+async function loadMoreNotes() {
+  if (!nextCursor || loadingMore) return;
+
+  loadingMore = true;
+  try {
+    const page = await fetchPage('/notes/', listParams(), nextCursor);
+    const known = new Set(notes.map(function(n) { return n.id; }));
+    notes = notes.concat(page.items.filter(function(n) { return !known.has(n.id); }));
+    nextCursor = page.cursor;
+    renderNotesList(searchInput ? searchInput.value : '');
   } catch (error) {
     console.error('Error loading notes:', error);
-    showToast('Ошибка загрузки заметок', 'error');
+  } finally {
+    loadingMore = false;
   }
 }
 
 async function loadTrash() {
   try {
-    const response = await fetch(API_BASE + '/trash/');
-    if (response.ok) {
-      trashedNotes = await response.json();
-      renderTrashList();
-    }
+    trashedNotes = await fetchAllPages('/trash/');
+    renderTrashList();
   } catch (error) {
     console.error('Error loading trash:', error);
   }
@@ -180,9 +429,7 @@ function setupEventListeners() {
   }
 
   if (searchInput) {
-    searchInput.addEventListener('input', function(e) {
-      renderNotesList(e.target.value);
-    });
+    searchInput.addEventListener('input', handleSearchInput);
   }
 
   if (editorTitle) {
@@ -250,8 +497,16 @@ function setupEventListeners() {
   if (sortSelect) {
     sortSelect.addEventListener('change', function(e) {
       currentSort = e.target.value;
-      sortNotes();
-      renderNotesList(searchInput ? searchInput.value : '');
+      loadNotes();
+    });
+  }
+
+  if (notesContainer) {
+    notesContainer.addEventListener('scroll', function() {
+      const remaining = notesContainer.scrollHeight - notesContainer.scrollTop - notesContainer.clientHeight;
+      if (remaining < LOAD_MORE_THRESHOLD) {
+        loadMoreNotes();
+      }
     });
   }
 
@@ -367,23 +622,50 @@ async function createNewNote() {
   }
 }
 
+function handleSearchInput(e) {
+  const query = e.target.value.trim();
+  clearTimeout(searchTimer);
+
+  if (query === '') {
+    searchResults = null;
+    renderNotesList();
+    return;
+  }
+
+  searchTimer = setTimeout(function() { runSearch(query); }, SEARCH_DELAY);
+}
+
+async function runSearch(query) {
+  try {
+    const url = API_BASE + '/notes/search?q=' + encodeURIComponent(query) + '&limit=' + PAGE_SIZE;
+    const response = await fetch(url);
+    if (!response.ok) return;
+
+    const results = await response.json();
+    if (!searchInput || searchInput.value.trim() !== query) return;
+
+    searchResults = results;
+    renderNotesList(query);
+  } catch (error) {
+    console.error('Error searching notes:', error);
+    showToast('Ошибка поиска', 'error');
+  }
+}
+
 function renderNotesList(searchQuery) {
   if (!notesList) return;
 
   if (!searchQuery) searchQuery = '';
 
-  const filteredNotes = [];
-  for (let i = 0; i < notes.length; i++) {
-    const note = notes[i];
-    if (searchQuery === '') {
-      filteredNotes.push(note);
-    } else {
-      const query = searchQuery.toLowerCase();
-      const headlineMatch = note.headline && note.headline.toLowerCase().indexOf(query) !== -1;
-      const textMatch = note.text && note.text.toLowerCase().indexOf(query) !== -1;
-      if (headlineMatch || textMatch) {
-        filteredNotes.push(note);
-      }
+  let filteredNotes = notes;
+  const snippets = {};
+  if (searchQuery.trim() !== '' && searchResults) {
+    filteredNotes = [];
+    for (let i = 0; i < searchResults.length; i++) {
+      const result = searchResults[i];
+      const local = notes.find(function(n) { return n.id === result.id; });
+      filteredNotes.push(local || result);
+      snippets[result.id] = result.snippet;
     }
   }
 
@@ -402,10 +684,10 @@ function renderNotesList(searchQuery) {
     const draft = getDraft(note.id);
     const isDraft = !!draft;
     const displayHeadline = isDraft ? draft.headline : note.headline;
-    const displayText = isDraft ? draft.text : note.text;
+    const displayText = isDraft ? draft.text : previewSource(note);
     const importance = isDraft ? (draft.improtance || 1) : (note.improtance || 1);
     const title = escapeHtml(displayHeadline) || 'Без названия';
-    const preview = getPreview(displayText);
+    const preview = snippets[note.id] && !isDraft ? highlightSnippet(snippets[note.id]) : getPreview(displayText);
     const date = formatDate(note.change_date || note.created_date);
     const label = getImportanceLabel(importance);
 
@@ -458,20 +740,21 @@ function renderTrashList() {
 }
 
 function selectNote(id) {
-  currentNote = null;
-  for (let i = 0; i < notes.length; i++) {
-    if (notes[i].id === id) {
-      currentNote = notes[i];
-      break;
-    }
+  const note = notes.find(function(n) { return n.id === id; });
+  const draft = getDraft(id);
+  // Редактор продолжает показывать прежнюю заметку, пока не загрузится текст новой
+  if (note && note.text === undefined && !draft) {
+    openNoteBody(id);
+    return;
   }
 
+  openingNoteId = null;
+  currentNote = note || null;
   if (!currentNote) return;
 
   if (noSelection) noSelection.style.display = 'none';
   if (editor) editor.style.display = 'flex';
 
-  const draft = getDraft(id);
   if (draft) {
     editorTitle.value = draft.headline || '';
     editorContent.value = draft.text || '';
@@ -560,9 +843,12 @@ async function saveCurrentNote() {
   updateStatus('saving');
 
   try {
+    const headers = { 'Content-Type': 'application/json' };
+    // Сервер отклонит запись (412), если заметку успели изменить в другом месте
+    if (currentNote.version) headers['If-Match'] = '"n' + currentNote.id + '-v' + currentNote.version + '"';
     const response = await fetch(API_BASE + '/notes/' + currentNote.id, {
       method: 'PUT',
-      headers: { 'Content-Type': 'application/json' },
+      headers: headers,
       body: JSON.stringify({
         headline: currentNote.headline,
         text: currentNote.text,
@@ -570,9 +856,15 @@ async function saveCurrentNote() {
       })
     });
 
+    if (response.status === 412) {
+      await resolveConflict(currentNote);
+      return;
+    }
+
     if (response.ok) {
       const updatedNote = await response.json();
       currentNote.change_date = updatedNote.change_date;
+      currentNote.version = updatedNote.version;
 
       for (let i = 0; i < notes.length; i++) {
         if (notes[i].id === currentNote.id) {
@@ -600,6 +892,36 @@ async function saveCurrentNote() {
   }
 }
 
+// Заметку изменили в другом месте: версия берется с сервера, иначе и все следующие
+// сохранения получали бы 412. Пользователь выбирает, чьи правки оставить
+async function resolveConflict(note) {
+  updateStatus('error');
+  let server;
+  try {
+    server = await fetchNote(note.id);
+  } catch (error) {
+    console.error('Error loading note:', error);
+    showToast('Заметка изменена в другом месте, правки сохранены в черновике', 'error');
+    return;
+  }
+
+  note.version = server.version;
+  const keepMine = confirm('Заметка «' + (server.headline || 'Без названия') + '» изменена в другом месте.\n\n' +
+    'OK - сохранить ваши правки поверх, Отмена - загрузить изменённую версию.');
+  if (currentNote !== note) return;
+  if (keepMine) {
+    await saveCurrentNote();
+    return;
+  }
+
+  deleteDraft(note.id);
+  const index = notes.findIndex(function(n) { return n.id === note.id; });
+  if (index !== -1) notes[index] = server;
+  selectNote(note.id);
+  renderNotesList(searchInput ? searchInput.value : '');
+  showToast('Загружена версия, изменённая в другом месте', 'success');
+}
+
 async function deleteCurrentNote() {
   if (!currentNote) return;
 
@@ -704,7 +1026,7 @@ function renderExportList() {
     const isChecked = selectedNotesForExport.has(note.id);
     const importance = note.improtance || 1;
     const title = escapeHtml(note.headline) || 'Без названия';
-    const preview = getPreview(note.text);
+    const preview = getPreview(previewSource(note));
 
     html += '<label class="export_item' + (isChecked ? ' selected' : '') + '">';
     html += '<input type="checkbox" class="export_checkbox" data-id="' + note.id + '"' + (isChecked ? ' checked' : '') + '>';
@@ -778,44 +1100,71 @@ function exportSelected(format) {
 
   closeExportModal();
 
-  if (format === 'txt') exportToTxt(selected);
-  else if (format === 'json') exportToJson(selected);
-  else if (format === 'pdf') exportToPdf(selected);
+  if (format === 'txt' || format === 'json') exportFromServer(format, selected);
+  else if (format === 'pdf') exportViaJob(format, selected);
 }
 
-function exportToTxt(notesToExport) {
-  let content = '';
-  for (let i = 0; i < notesToExport.length; i++) {
-    const note = notesToExport[i];
-    content += '='.repeat(50) + '\n';
-    content += 'Заголовок: ' + (note.headline || 'Без названия') + '\n';
-    content += 'Важность: ' + getImportanceLabel(note.improtance || 1) + '\n';
-    content += 'Создано: ' + new Date(note.created_date).toLocaleString('ru-RU') + '\n';
-    if (note.change_date) {
-      content += 'Изменено: ' + new Date(note.change_date).toLocaleString('ru-RU') + '\n';
+async function exportViaJob(format, notesToExport) {
+  showToast('Готовим ' + format.toUpperCase() + '...', 'success');
+
+  try {
+    const response = await fetch(API_BASE + '/exports', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        format: format,
+        ids: notesToExport.map(function(n) { return n.id; })
+      })
+    });
+    if (!response.ok) throw new Error('HTTP ' + response.status);
+
+    const job = await response.json();
+    const url = API_BASE + '/exports/' + job.id;
+    while (true) {
+      await new Promise(function(resolve) { setTimeout(resolve, EXPORT_POLL_INTERVAL); });
+      const result = await fetch(url);
+      if (result.status === 202) continue;
+      if (!result.ok) throw new Error('HTTP ' + result.status);
+
+      downloadBlob(await result.blob(), notesToExport.length === 1 ? 'note.' + format : 'notes.' + format);
+      showToast('Экспортировано ' + notesToExport.length + ' заметок в ' + format.toUpperCase(), 'success');
+      return;
+    }
+  } catch (error) {
+    console.error('Error exporting notes:', error);
+    if (format === 'pdf') {
+      exportToPdf(await withNoteBodies(notesToExport));
+    } else {
+      showToast('Ошибка экспорта', 'error');
     }
-    content += '-'.repeat(50) + '\n';
-    content += (note.text || 'Нет текста') + '\n\n';
   }
+}
 
-  downloadFile(content, notesToExport.length === 1 ? 'note.txt' : 'notes.txt', 'text/plain');
-  showToast('Экспортировано ' + notesToExport.length + ' заметок в TXT', 'success');
+function downloadBlob(blob, filename) {
+  const link = document.createElement('a');
+  link.href = URL.createObjectURL(blob);
+  link.download = filename;
+  document.body.appendChild(link);
+  link.click();
+  document.body.removeChild(link);
+  URL.revokeObjectURL(link.href);
 }
 
-function exportToJson(notesToExport) {
-  const exportData = notesToExport.map(function(note) {
-    return {
-      headline: note.headline,
-      text: note.text,
-      importance: note.improtance,
-      created_date: note.created_date,
-      change_date: note.change_date
-    };
-  });
+function exportFromServer(format, notesToExport) {
+  // Если выбраны все заметки, список id не передаётся - сервер выгрузит всё сам
+  const allSelected = !nextCursor && notesToExport.length === notes.length;
+  let url = API_BASE + '/notes/export?format=' + format;
+  if (!allSelected) {
+    url += '&ids=' + notesToExport.map(function(n) { return n.id; }).join(',');
+  }
 
-  const content = JSON.stringify(exportData, null, 2);
-  downloadFile(content, notesToExport.length === 1 ? 'note.json' : 'notes.json', 'application/json');
-  showToast('Экспортировано ' + notesToExport.length + ' заметок в JSON', 'success');
+  const link = document.createElement('a');
+  link.href = url;
+  link.download = notesToExport.length === 1 ? 'note.' + format : 'notes.' + format;
+  document.body.appendChild(link);
+  link.click();
+  document.body.removeChild(link);
+  showToast('Экспортировано ' + notesToExport.length + ' заметок в ' + format.toUpperCase(), 'success');
 }
 
 function exportToPdf(notesToExport) {
@@ -853,17 +1202,6 @@ function exportToPdf(notesToExport) {
   showToast('Откройте диалог печати для сохранения PDF', 'success');
 }
 
-function downloadFile(content, filename, mimeType) {
-  const blob = new Blob([content], { type: mimeType + ';charset=utf-8' });
-  const link = document.createElement('a');
-  link.href = URL.createObjectURL(blob);
-  link.download = filename;
-  document.body.appendChild(link);
-  link.click();
-  document.body.removeChild(link);
-  URL.revokeObjectURL(link.href);
-}
-
 function updateStatus(status) {
   if (!statusIndicator) return;
 
@@ -925,6 +1263,12 @@ function escapeHtml(text) {
   return div.innerHTML;
 }
 
+function highlightSnippet(snippet) {
+  return escapeHtml(snippet)
+    .replace(/&lt;mark&gt;/g, '<mark>')
+    .replace(/&lt;\/mark&gt;/g, '</mark>');
+}
+
 function getPreview(text) {
   if (!text) return 'Нет текста';
   if (text.length > 50) return text.substring(0, 50) + '...';